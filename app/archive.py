@@ -0,0 +1,266 @@
+import base64
+import io
+import itertools
+import json
+import os
+import struct
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import zstandard
+
+from app.config import Config
+
+# Dataset archives: page and chunk metadata as JSON lines plus every embedding in one
+# float32 .npy matrix, written and read a batch at a time
+ARCHIVE_VERSION = 1
+MANIFEST = 'manifest.json'
+EMBEDDINGS = 'embeddings.npy'
+
+DATASET_FIELDS = ['name', 'description', 'domainname', 'metatag1name', 'metatag2name', 'chunksize',
+                  'chunkoverlap', 'coarsedimensions', 'coarsequantization', 'rerankfactor', 'status',
+                  'embeddingmodel']
+# Exported columns and how they travel through JSON. Raw HTML stays behind: it belongs to the
+# source's raw store, and cleantext already holds everything chunking needs
+PAGE_FIELDS = {'id': 'uuid', 'url': None, 'normalizedurl': None, 'title': None, 'cleantext': None,
+               'wordcount': None, 'status': None, 'errormessage': None, 'etag': None, 'lastmodified': None,
+               'contenthash': None, 'minhash': 'bytes', 'duplicateof': 'uuid',
+               'createdat': 'datetime', 'updatedat': 'datetime'}
+CHUNK_FIELDS = {'id': 'uuid', 'pageid': 'uuid', 'text': None, 'summary': None, 'contextretrieval': None,
+                'domainmeta1': None, 'domainmeta2': None, 'tokencount': None, 'contenthash': None,
+                'minhash': 'bytes', 'canonicalid': 'uuid', 'status': None, 'createdat': 'datetime'}
+# COPY columns on import; duplicateof/canonicalid are filled in afterwards, once their targets exist
+PAGE_IMPORT_COLUMNS = ['id', 'datasetid', 'url', 'normalizedurl', 'title', 'cleantext', 'wordcount',
+                       'status', 'errormessage', 'etag', 'lastmodified', 'contenthash', 'minhash',
+                       'createdat', 'updatedat', 'nextattemptat']
+CHUNK_IMPORT_COLUMNS = ['id', 'pageid', 'datasetid', 'text', 'summary', 'contextretrieval',
+                        'domainmeta1', 'domainmeta2', 'embedding', 'tokencount', 'contenthash',
+                        'minhash', 'status', 'createdat']
+LINK_FIELDS = {'page': 'duplicateof', 'chunk': 'canonicalid'}
+
+_VECTOR_HEADER = struct.Struct('>HH')
+
+
+def remap_id(namespace: uuid.UUID, value: Optional[str]) -> Optional[uuid.UUID]:
+    # Imported rows get fresh ids derived from the new dataset id, so a dataset can be restored
+    # next to its original and references resolve without an id map
+    return uuid.uuid5(namespace, value) if value else None
+
+
+def _encode(row, fields: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    record = {}
+    for name, kind in fields.items():
+        value = row[name]
+        if value is not None and kind == 'uuid':
+            value = str(value)
+        elif value is not None and kind == 'datetime':
+            value = value.isoformat()
+        elif value is not None and kind == 'bytes':
+            value = base64.b64encode(value).decode('ascii')
+        record[name] = value
+    return record
+
+
+def _decode(record: Dict[str, Any], fields: Dict[str, Optional[str]]) -> Dict[str, Any]:
+    row = dict(record)
+    for name, kind in fields.items():
+        value = row.get(name)
+        if value is not None and kind == 'datetime':
+            row[name] = datetime.fromisoformat(value)
+        elif value is not None and kind == 'bytes':
+            row[name] = base64.b64decode(value)
+    return row
+
+
+def _open_text(path: str, mode: str, level: Optional[int] = None):
+    # *.zst files go through a streaming zstd frame, so neither side holds the whole file
+    if not path.endswith('.zst'):
+        return open(path, mode, encoding='utf-8')
+    if mode == 'w':
+        raw = zstandard.ZstdCompressor(level=level or Config.RAW_STORE_LEVEL).stream_writer(open(path, 'wb'))
+    else:
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+    return io.TextIOWrapper(raw, encoding='utf-8')
+
+
+class ArchiveWriter:
+    """Writes one dataset archive. The manifest goes last, so a directory without one
+    is an interrupted export."""
+
+    def __init__(self, directory: str, compress: bool = True):
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, MANIFEST)):
+            raise FileExistsError(f"{directory} already holds an archive")
+        self.directory = directory
+        suffix = '.jsonl.zst' if compress else '.jsonl'
+        self.files = {'pages': f'pages{suffix}', 'chunks': f'chunks{suffix}', 'embeddings': EMBEDDINGS}
+        self.pages = _open_text(os.path.join(directory, self.files['pages']), 'w')
+        self.chunks = _open_text(os.path.join(directory, self.files['chunks']), 'w')
+        self.embeddings = None
+        self.counts = {'pages': 0, 'chunks': 0, 'embeddings': 0}
+        self.shape = (0, 0)
+
+    def begin_embeddings(self, rows: int, dimensions: int):
+        # .npy needs its shape up front; the export counts rows in the snapshot it then reads
+        self.shape = (rows, dimensions)
+        self.embeddings = open(os.path.join(self.directory, EMBEDDINGS), 'wb')
+        np.lib.format.write_array_header_1_0(
+            self.embeddings, {'descr': '<f4', 'fortran_order': False, 'shape': self.shape})
+
+    def write_pages(self, rows: List):
+        self.pages.writelines(json.dumps(_encode(row, PAGE_FIELDS), ensure_ascii=False) + '\n' for row in rows)
+        self.counts['pages'] += len(rows)
+
+    def write_chunks(self, rows: List):
+        # rows carry the embedding in pgvector wire format; one byteswap per batch turns
+        # them into little-endian matrix rows
+        payloads = []
+        lines = []
+        for row in rows:
+            record = _encode(row, CHUNK_FIELDS)
+            payload = row['embedding']
+            if payload is None:
+                record['embedding'] = None
+            else:
+                record['embedding'] = self.counts['embeddings'] + len(payloads)
+                payloads.append(payload[_VECTOR_HEADER.size:])
+            lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+        if payloads:
+            block = np.frombuffer(b''.join(payloads), dtype='>f4').astype('<f4')
+            if block.size != len(payloads) * self.shape[1]:
+                raise ValueError("Embedding dimensions differ within the dataset")
+            self.embeddings.write(block.tobytes())
+        self.chunks.writelines(lines)
+        self.counts['chunks'] += len(rows)
+        self.counts['embeddings'] += len(payloads)
+
+    def abort(self):
+        # Leaves the partial files for inspection; without a manifest no reader accepts them
+        self.pages.close()
+        self.chunks.close()
+        if self.embeddings is not None:
+            self.embeddings.close()
+
+    def close(self, dataset, source_id: str):
+        self.abort()
+        if self.counts['embeddings'] != self.shape[0]:
+            raise ValueError(f"Expected {self.shape[0]} embeddings, wrote {self.counts['embeddings']}")
+        manifest = {
+            'version': ARCHIVE_VERSION,
+            'source_id': source_id,
+            'exported_at': datetime.now(timezone.utc).isoformat(),
+            'dataset': {name: dataset[name] for name in DATASET_FIELDS},
+            'files': self.files if self.embeddings is not None else {**self.files, 'embeddings': None},
+            'counts': self.counts,
+            'dimensions': self.shape[1],
+        }
+        with open(os.path.join(self.directory, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+class ArchiveReader:
+    """Reads an archive back as COPY-ready tuples under a new dataset id.
+
+    Embeddings are memory-mapped and converted one batch at a time. With a hasher,
+    LSH bands of canonical rows are recomputed from the stored MinHash signatures;
+    signatures of another size are dropped and left to scripts/dedup_dataset.py.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != ARCHIVE_VERSION:
+            raise ValueError(f"Unsupported archive version: {self.manifest.get('version')}")
+        self.dataset = self.manifest['dataset']
+        self.counts = self.manifest['counts']
+        self.dimensions = self.manifest['dimensions']
+
+    def _records(self, kind: str) -> Iterator[Dict[str, Any]]:
+        with _open_text(os.path.join(self.directory, self.manifest['files'][kind]), 'r') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def _embeddings(self) -> Optional[np.ndarray]:
+        name = self.manifest['files'].get('embeddings')
+        if not name:
+            return None
+        matrix = np.load(os.path.join(self.directory, name), mmap_mode='r')
+        if matrix.shape != (self.counts['embeddings'], self.dimensions):
+            raise ValueError(f"{name} has shape {matrix.shape}, the manifest says "
+                             f"{(self.counts['embeddings'], self.dimensions)}")
+        return matrix
+
+    @staticmethod
+    def _signature(row: Dict[str, Any], link: str, hasher) -> Tuple[Optional[bytes], List[tuple]]:
+        minhash = row.get('minhash')
+        if minhash is None or hasher is None or len(minhash) != hasher.num_perm * 4:
+            return None, []
+        return minhash, ([] if row.get(link) else hasher.band_keys(minhash))
+
+    def pages(self, dataset_id: uuid.UUID, batch_size: int, hasher=None) -> Iterator[Tuple[List[tuple], List[tuple]]]:
+        # Batches of (page records, (page id, (band, bucket)) pairs)
+        now = datetime.now(timezone.utc)
+        records = self._records('pages')
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                return
+            rows, bands = [], []
+            for record in batch:
+                row = _decode(record, PAGE_FIELDS)
+                page_id = remap_id(dataset_id, row['id'])
+                minhash, keys = self._signature(row, 'duplicateof', hasher)
+                # Leases do not survive the move: pages in flight go back to the queue
+                status = 'pending' if row['status'] == 'processing' else row['status']
+                rows.append((
+                    page_id, dataset_id, row['url'], row['normalizedurl'], row['title'], row['cleantext'],
+                    row['wordcount'], status, row['errormessage'], row['etag'], row['lastmodified'],
+                    row['contenthash'], minhash, row['createdat'], row['updatedat'],
+                    now if status == 'pending' else None
+                ))
+                bands.extend((page_id, key) for key in keys)
+            yield rows, bands
+
+    def chunks(self, dataset_id: uuid.UUID, batch_size: int, hasher=None) -> Iterator[Tuple[List[tuple], List[tuple]]]:
+        # Batches of (chunk records, (chunk id, (band, bucket)) pairs); embeddings stay in
+        # pgvector wire format for a raw codec connection
+        matrix = self._embeddings()
+        prefix = _VECTOR_HEADER.pack(self.dimensions, 0)
+        records = self._records('chunks')
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                return
+            positions = [record['embedding'] for record in batch if record['embedding'] is not None]
+            # Embedding rows are numbered in chunk order, so each batch reads one contiguous block
+            block = (np.ascontiguousarray(matrix[positions[0]:positions[-1] + 1], dtype='>f4')
+                     if positions else None)
+            rows, bands = [], []
+            for record in batch:
+                row = _decode(record, CHUNK_FIELDS)
+                chunk_id = remap_id(dataset_id, row['id'])
+                position = row['embedding']
+                embedding = None if position is None else prefix + block[position - positions[0]].tobytes()
+                minhash, keys = self._signature(row, 'canonicalid', hasher)
+                # An enrichment claim is meaningless in the new database
+                status = 'created' if row['status'] == 'enriching' else row['status']
+                rows.append((
+                    chunk_id, remap_id(dataset_id, row['pageid']), dataset_id, row['text'], row['summary'],
+                    row['contextretrieval'], row['domainmeta1'], row['domainmeta2'], embedding,
+                    row['tokencount'], row['contenthash'], minhash, status, row['createdat']
+                ))
+                bands.extend((chunk_id, key) for key in keys)
+            yield rows, bands
+
+    def links(self, kind: str, dataset_id: uuid.UUID, batch_size: int) -> Iterator[List[tuple]]:
+        # Batches of (id, duplicateof/canonicalid) for a second pass over pages or chunks
+        field = LINK_FIELDS[kind]
+        records = (record for record in self._records(f'{kind}s') if record.get(field))
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                return
+            yield [(remap_id(dataset_id, record['id']), remap_id(dataset_id, record[field])) for record in batch]
@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -5,6 +6,7 @@ load_dotenv()
 
 class Config:
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # None = api.openai.com; set for proxies and the benchmark stub
     DATABASE_URL = os.getenv('DATABASE_URL')
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     
@@ -15,7 +17,131 @@ class Config:
     # OpenAI settings
     EMBEDDING_MODEL = "text-embedding-3-small"
     EMBEDDING_DIMENSIONS = 1536
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '256'))  # inputs per request
+    EMBEDDING_BATCH_TOKENS = int(os.getenv('EMBEDDING_BATCH_TOKENS', '200000'))  # token budget per request
+    OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', '10'))
+    OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '8'))
+    # Account quota per model; OPENAI_RATE_LIMITS overrides, e.g. {"gpt-3.5-turbo": {"rpm": 3500, "tpm": 160000}}
+    OPENAI_DEFAULT_RPM = float(os.getenv('OPENAI_DEFAULT_RPM', '3000'))
+    OPENAI_DEFAULT_TPM = float(os.getenv('OPENAI_DEFAULT_TPM', '1000000'))
+    OPENAI_RATE_LIMITS = json.loads(os.getenv('OPENAI_RATE_LIMITS', '{}'))
     
     # Processing settings
     MAX_CONCURRENT_REQUESTS = 5
     REQUEST_TIMEOUT = 30
+    
+    # Scraper: shared connection pool and per-domain politeness
+    SCRAPER_USER_AGENT = os.getenv('SCRAPER_USER_AGENT', 'Mozilla/5.0 (compatible; StrageBot/1.0)')
+    SCRAPER_MAX_CONNECTIONS = int(os.getenv('SCRAPER_MAX_CONNECTIONS', '100'))
+    SCRAPER_MAX_PER_HOST = int(os.getenv('SCRAPER_MAX_PER_HOST', '4'))
+    SCRAPER_HOST_RATE = float(os.getenv('SCRAPER_HOST_RATE', '2'))  # requests per second per domain
+    SCRAPER_DNS_TTL = int(os.getenv('SCRAPER_DNS_TTL', '300'))
+    SCRAPER_MAX_RETRIES = int(os.getenv('SCRAPER_MAX_RETRIES', '3'))
+    SCRAPER_BACKOFF_BASE = float(os.getenv('SCRAPER_BACKOFF_BASE', '1'))
+    SCRAPER_MAX_RETRY_AFTER = float(os.getenv('SCRAPER_MAX_RETRY_AFTER', '120'))
+    # Bodies are streamed into one buffer and abandoned past this size (bounds memory per fetch)
+    SCRAPER_MAX_BYTES = int(os.getenv('SCRAPER_MAX_BYTES', str(10 * 1024 * 1024)))
+    # Anything else is refused from the headers, before the body is downloaded
+    SCRAPER_CONTENT_TYPES = [t.strip() for t in os.getenv('SCRAPER_CONTENT_TYPES', 'text/html,application/xhtml+xml').split(',')]
+    # Used when neither the headers nor <meta charset> name an encoding and the body is not UTF-8
+    SCRAPER_FALLBACK_ENCODING = os.getenv('SCRAPER_FALLBACK_ENCODING', 'cp1251')
+    # Per-domain overrides, e.g. {"example.com": {"concurrency": 2, "rate": 0.5}}
+    SCRAPER_DOMAIN_LIMITS = json.loads(os.getenv('SCRAPER_DOMAIN_LIMITS', '{}'))
+    
+    # HTML extraction runs off the event loop: 'process' pool or 'thread' pool
+    EXTRACTION_EXECUTOR = os.getenv('EXTRACTION_EXECUTOR', 'process')
+    EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', str(os.cpu_count() or 2)))
+    
+    # Chunk enrichment: 'inline' during ingestion or 'deferred' to the enrichment worker
+    ENRICHMENT_MODE = os.getenv('ENRICHMENT_MODE', 'inline')
+    ENRICHMENT_CONCURRENCY = int(os.getenv('ENRICHMENT_CONCURRENCY', '8'))
+    ENRICHMENT_BATCH_SIZE = int(os.getenv('ENRICHMENT_BATCH_SIZE', '100'))
+    
+    # Embedding/enrichment cache: none, memory or sqlite
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+    CACHE_PATH = os.getenv('CACHE_PATH', '.cache/openai_cache.sqlite3')
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+    
+    # Raw HTML: 'postgres' (zstd bytea in smart_page_raw), 'blob' (zstd files in RAW_STORE_DIR)
+    # or 'inline' (legacy uncompressed smart_pages.rawhtml)
+    RAW_STORE = os.getenv('RAW_STORE', 'postgres')
+    RAW_STORE_DIR = os.getenv('RAW_STORE_DIR', 'raw_html')
+    RAW_STORE_LEVEL = int(os.getenv('RAW_STORE_LEVEL', '3'))  # zstd level
+    # Garbage collection keeps unreferenced content stored or reused within this many seconds
+    RAW_STORE_GC_GRACE = float(os.getenv('RAW_STORE_GC_GRACE', '3600'))
+    
+    # Approximate index query knobs (unset keeps the server defaults)
+    HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', '0')) or None
+    IVFFLAT_PROBES = int(os.getenv('IVFFLAT_PROBES', '0')) or None
+    
+    # Hybrid search: candidates taken from each side before reciprocal-rank fusion, and the RRF constant
+    HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '50'))
+    HYBRID_RRF_K = int(os.getenv('HYBRID_RRF_K', '60'))
+    
+    # Local memory-mapped vector index (empty disables it)
+    LOCAL_INDEX_DIR = os.getenv('LOCAL_INDEX_DIR', '')
+    LOCAL_INDEX_DTYPE = os.getenv('LOCAL_INDEX_DTYPE', 'float32')
+    # Each sync re-reads this far behind its watermark for chunks that committed late
+    LOCAL_INDEX_RESCAN_SECONDS = float(os.getenv('LOCAL_INDEX_RESCAN_SECONDS', '600'))
+    # Share of deleted rows at which a sync rebuilds the index instead of masking them
+    LOCAL_INDEX_REBUILD_RATIO = float(os.getenv('LOCAL_INDEX_REBUILD_RATIO', '0.2'))
+    
+    # Search server
+    SEARCH_SERVER_HOST = os.getenv('SEARCH_SERVER_HOST', '0.0.0.0')
+    SEARCH_SERVER_PORT = int(os.getenv('SEARCH_SERVER_PORT', '8080'))
+    SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '10000'))  # cached query embeddings
+    SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '3600'))  # seconds
+    SEARCH_BATCH_SIZE = int(os.getenv('SEARCH_BATCH_SIZE', '64'))  # queries per embeddings request
+    SEARCH_BATCH_WAIT_MS = float(os.getenv('SEARCH_BATCH_WAIT_MS', '5'))
+    SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', '100'))  # larger limits are clamped
+    
+    # Prometheus endpoint for long runs (process_urls --metrics-port, 0 disables)
+    METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+    
+    # Near-duplicate elimination before embedding, opt-in: 'skip' drops duplicate chunks,
+    # 'link' stores them without an embedding, pointing at the canonical chunk; 'off' disables
+    DEDUP_MODE = os.getenv('DEDUP_MODE', 'off')
+    DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.9'))  # estimated Jaccard of word shingles
+    DEDUP_SHINGLE_SIZE = int(os.getenv('DEDUP_SHINGLE_SIZE', '5'))  # words
+    # Changing these makes stored signatures incomparable; re-run scripts/dedup_dataset.py --rebuild
+    DEDUP_NUM_PERM = int(os.getenv('DEDUP_NUM_PERM', '64'))
+    DEDUP_BANDS = int(os.getenv('DEDUP_BANDS', '8'))
+    DEDUP_MAX_CANDIDATES = int(os.getenv('DEDUP_MAX_CANDIDATES', '2000'))  # bucket rows read per lookup
+    
+    # Site crawler (scripts/crawl_site.py)
+    CRAWL_MAX_PAGES = int(os.getenv('CRAWL_MAX_PAGES', '0'))  # 0 = no limit
+    CRAWL_MAX_DEPTH = int(os.getenv('CRAWL_MAX_DEPTH', '5'))  # link hops from a seed or sitemap entry
+    CRAWL_FRONTIER_SIZE = int(os.getenv('CRAWL_FRONTIER_SIZE', '100000'))  # URLs waiting to be fetched
+    CRAWL_EXPECTED_URLS = int(os.getenv('CRAWL_EXPECTED_URLS', '1000000'))  # dedup sizing without a page limit
+    CRAWL_EXACT_DEDUP_LIMIT = int(os.getenv('CRAWL_EXACT_DEDUP_LIMIT', '2000000'))  # above this, a Bloom filter
+    CRAWL_BLOOM_ERROR_RATE = float(os.getenv('CRAWL_BLOOM_ERROR_RATE', '0.0001'))
+    CRAWL_SITEMAP_MAX_BYTES = int(os.getenv('CRAWL_SITEMAP_MAX_BYTES', str(100 * 1024 * 1024)))  # uncompressed
+    
+    # Dataset export/import (scripts/export_dataset.py, scripts/import_dataset.py): rows per cursor fetch and COPY
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '2000'))
+    
+    # Re-chunk / re-embed into a new chunk version (scripts/rechunk_dataset.py), throttled next to live search
+    RECHUNK_BATCH_PAGES = int(os.getenv('RECHUNK_BATCH_PAGES', '50'))
+    RECHUNK_PAGES_PER_SECOND = float(os.getenv('RECHUNK_PAGES_PER_SECOND', '20'))  # 0 = no limit
+    RECHUNK_API_SHARE = float(os.getenv('RECHUNK_API_SHARE', '0.5'))  # part of each model's RPM/TPM/concurrency
+    RECHUNK_GC_BATCH = int(os.getenv('RECHUNK_GC_BATCH', '5000'))  # old chunks deleted per statement
+    RECHUNK_GC_PAUSE = float(os.getenv('RECHUNK_GC_PAUSE', '0.5'))  # seconds between deletes
+    
+    # Page job queue (scripts/ingest_worker.py)
+    JOB_BATCH_SIZE = int(os.getenv('JOB_BATCH_SIZE', '50'))  # pages claimed at a time
+    JOB_MAX_IN_FLIGHT = int(os.getenv('JOB_MAX_IN_FLIGHT', '200'))  # claimed pages a worker processes at once
+    JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+    JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', '60'))
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+    JOB_BACKOFF_BASE = float(os.getenv('JOB_BACKOFF_BASE', '30'))  # seconds, doubled per attempt
+    JOB_BACKOFF_MAX = float(os.getenv('JOB_BACKOFF_MAX', '3600'))
+    
+    # Ingestion pipeline settings (workers per stage and queue bound between stages)
+    PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '20'))
+    PIPELINE_SCRAPE_WORKERS = int(os.getenv('PIPELINE_SCRAPE_WORKERS', '32'))
+    PIPELINE_EXTRACT_WORKERS = int(os.getenv('PIPELINE_EXTRACT_WORKERS', str(EXTRACTION_WORKERS)))
+    PIPELINE_CHUNK_WORKERS = int(os.getenv('PIPELINE_CHUNK_WORKERS', '1'))
+    PIPELINE_DEDUP_WORKERS = int(os.getenv('PIPELINE_DEDUP_WORKERS', '2'))
+    PIPELINE_EMBED_WORKERS = int(os.getenv('PIPELINE_EMBED_WORKERS', '4'))
+    PIPELINE_PERSIST_WORKERS = int(os.getenv('PIPELINE_PERSIST_WORKERS', '2'))
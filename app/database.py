@@ -1,15 +1,75 @@
 import asyncpg
 import asyncio
+import time
+from contextlib import asynccontextmanager
 from typing import List, Dict, Any, Optional
 import uuid
+from datetime import datetime
+from app.archive import (ArchiveReader, ArchiveWriter, CHUNK_FIELDS, CHUNK_IMPORT_COLUMNS,
+                         DATASET_FIELDS, LINK_FIELDS, PAGE_FIELDS, PAGE_IMPORT_COLUMNS)
 from app.config import Config
+from app.metrics import REGISTRY
+from app.models import Page
+from app.rawstore import RawContentStore, create_raw_store
+from app.schema import QUANTIZATIONS, coarse_expression
+from app.vectors import register_vector_codecs
+
+DB_QUERY_SECONDS = REGISTRY.histogram("db_query_seconds", "Postgres statement latency", ["statement"])
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram("db_pool_wait_seconds", "Time waiting for a pooled connection")
+DB_POOL_CONNECTIONS = REGISTRY.gauge("db_pool_connections", "Pool connections by state", ["state"])
+
+CHUNK_COLUMNS = ['id', 'pageid', 'text', 'summary', 'contextretrieval',
+                 'domainmeta1', 'domainmeta2', 'embedding', 'tokencount', 'contenthash',
+                 'minhash', 'canonicalid', 'status', 'version']
+BAND_COLUMNS = {'page': ['datasetid', 'band', 'bucket', 'pageid'],
+                'chunk': ['datasetid', 'band', 'bucket', 'chunkid']}
+# Dataset search settings change rarely; long-running searchers re-read them this often
+SEARCH_SETTINGS_TTL = 60.0
+# pgvector rejects a larger hnsw.ef_search
+EF_SEARCH_MAX = 1000
+# Everything but rawhtml, which is fetched only when asked for
+PAGE_COLUMNS = ['id', 'datasetid', 'url', 'title', 'rawhash', 'cleantext', 'wordcount', 'status',
+                'errormessage', 'normalizedurl', 'etag', 'lastmodified', 'contenthash', 'duplicateof',
+                'createdat', 'updatedat']
+# Active chunk version of the chunk's own dataset, for queries that span datasets
+ACTIVE_VERSION = "c.version = (SELECT d.chunkversion FROM smart_datasets d WHERE d.id = c.datasetid)"
+
+
+class ChunkVersionChanged(Exception):
+    """The dataset switched chunk versions after the writer read its chunking settings."""
+
 
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, raw_store: RawContentStore = None):
         self.pool = None
+        # Where raw HTML goes; None keeps it inline in smart_pages.rawhtml
+        self.raw_store = raw_store if raw_store is not None else create_raw_store()
+        self.search_settings: Dict[str, tuple] = {}
+        # Statements sent to the server, for benchmarks (COPY is counted by hand)
+        self.round_trips = 0
     
     async def connect(self):
-        self.pool = await asyncpg.create_pool(Config.DATABASE_URL)
+        self.pool = await asyncpg.create_pool(Config.DATABASE_URL, init=self._init_connection)
+        pool = self.pool
+        DB_POOL_CONNECTIONS.labels(state='open').set_function(pool.get_size)
+        DB_POOL_CONNECTIONS.labels(state='idle').set_function(pool.get_idle_size)
+    
+    async def _init_connection(self, conn):
+        await register_vector_codecs(conn)
+        conn.add_query_logger(self._count_query)
+    
+    def _count_query(self, record):
+        self.round_trips += 1
+        statement = record.query.split(None, 1)[0].upper() if record.query.strip() else ''
+        DB_QUERY_SECONDS.labels(statement=statement).observe(record.elapsed)
+    
+    @asynccontextmanager
+    async def acquire(self):
+        # pool.acquire() that records how long callers queue for a connection
+        started = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+            yield conn
     
     async def close(self):
         if self.pool:
@@ -19,7 +79,7 @@ class DatabaseManager:
                            domainname: str = None, metatag1name: str = None, 
                            metatag2name: str = None, chunksize: int = 500, 
                            chunkoverlap: int = 50) -> str:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             dataset_id = await conn.fetchval("""
                 INSERT INTO smart_datasets (name, description, domainname, 
                                           metatag1name, metatag2name, chunksize, chunkoverlap)
@@ -28,67 +88,1009 @@ class DatabaseManager:
             """, name, description, domainname, metatag1name, metatag2name, chunksize, chunkoverlap)
             return str(dataset_id)
     
+    async def store_raw_html(self, conn, rawhtml: Optional[str]) -> tuple:
+        # (value for smart_pages.rawhtml, value for smart_pages.rawhash)
+        if self.raw_store is None or not rawhtml:
+            return rawhtml, None
+        return None, await self.raw_store.put(conn, rawhtml)
+    
     async def add_page(self, dataset_id: str, url: str, title: str = None, 
                       rawhtml: str = None, cleantext: str = None, 
                       wordcount: int = None) -> str:
-        async with self.pool.acquire() as conn:
-            page_id = await conn.fetchval("""
-                INSERT INTO smart_pages (datasetid, url, title, rawhtml, cleantext, wordcount)
-                VALUES ($1, $2, $3, $4, $5, $6)
-                RETURNING id
-            """, uuid.UUID(dataset_id), url, title, rawhtml, cleantext, wordcount)
-            return str(page_id)
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                rawhtml, rawhash = await self.store_raw_html(conn, rawhtml)
+                page_id = await conn.fetchval("""
+                    INSERT INTO smart_pages (datasetid, url, title, rawhtml, rawhash, cleantext, wordcount)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    RETURNING id
+                """, uuid.UUID(dataset_id), url, title, rawhtml, rawhash, cleantext, wordcount)
+                return str(page_id)
     
     async def add_chunk(self, page_id: str, text: str, summary: str = None,
                        contextretrieval: str = None, domainmeta1: str = None,
                        domainmeta2: str = None, embedding: List[float] = None,
                        tokencount: int = None) -> str:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             chunk_id = await conn.fetchval("""
                 INSERT INTO smart_chunks (pageid, text, summary, contextretrieval,
-                                        domainmeta1, domainmeta2, embedding, tokencount)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                                        domainmeta1, domainmeta2, embedding, tokencount, version)
+                SELECT $1, $2, $3, $4, $5, $6, $7, $8, d.chunkversion
+                FROM smart_pages p JOIN smart_datasets d ON d.id = p.datasetid
+                WHERE p.id = $1
                 RETURNING id
             """, uuid.UUID(page_id), text, summary, contextretrieval, 
                 domainmeta1, domainmeta2, embedding, tokencount)
+            if chunk_id is None:
+                # INSERT ... SELECT inserts nothing for an unknown page instead of failing the FK
+                raise ValueError(f"Page {page_id} not found")
             return str(chunk_id)
     
+    async def add_chunks_bulk(self, page_id: str, chunks: List[Dict[str, Any]], conn=None,
+                              dataset_id: str = None, version: int = None) -> List[str]:
+        # version None: the dataset's active chunk version
+        if not chunks:
+            return []
+        if conn is None:
+            async with self.acquire() as conn:
+                return await self.add_chunks_bulk(page_id, chunks, conn=conn, dataset_id=dataset_id,
+                                                  version=version)
+        
+        page_uuid = uuid.UUID(page_id)
+        if version is None:
+            version = await conn.fetchval("""
+                SELECT d.chunkversion FROM smart_pages p JOIN smart_datasets d ON d.id = p.datasetid
+                WHERE p.id = $1
+            """, page_uuid)
+        chunk_ids = await self._copy_chunks(conn, dataset_id, [(page_uuid, chunks)], version)
+        return [str(chunk_id) for chunk_id in chunk_ids]
+    
+    async def _copy_chunks(self, conn, dataset_id: Optional[str], pages: List[tuple], version: int) -> List[uuid.UUID]:
+        # pages: (page uuid, chunks); one COPY for all of them, then one for their LSH bands
+        chunk_ids, records, bands = [], [], []
+        for page_uuid, chunks in pages:
+            for chunk in chunks:
+                chunk_id = uuid.uuid4()
+                chunk_ids.append(chunk_id)
+                records.append((
+                    chunk_id, page_uuid, chunk['text'], chunk.get('summary'), chunk.get('contextretrieval'),
+                    chunk.get('domainmeta1'), chunk.get('domainmeta2'), chunk.get('embedding'),
+                    chunk.get('tokencount'), chunk.get('contenthash'), chunk.get('minhash'),
+                    uuid.UUID(chunk['canonicalid']) if chunk.get('canonicalid') else None,
+                    chunk.get('status', 'created'), version
+                ))
+                bands.extend((chunk_id, band) for band in chunk.get('bands') or ())
+        if not records:
+            return []
+        with DB_QUERY_SECONDS.labels(statement='COPY').time():
+            await conn.copy_records_to_table('smart_chunks', records=records, columns=CHUNK_COLUMNS)
+        self.round_trips += 1
+        
+        if bands:
+            if dataset_id is None:
+                dataset_id = str(await conn.fetchval("SELECT datasetid FROM smart_pages WHERE id = $1", pages[0][0]))
+            await self._add_bands(conn, 'chunk', dataset_id, bands)
+        return chunk_ids
+    
+    async def _add_bands(self, conn, kind: str, dataset_id: str, bands: List[tuple]):
+        # bands: (owner uuid, (band, bucket)) for canonical pages or chunks
+        dataset_uuid = uuid.UUID(dataset_id)
+        records = [(dataset_uuid, band, bucket, owner) for owner, (band, bucket) in bands]
+        with DB_QUERY_SECONDS.labels(statement='COPY').time():
+            await conn.copy_records_to_table(f'smart_{kind}_bands', records=records, columns=BAND_COLUMNS[kind])
+        self.round_trips += 1
+    
+    async def find_near_duplicates(self, kind: str, dataset_id: str, keys: List[tuple],
+                                   exclude_page_id: str = None,
+                                   limit: int = Config.DEDUP_MAX_CANDIDATES,
+                                   version: int = None, exclude_page_ids: List[str] = None) -> List[tuple]:
+        # (band, bucket, id, minhash) of canonical pages/chunks sharing any of the (band, bucket) keys;
+        # rows of the excluded pages are skipped, a recrawled page must not match its own old version.
+        # Chunks come from the given chunk version, by default the active one
+        if not keys:
+            return []
+        excluded = ([exclude_page_id] if exclude_page_id else []) + list(exclude_page_ids or ())
+        args = [uuid.UUID(dataset_id), [band for band, _ in keys], [bucket for _, bucket in keys],
+                [uuid.UUID(page_id) for page_id in excluded] or None, limit]
+        if kind == 'page':
+            join, owner = "JOIN smart_pages x ON x.id = b.pageid", "x.id"
+        else:
+            join, owner = ("JOIN smart_chunks x ON x.id = b.chunkid AND x.version = "
+                           "COALESCE($6::integer, (SELECT chunkversion FROM smart_datasets WHERE id = $1))"), "x.pageid"
+            args.append(version)
+        async with self.acquire() as conn:
+            rows = await conn.fetch(f"""
+                SELECT b.band, b.bucket, x.id, x.minhash
+                FROM smart_{kind}_bands b
+                {join}
+                WHERE b.datasetid = $1
+                  AND (b.band, b.bucket) IN (SELECT * FROM unnest($2::smallint[], $3::bigint[]))
+                  AND ($4::uuid[] IS NULL OR {owner} <> ALL($4))
+                LIMIT $5
+            """, *args)
+        return [(row['band'], row['bucket'], str(row['id']), row['minhash']) for row in rows]
+    
+    async def iter_unsigned(self, kind: str, dataset_id: str, prefetch: int = 1000):
+        # (id, text) of canonical pages/chunks stored without a signature, for backfilling
+        table, text = ('smart_pages', 'cleantext') if kind == 'page' else ('smart_chunks', 'text')
+        canonical = 'duplicateof IS NULL' if kind == 'page' else f'canonicalid IS NULL AND {ACTIVE_VERSION}'
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(f"""
+                    SELECT id, {text} AS text FROM {table} c
+                    WHERE datasetid = $1 AND minhash IS NULL AND {canonical} AND {text} IS NOT NULL
+                """, uuid.UUID(dataset_id), prefetch=prefetch):
+                    yield row
+    
+    async def set_signatures(self, kind: str, dataset_id: str, signatures: List[tuple]):
+        # signatures: (id, minhash, [(band, bucket), ...]) of pages or chunks
+        table = 'smart_pages' if kind == 'page' else 'smart_chunks'
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany(f"""
+                    UPDATE {table} SET minhash = $2 WHERE id = $1
+                """, [(uuid.UUID(item_id), minhash) for item_id, minhash, _ in signatures])
+                bands = [(uuid.UUID(item_id), key) for item_id, _, keys in signatures for key in keys]
+                if bands:
+                    await self._add_bands(conn, kind, dataset_id, bands)
+    
+    async def clear_signatures(self, dataset_id: str):
+        # Drops every signature and bucket of the dataset, before a rebuild with new MinHash settings
+        dataset_uuid = uuid.UUID(dataset_id)
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM smart_chunk_bands WHERE datasetid = $1", dataset_uuid)
+                await conn.execute("DELETE FROM smart_page_bands WHERE datasetid = $1", dataset_uuid)
+                await conn.execute("UPDATE smart_chunks SET minhash = NULL WHERE datasetid = $1", dataset_uuid)
+                await conn.execute("UPDATE smart_pages SET minhash = NULL WHERE datasetid = $1", dataset_uuid)
+    
+    async def save_page_with_chunks(self, dataset_id: str, url: str, chunks: List[Dict[str, Any]],
+                                    title: str = None, rawhtml: str = None, cleantext: str = None,
+                                    wordcount: int = None, status: str = 'processed',
+                                    normalizedurl: str = None, etag: str = None,
+                                    lastmodified: str = None, contenthash: str = None,
+                                    minhash: bytes = None, duplicateof: str = None,
+                                    bands: List[tuple] = None, chunk_version: int = None) -> str:
+        # Page row, all of its chunks and the final status in a single transaction.
+        # chunk_version is the version the chunks were made for, checked against the active one
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                rawhtml, rawhash = await self.store_raw_html(conn, rawhtml)
+                row = await conn.fetchrow("""
+                    INSERT INTO smart_pages (datasetid, url, title, rawhtml, rawhash, cleantext, wordcount,
+                                             status, normalizedurl, etag, lastmodified, contenthash,
+                                             minhash, duplicateof, chunkversion)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14,
+                            (SELECT chunkversion FROM smart_datasets WHERE id = $1))
+                    RETURNING id, chunkversion
+                """, uuid.UUID(dataset_id), url, title, rawhtml, rawhash, cleantext, wordcount, status,
+                    normalizedurl or url, etag, lastmodified, contenthash, minhash,
+                    uuid.UUID(duplicateof) if duplicateof else None)
+                page_id, version = row['id'], row['chunkversion']
+                self._check_chunk_version(dataset_id, chunk_version, version)
+                if bands:
+                    await self._add_bands(conn, 'page', dataset_id, [(page_id, key) for key in bands])
+                await self.add_chunks_bulk(str(page_id), chunks, conn=conn, dataset_id=dataset_id, version=version)
+                return str(page_id)
+    
+    @staticmethod
+    def _check_chunk_version(dataset_id, expected: Optional[int], active: int):
+        # The page row write holds off a version switch until commit, so active is final here
+        if expected is not None and expected != active:
+            raise ChunkVersionChanged(f"Dataset {dataset_id} switched to chunk version {active}, "
+                                      f"chunks were made for version {expected}")
+    
+    async def update_page_with_chunks(self, page_id: str, chunks: List[Dict[str, Any]],
+                                      stale_chunk_ids: List[str], title: str = None,
+                                      rawhtml: str = None, cleantext: str = None,
+                                      wordcount: int = None, status: str = 'processed',
+                                      etag: str = None, lastmodified: str = None,
+                                      contenthash: str = None, minhash: bytes = None,
+                                      duplicateof: str = None, bands: List[tuple] = None,
+                                      chunk_version: int = None) -> List[str]:
+        # Recrawl of a changed page: new chunks in, stale chunks out, page row refreshed, atomically
+        page_uuid = uuid.UUID(page_id)
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                rawhtml, rawhash = await self.store_raw_html(conn, rawhtml)
+                row = await conn.fetchrow("""
+                    UPDATE smart_pages p
+                    SET title = $2, rawhtml = $3, rawhash = $4, cleantext = $5, wordcount = $6, status = $7,
+                        etag = $8, lastmodified = $9, contenthash = $10, errormessage = NULL,
+                        minhash = $11, duplicateof = $12, updatedat = NOW(),
+                        chunkversion = (SELECT d.chunkversion FROM smart_datasets d WHERE d.id = p.datasetid)
+                    WHERE p.id = $1
+                    RETURNING p.datasetid, p.chunkversion
+                """, page_uuid, title, rawhtml, rawhash, cleantext, wordcount, status,
+                    etag, lastmodified, contenthash, minhash, uuid.UUID(duplicateof) if duplicateof else None)
+                dataset_id, version = row['datasetid'], row['chunkversion']
+                self._check_chunk_version(dataset_id, chunk_version, version)
+                # Chunks built for any other version are out of date now; a running re-chunk
+                # sees the page's chunkversion drop back and rebuilds it
+                await conn.execute("""
+                    DELETE FROM smart_chunks WHERE pageid = $1 AND version <> $2
+                """, page_uuid, version)
+                await conn.execute("DELETE FROM smart_page_bands WHERE pageid = $1", page_uuid)
+                if bands:
+                    await self._add_bands(conn, 'page', str(dataset_id), [(page_uuid, key) for key in bands])
+                if stale_chunk_ids:
+                    await conn.execute("""
+                        DELETE FROM smart_chunks WHERE id = ANY($1::uuid[])
+                    """, [uuid.UUID(chunk_id) for chunk_id in stale_chunk_ids])
+                return await self.add_chunks_bulk(page_id, chunks, conn=conn, dataset_id=str(dataset_id),
+                                                  version=version)
+    
+    async def get_page(self, page_id: str, include_rawhtml: bool = False) -> Optional[Page]:
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(f"""
+                SELECT {', '.join(PAGE_COLUMNS)} FROM smart_pages WHERE id = $1
+            """, uuid.UUID(page_id))
+        if not row:
+            return None
+        page = Page(**{key: str(value) if isinstance(value, uuid.UUID) else value for key, value in row.items()})
+        if include_rawhtml:
+            page.rawhtml = await self.get_raw_html(page_id)
+        return page
+    
+    async def get_raw_html(self, page_id: str) -> Optional[str]:
+        async with self.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT rawhtml, rawhash FROM smart_pages WHERE id = $1
+            """, uuid.UUID(page_id))
+            if not row:
+                return None
+            if row['rawhash'] and self.raw_store is not None:
+                return await self.raw_store.get(conn, row['rawhash'])
+            return row['rawhtml']
+    
+    async def offload_raw_html(self, batch_size: int = 200) -> int:
+        # Moves legacy inline rawhtml into the raw store, one short transaction per batch
+        if self.raw_store is None:
+            raise ValueError("RAW_STORE is 'inline', nothing to offload to")
+        moved = 0
+        while True:
+            async with self.acquire() as conn:
+                async with conn.transaction():
+                    rows = await conn.fetch("""
+                        SELECT id, rawhtml FROM smart_pages
+                        WHERE rawhtml IS NOT NULL AND rawhtml <> ''
+                        LIMIT $1
+                        FOR UPDATE SKIP LOCKED
+                    """, batch_size)
+                    if not rows:
+                        return moved
+                    updates = [(row['id'], await self.raw_store.put(conn, row['rawhtml'])) for row in rows]
+                    await conn.executemany("""
+                        UPDATE smart_pages SET rawhtml = NULL, rawhash = $2 WHERE id = $1
+                    """, updates)
+            moved += len(rows)
+    
+    async def get_page_by_url(self, dataset_id: str, normalizedurl: str) -> Optional[Dict]:
+        async with self.acquire() as conn:
+            result = await conn.fetchrow("""
+                SELECT id, url, etag, lastmodified, contenthash, status
+                FROM smart_pages
+                WHERE datasetid = $1 AND normalizedurl = $2
+                ORDER BY createdat DESC
+                LIMIT 1
+            """, uuid.UUID(dataset_id), normalizedurl)
+            return dict(result) if result else None
+    
+    async def get_chunk_hashes(self, page_id: str) -> Dict[str, List[str]]:
+        # Every chunk of the page, linked duplicates included, so a recrawl can drop any of them.
+        # Chunks that are neither embedded nor linked are never reused: they fall under None
+        async with self.acquire() as conn:
+            results = await conn.fetch(f"""
+                SELECT c.id,
+                       CASE WHEN c.embedding IS NOT NULL OR c.canonicalid IS NOT NULL THEN c.contenthash END
+                           AS contenthash
+                FROM smart_chunks c
+                WHERE c.pageid = $1 AND {ACTIVE_VERSION}
+            """, uuid.UUID(page_id))
+        hashes = {}
+        for row in results:
+            hashes.setdefault(row['contenthash'], []).append(str(row['id']))
+        return hashes
+    
+    async def touch_page(self, page_id: str, etag: str = None, lastmodified: str = None):
+        # Recrawl found the page unchanged; keep the newest validators
+        async with self.acquire() as conn:
+            await conn.execute("""
+                UPDATE smart_pages
+                SET etag = COALESCE($2, etag), lastmodified = COALESCE($3, lastmodified), updatedat = NOW(),
+                    status = 'processed', errormessage = NULL
+                WHERE id = $1
+            """, uuid.UUID(page_id), etag, lastmodified)
+    
     async def search_similar_chunks(self, query_embedding: List[float], 
-                                  dataset_id: str = None, limit: int = 10) -> List[Dict]:
-        async with self.pool.acquire() as conn:
-            if dataset_id:
-                results = await conn.fetch("""
-                    SELECT c.id, c.text, c.summary, c.contextretrieval,
-                           c.domainmeta1, c.domainmeta2, p.url, p.title,
-                           1 - (c.embedding <=> $1) as similarity
-                    FROM smart_chunks c
-                    JOIN smart_pages p ON c.pageid = p.id
-                    WHERE p.datasetid = $2
-                    ORDER BY c.embedding <=> $1
-                    LIMIT $3
-                """, query_embedding, uuid.UUID(dataset_id), limit)
-            else:
-                results = await conn.fetch("""
-                    SELECT c.id, c.text, c.summary, c.contextretrieval,
-                           c.domainmeta1, c.domainmeta2, p.url, p.title,
-                           1 - (c.embedding <=> $1) as similarity
-                    FROM smart_chunks c
-                    JOIN smart_pages p ON c.pageid = p.id
-                    ORDER BY c.embedding <=> $1
-                    LIMIT $2
-                """, query_embedding, limit)
+                                  dataset_id: str = None, limit: int = 10,
+                                  ef_search: int = Config.HNSW_EF_SEARCH,
+                                  probes: int = Config.IVFFLAT_PROBES,
+                                  chunk_version: int = None) -> List[Dict]:
+        # Rank on smart_chunks alone so an HNSW/IVFFlat index can serve the ORDER BY,
+        # then join pages only for the winners. ef_search/probes trade recall for speed.
+        # chunk_version pins the dataset's version the query was embedded for (default: the active one)
+        coarse = await self.get_search_settings(dataset_id) if dataset_id else None
+        if coarse and coarse['coarsequantization']:
+            # HNSW never returns more than ef_search rows, and ef_search stops at EF_SEARCH_MAX
+            candidates = max(limit, min(limit * max(coarse['rerankfactor'], 1), EF_SEARCH_MAX))
+            ef_search = max(ef_search or 0, candidates)
+        if ef_search:
+            ef_search = min(ef_search, EF_SEARCH_MAX)
+        
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                if ef_search:
+                    await conn.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+                if probes:
+                    await conn.execute(f"SET LOCAL ivfflat.probes = {int(probes)}")
+                
+                if coarse and coarse['coarsequantization']:
+                    results = await self._search_two_phase(conn, query_embedding, dataset_id, limit,
+                                                           candidates, coarse, chunk_version)
+                elif dataset_id:
+                    results = await conn.fetch("""
+                        WITH nearest AS (
+                            SELECT c.id, c.pageid, c.text, c.summary, c.contextretrieval,
+                                   c.domainmeta1, c.domainmeta2, c.embedding <=> $1 AS distance
+                            FROM smart_chunks c
+                            WHERE c.datasetid = $2
+                              AND c.version = COALESCE($4::integer,
+                                                       (SELECT chunkversion FROM smart_datasets WHERE id = $2))
+                            ORDER BY c.embedding <=> $1
+                            LIMIT $3
+                        )
+                        SELECT n.id, n.text, n.summary, n.contextretrieval,
+                               n.domainmeta1, n.domainmeta2, p.url, p.title,
+                               1 - n.distance as similarity
+                        FROM nearest n
+                        JOIN smart_pages p ON n.pageid = p.id
+                        ORDER BY n.distance
+                    """, query_embedding, uuid.UUID(dataset_id), limit, chunk_version)
+                else:
+                    results = await conn.fetch(f"""
+                        WITH nearest AS (
+                            SELECT c.id, c.pageid, c.text, c.summary, c.contextretrieval,
+                                   c.domainmeta1, c.domainmeta2, c.embedding <=> $1 AS distance
+                            FROM smart_chunks c
+                            WHERE {ACTIVE_VERSION}
+                            ORDER BY c.embedding <=> $1
+                            LIMIT $2
+                        )
+                        SELECT n.id, n.text, n.summary, n.contextretrieval,
+                               n.domainmeta1, n.domainmeta2, p.url, p.title,
+                               1 - n.distance as similarity
+                        FROM nearest n
+                        JOIN smart_pages p ON n.pageid = p.id
+                        ORDER BY n.distance
+                    """, query_embedding, limit)
+            
+            return [dict(row) for row in results]
+    
+    async def _search_two_phase(self, conn, query_embedding: List[float], dataset_id: str, limit: int,
+                                candidates: int, coarse: Dict, chunk_version: int = None):
+        # Candidates from the small shortened/quantized index, exact cosine re-ranking on the full vectors
+        dimensions = coarse['coarsedimensions'] or Config.EMBEDDING_DIMENSIONS
+        quantization = coarse['coarsequantization']
+        operator = QUANTIZATIONS[quantization][1]
+        column = coarse_expression('c.embedding', dimensions, quantization)
+        query = coarse_expression('$1::vector', dimensions, quantization)
+        return await conn.fetch(f"""
+            WITH candidates AS (
+                SELECT c.id
+                FROM smart_chunks c
+                WHERE c.datasetid = $2
+                  AND c.version = COALESCE($5::integer, (SELECT chunkversion FROM smart_datasets WHERE id = $2))
+                ORDER BY {column} {operator} {query}
+                LIMIT $4
+            ), nearest AS (
+                SELECT c.id, c.pageid, c.text, c.summary, c.contextretrieval,
+                       c.domainmeta1, c.domainmeta2, c.embedding <=> $1 AS distance
+                FROM smart_chunks c
+                WHERE c.id IN (SELECT id FROM candidates)
+                ORDER BY distance
+                LIMIT $3
+            )
+            SELECT n.id, n.text, n.summary, n.contextretrieval,
+                   n.domainmeta1, n.domainmeta2, p.url, p.title,
+                   1 - n.distance as similarity
+            FROM nearest n
+            JOIN smart_pages p ON n.pageid = p.id
+            ORDER BY n.distance
+        """, query_embedding, uuid.UUID(dataset_id), limit, candidates, chunk_version)
+    
+    async def hybrid_search_chunks(self, query_embedding: List[float], query_text: str,
+                                   dataset_id: str = None, limit: int = 10,
+                                   vector_weight: float = 1.0, text_weight: float = 1.0,
+                                   candidates: int = None, rrf_k: int = Config.HYBRID_RRF_K,
+                                   ef_search: int = Config.HNSW_EF_SEARCH,
+                                   probes: int = Config.IVFFLAT_PROBES,
+                                   chunk_version: int = None) -> List[Dict]:
+        # Vector and full-text candidates, each index-backed and capped, fused by reciprocal rank:
+        # score = sum(weight / (rrf_k + rank)). A zero weight skips that side entirely.
+        candidates = max(candidates or Config.HYBRID_CANDIDATES, limit)
+        coarse = await self.get_search_settings(dataset_id) if dataset_id else None
+        coarse = coarse if coarse and coarse['coarsequantization'] else None
+        coarse_candidates = candidates
+        if coarse:
+            coarse_candidates = max(candidates, min(candidates * max(coarse['rerankfactor'], 1), EF_SEARCH_MAX))
+        ef_search = min(max(ef_search or 0, coarse_candidates), EF_SEARCH_MAX)
+        
+        # $8 (dataset id) and $9 (pinned chunk version) are only bound when filtering;
+        # otherwise only the active chunk version counts
+        if dataset_id:
+            dataset_filter = ("c.datasetid = $8 AND c.version = "
+                              "COALESCE($9::integer, (SELECT chunkversion FROM smart_datasets WHERE id = $8)) AND")
+        else:
+            dataset_filter = f"{ACTIVE_VERSION} AND"
+        if coarse:
+            dimensions = coarse['coarsedimensions'] or Config.EMBEDDING_DIMENSIONS
+            operator = QUANTIZATIONS[coarse['coarsequantization']][1]
+            column = coarse_expression('c.embedding', dimensions, coarse['coarsequantization'])
+            query = coarse_expression('$1::vector', dimensions, coarse['coarsequantization'])
+            vector_source = f"""
+                SELECT c.id, c.embedding <=> $1 AS distance
+                FROM smart_chunks c
+                WHERE c.id IN (
+                    SELECT c.id FROM smart_chunks c
+                    WHERE {dataset_filter} TRUE
+                    ORDER BY {column} {operator} {query}
+                    LIMIT CASE WHEN $5::float8 > 0 THEN {int(coarse_candidates)} ELSE 0 END
+                )
+                ORDER BY distance
+                LIMIT $3
+            """
+        else:
+            vector_source = f"""
+                SELECT c.id, c.embedding <=> $1 AS distance
+                FROM smart_chunks c
+                WHERE {dataset_filter} TRUE
+                ORDER BY c.embedding <=> $1
+                LIMIT CASE WHEN $5::float8 > 0 THEN $3 ELSE 0 END
+            """
+        
+        sql = f"""
+            WITH query AS (
+                SELECT websearch_to_tsquery('russian', $2) || websearch_to_tsquery('simple', $2) AS q
+            ), vector_hits AS (
+                SELECT id, row_number() OVER (ORDER BY distance) AS rank
+                FROM ({vector_source}) v
+            ), text_hits AS (
+                SELECT id, row_number() OVER (ORDER BY score DESC) AS rank
+                FROM (
+                    SELECT c.id, ts_rank_cd(c.searchvector, query.q) AS score
+                    FROM smart_chunks c, query
+                    WHERE {dataset_filter} c.searchvector @@ query.q AND c.canonicalid IS NULL
+                    ORDER BY score DESC
+                    LIMIT CASE WHEN $6::float8 > 0 THEN $3 ELSE 0 END
+                ) t
+            ), fused AS (
+                SELECT id, sum(score) AS score
+                FROM (
+                    SELECT id, $5::float8 / ($7::float8 + rank) AS score FROM vector_hits
+                    UNION ALL
+                    SELECT id, $6::float8 / ($7::float8 + rank) AS score FROM text_hits
+                ) s
+                GROUP BY id
+                ORDER BY score DESC
+                LIMIT $4
+            )
+            SELECT c.id, c.text, c.summary, c.contextretrieval,
+                   c.domainmeta1, c.domainmeta2, p.url, p.title,
+                   1 - (c.embedding <=> $1) AS similarity, f.score
+            FROM fused f
+            JOIN smart_chunks c ON c.id = f.id
+            JOIN smart_pages p ON c.pageid = p.id
+            ORDER BY f.score DESC
+        """
+        params = [query_embedding, query_text, candidates, limit,
+                  float(vector_weight), float(text_weight), float(rrf_k)]
+        if dataset_id:
+            params += [uuid.UUID(dataset_id), chunk_version]
+        
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                if ef_search:
+                    await conn.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
+                if probes:
+                    await conn.execute(f"SET LOCAL ivfflat.probes = {int(probes)}")
+                results = await conn.fetch(sql, *params)
             
             return [dict(row) for row in results]
     
+    async def get_search_settings(self, dataset_id: str) -> Optional[Dict]:
+        cached = self.search_settings.get(dataset_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        async with self.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT coarsedimensions, coarsequantization, rerankfactor, chunkversion, embeddingmodel
+                FROM smart_datasets WHERE id = $1
+            """, uuid.UUID(dataset_id))
+        settings = dict(row) if row else None
+        self.search_settings[dataset_id] = (time.monotonic() + SEARCH_SETTINGS_TTL, settings)
+        return settings
+    
+    async def set_search_settings(self, dataset_id: str, dimensions: Optional[int] = None,
+                                  quantization: Optional[str] = None, rerank_factor: int = 4):
+        # quantization None switches the dataset back to searching full-precision embeddings
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        async with self.acquire() as conn:
+            await conn.execute("""
+                UPDATE smart_datasets
+                SET coarsedimensions = $2, coarsequantization = $3, rerankfactor = $4
+                WHERE id = $1
+            """, uuid.UUID(dataset_id), dimensions, quantization, rerank_factor)
+        self.search_settings.pop(dataset_id, None)
+    
+    async def iter_chunk_embeddings(self, dataset_id: str, after: tuple = None, version: int = None,
+                                    prefetch: int = 4096):
+        # Streams (id, createdat, embedding) in (createdat, id) order through a server-side cursor;
+        # version defaults to the dataset's active one
+        created_after, id_after = after or (datetime.min, uuid.UUID(int=0))
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor("""
+                    SELECT c.id, c.createdat, c.embedding
+                    FROM smart_chunks c
+                    WHERE c.datasetid = $1 AND c.embedding IS NOT NULL
+                      AND c.version = COALESCE($4::integer, (SELECT chunkversion FROM smart_datasets WHERE id = $1))
+                      AND (c.createdat, c.id) > ($2, $3)
+                    ORDER BY c.createdat, c.id
+                """, uuid.UUID(dataset_id), created_after, id_after, version, prefetch=prefetch):
+                    yield row
+    
+    async def iter_chunk_ids(self, dataset_id: str, version: int = None, prefetch: int = 65536):
+        # Streams the ids of a version's embedded chunks; the local index finds its deleted rows with it
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor("""
+                    SELECT c.id FROM smart_chunks c
+                    WHERE c.datasetid = $1 AND c.embedding IS NOT NULL
+                      AND c.version = COALESCE($2::integer, (SELECT chunkversion FROM smart_datasets WHERE id = $1))
+                """, uuid.UUID(dataset_id), version, prefetch=prefetch):
+                    yield row['id']
+    
+    @asynccontextmanager
+    async def raw_vector_connection(self):
+        # A connection of its own, outside the pool, whose vector values are wire-format bytes
+        conn = await asyncpg.connect(Config.DATABASE_URL)
+        try:
+            await register_vector_codecs(conn, raw=True)
+            conn.add_query_logger(self._count_query)
+            yield conn
+        finally:
+            await conn.close()
+    
+    async def _stream_cursor(self, conn, query: str, *args, write, batch_size: int):
+        # Hands each cursor batch to write() in a thread while the next batch is fetched
+        cursor = await conn.cursor(query, *args)
+        writing = None
+        try:
+            while True:
+                rows = await cursor.fetch(batch_size)
+                if writing is not None:
+                    await writing
+                    writing = None
+                if not rows:
+                    return
+                writing = asyncio.ensure_future(asyncio.to_thread(write, rows))
+        finally:
+            if writing is not None:
+                await asyncio.gather(writing, return_exceptions=True)
+    
+    @staticmethod
+    async def _read_ahead(batches):
+        # Iterates a blocking iterator in a thread, one item ahead of the caller
+        done = object()
+        pending = asyncio.ensure_future(asyncio.to_thread(next, batches, done))
+        while True:
+            item = await pending
+            if item is done:
+                return
+            pending = asyncio.ensure_future(asyncio.to_thread(next, batches, done))
+            yield item
+    
+    async def export_dataset(self, dataset_id: str, directory: str, compress: bool = True,
+                             batch_size: int = Config.ARCHIVE_BATCH_SIZE) -> Dict[str, int]:
+        # Pages, the active chunk version and its embeddings from one repeatable-read snapshot, streamed
+        # through server-side cursors; memory stays at about two batches whatever the dataset size
+        dataset_uuid = uuid.UUID(dataset_id)
+        async with self.raw_vector_connection() as conn:
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                dataset = await conn.fetchrow("SELECT * FROM smart_datasets WHERE id = $1", dataset_uuid)
+                if dataset is None:
+                    raise ValueError(f"Dataset {dataset_id} not found")
+                embedded = await conn.fetchrow("""
+                    SELECT count(*) AS rows, min(vector_dims(embedding)) AS dimensions,
+                           max(vector_dims(embedding)) AS widest
+                    FROM smart_chunks WHERE datasetid = $1 AND version = $2 AND embedding IS NOT NULL
+                """, dataset_uuid, dataset['chunkversion'])
+                if embedded['dimensions'] != embedded['widest']:
+                    raise ValueError(f"Dataset {dataset_id} mixes {embedded['dimensions']}- and "
+                                     f"{embedded['widest']}-dimensional embeddings")
+                
+                writer = await asyncio.to_thread(ArchiveWriter, directory, compress)
+                try:
+                    if embedded['rows']:
+                        writer.begin_embeddings(embedded['rows'], embedded['dimensions'])
+                    await self._stream_cursor(conn, f"""
+                        SELECT {', '.join(PAGE_FIELDS)} FROM smart_pages WHERE datasetid = $1
+                    """, dataset_uuid, write=writer.write_pages, batch_size=batch_size)
+                    await self._stream_cursor(conn, f"""
+                        SELECT {', '.join(CHUNK_FIELDS)}, embedding FROM smart_chunks
+                        WHERE datasetid = $1 AND version = $2
+                    """, dataset_uuid, dataset['chunkversion'], write=writer.write_chunks, batch_size=batch_size)
+                except BaseException:
+                    await asyncio.to_thread(writer.abort)
+                    raise
+                await asyncio.to_thread(writer.close, dataset, dataset_id)
+        return writer.counts
+    
+    async def import_dataset(self, directory: str, name: str = None, hasher=None,
+                             batch_size: int = Config.ARCHIVE_BATCH_SIZE) -> str:
+        # Binary COPY into a new dataset, all in one transaction: a failed import leaves nothing.
+        # hasher (a MinHasher) rebuilds the near-duplicate buckets from the stored signatures
+        reader = await asyncio.to_thread(ArchiveReader, directory)
+        dataset_uuid = uuid.uuid4()
+        dataset_id = str(dataset_uuid)
+        settings = dict(reader.dataset, name=name or reader.dataset['name'])
+        
+        async with self.raw_vector_connection() as conn:
+            async with conn.transaction():
+                placeholders = ', '.join(f'${i}' for i in range(2, len(DATASET_FIELDS) + 2))
+                await conn.execute(f"""
+                    INSERT INTO smart_datasets (id, {', '.join(DATASET_FIELDS)}) VALUES ($1, {placeholders})
+                """, dataset_uuid, *(settings.get(field) for field in DATASET_FIELDS))
+                
+                for kind, batches, columns in (
+                    ('page', reader.pages(dataset_uuid, batch_size, hasher), PAGE_IMPORT_COLUMNS),
+                    ('chunk', reader.chunks(dataset_uuid, batch_size, hasher), CHUNK_IMPORT_COLUMNS),
+                ):
+                    async for records, bands in self._read_ahead(batches):
+                        with DB_QUERY_SECONDS.labels(statement='COPY').time():
+                            await conn.copy_records_to_table(f'smart_{kind}s', records=records, columns=columns)
+                        self.round_trips += 1
+                        if bands:
+                            await self._add_bands(conn, kind, dataset_id, bands)
+                
+                # Duplicate links go in once every row they may point at exists
+                for kind, field in LINK_FIELDS.items():
+                    async for links in self._read_ahead(reader.links(kind, dataset_uuid, batch_size)):
+                        await conn.execute(f"""
+                            UPDATE smart_{kind}s x SET {field} = l.target
+                            FROM unnest($1::uuid[], $2::uuid[]) AS l (id, target)
+                            WHERE x.id = l.id
+                        """, [item_id for item_id, _ in links], [target for _, target in links])
+        return dataset_id
+    
+    async def get_chunks_by_ids(self, chunk_ids: List[str]) -> Dict[str, Dict]:
+        async with self.acquire() as conn:
+            results = await conn.fetch("""
+                SELECT c.id, c.text, c.summary, c.contextretrieval,
+                       c.domainmeta1, c.domainmeta2, p.url, p.title
+                FROM smart_chunks c
+                JOIN smart_pages p ON c.pageid = p.id
+                WHERE c.id = ANY($1::uuid[])
+            """, [uuid.UUID(chunk_id) for chunk_id in chunk_ids])
+            return {str(row['id']): dict(row) for row in results}
+    
+    async def claim_unenriched_chunks(self, limit: int, dataset_id: str = None,
+                                      lease_seconds: int = 600) -> List[Dict]:
+        # Claims are leased so chunks held by a crashed worker become claimable again. Linked
+        # duplicates are skipped: search reads the canonical chunk, not them
+        async with self.acquire() as conn:
+            results = await conn.fetch("""
+                UPDATE smart_chunks SET status = 'enriching', enrichclaimedat = NOW()
+                WHERE id IN (
+                    SELECT id FROM smart_chunks
+                    WHERE summary IS NULL AND contextretrieval IS NULL
+                      AND canonicalid IS NULL
+                      AND ($2::uuid IS NULL OR datasetid = $2)
+                      AND (status = 'created'
+                           OR (status = 'enriching' AND enrichclaimedat < NOW() - make_interval(secs => $3)))
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, text
+            """, limit, uuid.UUID(dataset_id) if dataset_id else None, lease_seconds)
+            return [dict(row) for row in results]
+    
+    async def save_chunk_enrichments(self, enrichments: List[Dict[str, Any]]):
+        async with self.acquire() as conn:
+            await conn.executemany("""
+                UPDATE smart_chunks
+                SET summary = $2, contextretrieval = $3, enrichclaimedat = NULL,
+                    status = CASE WHEN $2::text IS NULL AND $3::text IS NULL
+                                  THEN 'enrichment_failed' ELSE 'enriched' END
+                WHERE id = $1
+            """, [(item['id'], item.get('summary'), item.get('contextretrieval')) for item in enrichments])
+    
+    async def enqueue_pages(self, dataset_id: str, urls: List[tuple]) -> int:
+        # urls: (url, normalizedurl) pairs. Known pages are re-queued unless a worker holds them
+        dataset_uuid = uuid.UUID(dataset_id)
+        originals = [url for url, _ in urls]
+        normalized = [normalizedurl for _, normalizedurl in urls]
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                requeued = await conn.fetch("""
+                    UPDATE smart_pages
+                    SET status = 'pending', nextattemptat = NOW(), attempts = 0, errormessage = NULL
+                    WHERE datasetid = $1 AND normalizedurl = ANY($2::text[]) AND status <> 'processing'
+                    RETURNING normalizedurl
+                """, dataset_uuid, normalized)
+                inserted = await conn.fetch("""
+                    INSERT INTO smart_pages (datasetid, url, normalizedurl, status, nextattemptat)
+                    SELECT DISTINCT ON (t.normalizedurl) $1, t.url, t.normalizedurl, 'pending', NOW()
+                    FROM unnest($2::text[], $3::text[]) AS t(url, normalizedurl)
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM smart_pages p
+                        WHERE p.datasetid = $1 AND p.normalizedurl = t.normalizedurl
+                    )
+                    RETURNING id
+                """, dataset_uuid, originals, normalized)
+                return len(requeued) + len(inserted)
+    
+    async def claim_pages(self, limit: int, worker_id: str, dataset_id: str = None,
+                          lease_seconds: int = 300) -> List[Dict]:
+        # Due pending pages plus pages whose holder stopped heartbeating; each claim counts as an attempt
+        async with self.acquire() as conn:
+            results = await conn.fetch("""
+                UPDATE smart_pages
+                SET status = 'processing', claimedby = $2, attempts = attempts + 1,
+                    leaseexpiresat = NOW() + make_interval(secs => $4)
+                WHERE id IN (
+                    SELECT id FROM smart_pages
+                    WHERE ($3::uuid IS NULL OR datasetid = $3)
+                      AND ((status = 'pending' AND nextattemptat <= NOW())
+                           OR (status = 'processing' AND leaseexpiresat < NOW()))
+                    ORDER BY nextattemptat
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, datasetid, url, attempts
+            """, limit, worker_id, uuid.UUID(dataset_id) if dataset_id else None, lease_seconds)
+            return [dict(row) for row in results]
+    
+    async def extend_page_leases(self, worker_id: str, lease_seconds: int = 300) -> int:
+        async with self.acquire() as conn:
+            result = await conn.execute("""
+                UPDATE smart_pages SET leaseexpiresat = NOW() + make_interval(secs => $2)
+                WHERE claimedby = $1 AND status = 'processing'
+            """, worker_id, lease_seconds)
+            return int(result.split()[-1])
+    
+    async def complete_page_job(self, page_id: str, worker_id: str):
+        # The pipeline has already written the final status
+        async with self.acquire() as conn:
+            await conn.execute("""
+                UPDATE smart_pages SET claimedby = NULL, leaseexpiresat = NULL, nextattemptat = NULL
+                WHERE id = $1 AND claimedby = $2
+            """, uuid.UUID(page_id), worker_id)
+    
+    async def retry_page_job(self, page_id: str, worker_id: str, error_message: str,
+                             retry_in: Optional[float]):
+        # retry_in None gives up: the page stays 'error' until it is enqueued again
+        async with self.acquire() as conn:
+            await conn.execute("""
+                UPDATE smart_pages
+                SET status = CASE WHEN $4::float8 IS NULL THEN 'error' ELSE 'pending' END,
+                    nextattemptat = NOW() + make_interval(secs => $4::float8),
+                    errormessage = $3, claimedby = NULL, leaseexpiresat = NULL
+                WHERE id = $1 AND claimedby = $2
+            """, uuid.UUID(page_id), worker_id, error_message, retry_in)
+    
+    async def get_queue_counts(self, dataset_id: str = None) -> Dict[str, int]:
+        async with self.acquire() as conn:
+            results = await conn.fetch("""
+                SELECT CASE WHEN status = 'pending' AND nextattemptat IS NOT NULL THEN 'queued'
+                            ELSE status END AS state,
+                       count(*) AS pages
+                FROM smart_pages
+                WHERE $1::uuid IS NULL OR datasetid = $1
+                GROUP BY 1
+            """, uuid.UUID(dataset_id) if dataset_id else None)
+            return {row['state']: row['pages'] for row in results}
+    
+    async def start_chunk_version(self, dataset_id: str, chunksize: int, chunkoverlap: int,
+                                  embeddingmodel: str) -> Dict:
+        # The version being built with these settings, or a new one. Another build in progress
+        # has to be finished or aborted first
+        dataset_uuid = uuid.UUID(dataset_id)
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                active = await conn.fetchval("""
+                    SELECT chunkversion FROM smart_datasets WHERE id = $1 FOR UPDATE
+                """, dataset_uuid)
+                if active is None:
+                    raise ValueError(f"Dataset {dataset_id} not found")
+                building = await conn.fetchrow("""
+                    SELECT * FROM smart_chunk_versions WHERE datasetid = $1 AND status = 'building'
+                """, dataset_uuid)
+                if building:
+                    if (building['chunksize'], building['chunkoverlap'], building['embeddingmodel']) != \
+                            (chunksize, chunkoverlap, embeddingmodel):
+                        raise ValueError(f"Chunk version {building['version']} is being built with other settings")
+                    return dict(building)
+                row = await conn.fetchrow("""
+                    INSERT INTO smart_chunk_versions (datasetid, version, chunksize, chunkoverlap, embeddingmodel)
+                    SELECT $1, GREATEST($2, COALESCE(max(version), 0)) + 1, $3, $4, $5
+                    FROM smart_chunk_versions WHERE datasetid = $1
+                    RETURNING *
+                """, dataset_uuid, active, chunksize, chunkoverlap, embeddingmodel)
+                return dict(row)
+    
+    async def get_chunk_versions(self, dataset_id: str) -> List[Dict]:
+        # Recorded versions with their live chunk counts; pagesleft is what a build still has to do
+        dataset_uuid = uuid.UUID(dataset_id)
+        async with self.acquire() as conn:
+            versions = await conn.fetch("""
+                SELECT v.*, CASE WHEN v.status = 'building' THEN
+                                (SELECT count(*) FROM smart_pages p
+                                 WHERE p.datasetid = v.datasetid AND p.chunkversion < v.version)
+                            END AS pagesleft
+                FROM smart_chunk_versions v WHERE v.datasetid = $1
+                ORDER BY v.version
+            """, dataset_uuid)
+            chunks = await conn.fetch("""
+                SELECT version, count(*) AS chunks FROM smart_chunks WHERE datasetid = $1 GROUP BY version
+            """, dataset_uuid)
+        counts = {row['version']: row['chunks'] for row in chunks}
+        return [dict(row, chunks=counts.get(row['version'], 0)) for row in versions]
+    
+    async def iter_pages_for_version(self, dataset_id: str, version: int, batch_size: int = 50):
+        # Batches of pages whose chunks have not been built for version, in (chunkversion, id) order.
+        # Progress lives in smart_pages.chunkversion, so a restarted build continues where it stopped.
+        # Each batch is its own short query: no transaction stays open while the caller embeds
+        dataset_uuid = uuid.UUID(dataset_id)
+        after = (0, uuid.UUID(int=0))
+        while True:
+            async with self.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT id, chunkversion, cleantext, contenthash, duplicateof FROM smart_pages
+                    WHERE datasetid = $1 AND chunkversion < $2 AND (chunkversion, id) > ($3, $4)
+                    ORDER BY chunkversion, id
+                    LIMIT $5
+                """, dataset_uuid, version, after[0], after[1], batch_size)
+            if not rows:
+                return
+            yield rows
+            after = (rows[-1]['chunkversion'], rows[-1]['id'])
+    
+    async def get_reusable_chunks(self, page_ids: List[str], include_embeddings: bool = False) -> Dict[tuple, Dict]:
+        # Active-version chunks of these pages by (page id, text hash): enrichment, and the embedding
+        # when the model is unchanged, carry over to identical chunks of a new version
+        embedding = ", c.embedding" if include_embeddings else ""
+        async with self.acquire() as conn:
+            rows = await conn.fetch(f"""
+                SELECT c.pageid, c.contenthash, c.summary, c.contextretrieval,
+                       c.domainmeta1, c.domainmeta2{embedding}
+                FROM smart_chunks c
+                WHERE c.pageid = ANY($1::uuid[]) AND c.canonicalid IS NULL AND {ACTIVE_VERSION}
+            """, [uuid.UUID(page_id) for page_id in page_ids])
+        return {(str(row['pageid']), row['contenthash']): dict(row) for row in rows}
+    
+    async def save_version_chunks(self, dataset_id: str, version: int, pages: List[tuple]) -> List[str]:
+        # pages: (page id, contenthash the chunks were made from, chunks). Pages edited since they were
+        # read keep their old chunkversion and come round again; returns the ids that were saved
+        dataset_uuid = uuid.UUID(dataset_id)
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                status = await conn.fetchval("""
+                    SELECT status FROM smart_chunk_versions WHERE datasetid = $1 AND version = $2 FOR SHARE
+                """, dataset_uuid, version)
+                if status != 'building':
+                    raise ValueError(f"Chunk version {version} is {status or 'unknown'}, not building")
+                rows = await conn.fetch("""
+                    UPDATE smart_pages p SET chunkversion = $2
+                    FROM unnest($3::uuid[], $4::text[]) AS s (id, contenthash)
+                    WHERE p.id = s.id AND p.datasetid = $1 AND p.contenthash IS NOT DISTINCT FROM s.contenthash
+                    RETURNING p.id
+                """, dataset_uuid, version, [uuid.UUID(page_id) for page_id, _, _ in pages],
+                    [contenthash for _, contenthash, _ in pages])
+                saved = {row['id'] for row in rows}
+                if not saved:
+                    return []
+                # Leftovers of an earlier attempt at the same page
+                await conn.execute("""
+                    DELETE FROM smart_chunks WHERE pageid = ANY($1::uuid[]) AND version = $2
+                """, list(saved), version)
+                chunk_ids = await self._copy_chunks(conn, dataset_id, [
+                    (uuid.UUID(page_id), chunks) for page_id, _, chunks in pages if uuid.UUID(page_id) in saved
+                ], version)
+                await conn.execute("""
+                    UPDATE smart_chunk_versions
+                    SET pagesdone = pagesdone + $3, chunkscreated = chunkscreated + $4
+                    WHERE datasetid = $1 AND version = $2
+                """, dataset_uuid, version, len(saved), len(chunk_ids))
+        return [str(page_id) for page_id in saved]
+    
+    async def switch_chunk_version(self, dataset_id: str, version: int, lock_timeout: float = 5.0) -> bool:
+        # Makes a fully built version the one search reads, in one short transaction. The SHARE lock
+        # waits out in-flight page writes (and holds new ones back briefly) so no page can be
+        # rechunked under the old version unnoticed; False means pages are left or the lock timed out
+        dataset_uuid = uuid.UUID(dataset_id)
+        async with self.acquire() as conn:
+            try:
+                async with conn.transaction():
+                    await conn.execute(f"SET LOCAL lock_timeout = {int(lock_timeout * 1000)}")
+                    await conn.execute("LOCK TABLE smart_pages IN SHARE MODE")
+                    target = await conn.fetchrow("""
+                        SELECT * FROM smart_chunk_versions WHERE datasetid = $1 AND version = $2 FOR UPDATE
+                    """, dataset_uuid, version)
+                    if target is None or target['status'] != 'building':
+                        raise ValueError(f"Chunk version {version} is not being built")
+                    if await conn.fetchval("""
+                        SELECT EXISTS (SELECT 1 FROM smart_pages WHERE datasetid = $1 AND chunkversion < $2)
+                    """, dataset_uuid, version):
+                        return False
+                    await conn.execute("""
+                        UPDATE smart_datasets
+                        SET chunkversion = $2, chunksize = $3, chunkoverlap = $4, embeddingmodel = $5
+                        WHERE id = $1
+                    """, dataset_uuid, version, target['chunksize'], target['chunkoverlap'], target['embeddingmodel'])
+                    await conn.execute("""
+                        UPDATE smart_chunk_versions
+                        SET status = CASE WHEN version = $2 THEN 'active' ELSE 'retired' END,
+                            switchedat = CASE WHEN version = $2 THEN NOW() ELSE switchedat END
+                        WHERE datasetid = $1 AND (version = $2 OR status = 'active')
+                    """, dataset_uuid, version)
+            except asyncpg.LockNotAvailableError:
+                return False
+        self.search_settings.pop(dataset_id, None)
+        return True
+    
+    async def abort_chunk_version(self, dataset_id: str) -> Optional[int]:
+        # Stops the build in progress; its chunks are left for collect_chunk_versions
+        async with self.acquire() as conn:
+            return await conn.fetchval("""
+                UPDATE smart_chunk_versions SET status = 'aborted'
+                WHERE datasetid = $1 AND status = 'building'
+                RETURNING version
+            """, uuid.UUID(dataset_id))
+    
+    async def collect_chunk_versions(self, dataset_id: str, limit: int = 5000,
+                                     grace: float = SEARCH_SETTINGS_TTL) -> int:
+        # Deletes up to limit chunks of versions that are neither active nor being built; short
+        # statements keep row locks and WAL bursts small. Versions are marked collected once empty.
+        # Nothing is deleted within grace seconds of a switch: searchers with cached settings
+        # still query the previous version with its model
+        dataset_uuid = uuid.UUID(dataset_id)
+        async with self.acquire() as conn:
+            if await conn.fetchval("""
+                SELECT EXISTS (SELECT 1 FROM smart_chunk_versions
+                               WHERE datasetid = $1 AND status = 'active'
+                                 AND switchedat > NOW() - make_interval(secs => $2))
+            """, dataset_uuid, float(grace)):
+                return 0
+            result = await conn.execute("""
+                DELETE FROM smart_chunks WHERE id IN (
+                    SELECT c.id FROM smart_chunks c
+                    JOIN smart_datasets d ON d.id = c.datasetid
+                    WHERE c.datasetid = $1 AND c.version <> d.chunkversion
+                      AND c.version NOT IN (SELECT version FROM smart_chunk_versions
+                                            WHERE datasetid = $1 AND status = 'building')
+                    LIMIT $2
+                )
+            """, dataset_uuid, limit)
+            deleted = int(result.split()[-1])
+            if not deleted:
+                await conn.execute("""
+                    UPDATE smart_chunk_versions SET status = 'collected'
+                    WHERE datasetid = $1 AND status IN ('retired', 'aborted')
+                """, dataset_uuid)
+        return deleted
+    
     async def get_dataset_info(self, dataset_id: str) -> Dict:
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             result = await conn.fetchrow("""
                 SELECT * FROM smart_datasets WHERE id = $1
             """, uuid.UUID(dataset_id))
             return dict(result) if result else None
     
     async def update_page_status(self, page_id: str, status: str, error_message: str = None):
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             await conn.execute("""
                 UPDATE smart_pages SET status = $1, errormessage = $2 WHERE id = $3
             """, status, error_message, uuid.UUID(page_id))
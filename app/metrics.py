@@ -0,0 +1,254 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from app.config import Config
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans sub-millisecond cache hits to slow OpenAI calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram; quantiles are interpolated within the bucket."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def quantile(self, q: float) -> float:
+        with self.lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def cumulative_counts(self) -> List[int]:
+        with self.lock:
+            counts = list(self.counts)
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self) -> float:
+        return self.value
+
+
+class Gauge:
+    """Current value; set_function() makes it read a callback at export time."""
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+        self.lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    @contextmanager
+    def track(self):
+        # In-flight count around a block
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def snapshot(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class Metric:
+    """A named family of counters, gauges or histograms keyed by label values."""
+
+    def __init__(self, kind: str, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 factory: Callable = None):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.factory = factory
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values, **kwargs):
+        key = tuple(str(value) for value in values) or tuple(str(kwargs[name]) for name in self.labelnames)
+        child = self.children.get(key)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(key, self.factory())
+        return child
+
+    # Shortcuts for metrics without labels
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def track(self):
+        return self.labels().track()
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = 'strage'):
+        self.prefix = prefix
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def _register(self, kind: str, name: str, documentation: str, labelnames: Sequence[str],
+                  factory: Callable) -> Metric:
+        full_name = f"{self.prefix}_{name}" if self.prefix else name
+        with self.lock:
+            metric = self.metrics.get(full_name)
+            if metric is None:
+                metric = Metric(kind, full_name, documentation, labelnames, factory)
+                self.metrics[full_name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Metric:
+        return self._register('counter', name, documentation, labelnames, Counter)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Metric:
+        return self._register('gauge', name, documentation, labelnames, Gauge)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Metric:
+        return self._register('histogram', name, documentation, labelnames, lambda: Histogram(buckets))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for values, child in list(metric.children.items()):
+                if metric.kind != 'histogram':
+                    labels = _format_labels(metric.labelnames, values)
+                    lines.append(f"{metric.name}{labels} {_format_value(child.snapshot())}")
+                    continue
+                cumulative = child.cumulative_counts()
+                for bound, count in zip(child.buckets + [float('inf')], cumulative):
+                    labels = _format_labels(metric.labelnames, values, f'le="{_format_value(bound)}"')
+                    lines.append(f"{metric.name}_bucket{labels} {count}")
+                labels = _format_labels(metric.labelnames, values)
+                lines.append(f"{metric.name}_sum{labels} {_format_value(child.sum)}")
+                lines.append(f"{metric.name}_count{labels} {cumulative[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> Dict[str, Dict]:
+        # {metric: {"label=value,...": snapshot}}, for end-of-run reports
+        result = {}
+        for metric in list(self.metrics.values()):
+            children = {}
+            for values, child in list(metric.children.items()):
+                key = ",".join(f"{name}={value}" for name, value in zip(metric.labelnames, values))
+                children[key] = child.snapshot()
+            if children:
+                result[metric.name] = children
+        return result
+
+
+# Process-wide registry used by the scraper, chunker, embedder, database and pipeline
+REGISTRY = MetricsRegistry()
+
+
+def prometheus_handler(registry: MetricsRegistry = REGISTRY):
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response(body=registry.render_prometheus().encode('utf-8'),
+                            headers={"Content-Type": PROMETHEUS_CONTENT_TYPE})
+    return handler
+
+
+async def start_metrics_server(host: str = Config.METRICS_HOST, port: int = Config.METRICS_PORT,
+                               registry: MetricsRegistry = REGISTRY):
+    """Serves GET /metrics in Prometheus text format; returns the runner to clean up."""
+    app = web.Application()
+    app.router.add_get('/metrics', prometheus_handler(registry))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -13,6 +13,11 @@ class Dataset:
     metatag2name: Optional[str] = None
     chunksize: int = 500
     chunkoverlap: int = 50
+    coarsedimensions: Optional[int] = None
+    coarsequantization: Optional[str] = None
+    rerankfactor: int = 4
+    chunkversion: int = 1
+    embeddingmodel: Optional[str] = None
     status: str = 'created'
     createdat: Optional[datetime] = None
 
@@ -22,25 +27,42 @@ class Page:
     datasetid: str
     url: str
     title: Optional[str] = None
+    # Loaded only on request (DatabaseManager.get_page(..., include_rawhtml=True))
     rawhtml: Optional[str] = None
+    rawhash: Optional[str] = None
     cleantext: Optional[str] = None
     wordcount: Optional[int] = None
     status: str = 'pending'
     errormessage: Optional[str] = None
+    normalizedurl: Optional[str] = None
+    etag: Optional[str] = None
+    lastmodified: Optional[str] = None
+    contenthash: Optional[str] = None
+    # Canonical page this one nearly duplicates; such pages have no chunks of their own
+    duplicateof: Optional[str] = None
     createdat: Optional[datetime] = None
+    updatedat: Optional[datetime] = None
 
 @dataclass
 class Chunk:
     id: str
     pageid: str
     text: str
+    datasetid: Optional[str] = None
     summary: Optional[str] = None
     contextretrieval: Optional[str] = None
     domainmeta1: Optional[str] = None
     domainmeta2: Optional[str] = None
     embedding: Optional[List[float]] = None
     tokencount: Optional[int] = None
+    contenthash: Optional[str] = None
+    minhash: Optional[bytes] = None
+    # Set on near-duplicates stored without an embedding (DEDUP_MODE=link)
+    canonicalid: Optional[str] = None
     status: str = 'created'
+    # Chunk set this chunk belongs to; search reads the dataset's active one
+    version: int = 1
+    enrichclaimedat: Optional[datetime] = None
     createdat: Optional[datetime] = None
 
 @dataclass
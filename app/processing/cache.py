@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(model: str, prompt: str, text: str) -> str:
+    digest = hashlib.sha256()
+    for part in (model, prompt, text):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class CacheBackend(ABC):
+    # True when get/set do disk I/O; async callers then run them in a thread
+    blocking = False
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value: bytes):
+        self._set(key, value)
+
+    def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        return [self.get(key) for key in keys]
+
+    def set_many(self, items: List[Tuple[str, bytes]]):
+        for key, value in items:
+            self._set(key, value)
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def _set(self, key: str, value: bytes):
+        ...
+
+    @abstractmethod
+    def size(self) -> int:
+        ...
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.size()}
+
+    def close(self):
+        pass
+
+
+class MemoryCache(CacheBackend):
+    """LRU over an OrderedDict, evicted by total payload size; lives for one run."""
+
+    def __init__(self, max_bytes: int = Config.CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+
+    def _get(self, key: str) -> Optional[bytes]:
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value: bytes):
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.total_bytes -= len(previous)
+        self.entries[key] = value
+        self.total_bytes += len(value)
+        while self.total_bytes > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+    def size(self) -> int:
+        return self.total_bytes
+
+
+class SQLiteCache(CacheBackend):
+    """Persistent cache in a local SQLite file, shared across runs.
+
+    Entries are evicted least-recently-used first once the file holds more than
+    max_bytes of payload.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str = Config.CACHE_PATH, max_bytes: int = Config.CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessedat REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_accessedat ON cache (accessedat)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def _get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE cache SET accessedat = ? WHERE key = ?", (time.time(), key))
+            return bytes(row[0])
+
+    def _set(self, key: str, value: bytes):
+        with self.lock:
+            previous = self.conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, accessedat) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time())
+            )
+            self.total_bytes += len(value) - (previous[0] if previous else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Trim to 90% of the budget so eviction doesn't run on every insert
+        target = int(self.max_bytes * 0.9)
+        rows = self.conn.execute("SELECT key, size FROM cache ORDER BY accessedat")
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM cache WHERE key = ?", evicted)
+        logger.info(f"Evicted {len(evicted)} cache entries")
+
+    def size(self) -> int:
+        return self.total_bytes
+
+    def close(self):
+        self.conn.close()
+
+
+def create_cache(backend: str = Config.CACHE_BACKEND) -> Optional[CacheBackend]:
+    if backend == 'memory':
+        return MemoryCache()
+    if backend == 'sqlite':
+        return SQLiteCache()
+    if backend in ('', 'none'):
+        return None
+    raise ValueError(f"Unknown cache backend: {backend}")
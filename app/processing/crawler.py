@@ -0,0 +1,381 @@
+import asyncio
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import logging
+import math
+from collections import deque
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+
+import lxml.html
+from lxml import etree
+
+from app.config import Config
+from app.database import DatabaseManager
+from app.metrics import REGISTRY
+from app.processing.pipeline import PageJob
+from app.processing.scraper import WebScraper
+from app.processing.urls import normalize_url
+
+logger = logging.getLogger(__name__)
+
+CRAWL_URLS = REGISTRY.counter("crawl_urls_total", "Discovered URLs by source and outcome", ["source", "outcome"])
+
+# Links to these are never HTML pages
+SKIPPED_EXTENSIONS = {
+    '.7z', '.avi', '.bmp', '.css', '.csv', '.doc', '.docx', '.exe', '.gif', '.gz', '.ico', '.jpeg', '.jpg',
+    '.js', '.json', '.mov', '.mp3', '.mp4', '.pdf', '.png', '.ppt', '.pptx', '.rar', '.svg', '.tar', '.tgz',
+    '.webm', '.webp', '.woff', '.woff2', '.xls', '.xlsx', '.xml', '.zip',
+}
+
+# Crawlers only have to read the first 500 KiB of robots.txt (RFC 9309)
+ROBOTS_MAX_BYTES = 500 * 1024
+
+
+def _fingerprint(url: str, size: int = 8) -> bytes:
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=size).digest()
+
+
+class UrlSet:
+    """Exact dedup on 64-bit fingerprints of normalized URLs."""
+
+    def __init__(self):
+        self.fingerprints = set()
+
+    def __contains__(self, url: str) -> bool:
+        return int.from_bytes(_fingerprint(url), 'little') in self.fingerprints
+
+    def add(self, url: str):
+        self.fingerprints.add(int.from_bytes(_fingerprint(url), 'little'))
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+
+class BloomFilter:
+    """Fixed-size probabilistic set; a false positive skips an unseen URL, never refetches one."""
+
+    def __init__(self, capacity: int, error_rate: float = Config.CRAWL_BLOOM_ERROR_RATE):
+        self.bits = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.bits / capacity * math.log(2)), 1)
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, url: str) -> Iterable[int]:
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = _fingerprint(url, 16)
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def __contains__(self, url: str) -> bool:
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self._positions(url))
+
+    def add(self, url: str):
+        for position in self._positions(url):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __len__(self) -> int:
+        return self.count
+
+
+def url_filter(capacity: int):
+    # Exact while the fingerprints stay small, a Bloom filter of constant size beyond that
+    if capacity <= Config.CRAWL_EXACT_DEDUP_LIMIT:
+        return UrlSet()
+    return BloomFilter(capacity)
+
+
+class Frontier:
+    """Bounded priority queue of URLs, handed out round-robin across hosts.
+
+    Within a host, shallower and higher sitemap-priority URLs go first. The
+    scraper's HostLimiter still spaces requests; the rotation keeps one large
+    host from starving the others.
+    """
+
+    def __init__(self, max_size: int = Config.CRAWL_FRONTIER_SIZE):
+        self.max_size = max_size
+        self.hosts: Dict[str, list] = {}
+        self.rotation = deque()
+        self.size = 0
+        self.sequence = itertools.count()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def full(self) -> bool:
+        return self.size >= self.max_size
+
+    def push(self, url: str, depth: int, priority: float = 0.5) -> bool:
+        if self.full():
+            return False
+        host = (urlsplit(url).hostname or '').lower()
+        heap = self.hosts.get(host)
+        if heap is None:
+            heap = self.hosts[host] = []
+            self.rotation.append(host)
+        heapq.heappush(heap, (depth, -priority, next(self.sequence), url))
+        self.size += 1
+        return True
+
+    def pop(self) -> Optional[Tuple[str, int]]:
+        if not self.rotation:
+            return None
+        host = self.rotation.popleft()
+        heap = self.hosts[host]
+        depth, _, _, url = heapq.heappop(heap)
+        self.size -= 1
+        if heap:
+            self.rotation.append(host)
+        else:
+            del self.hosts[host]
+        return url, depth
+
+
+class _LimitedReader:
+    # File-like over a (decompressing) stream; stops sitemap gzip bombs and allows peeking
+    def __init__(self, stream, limit: int):
+        self.stream = stream
+        self.remaining = limit
+        self.head = b''
+
+    def _read(self, size: int) -> bytes:
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            raise ValueError("Sitemap exceeds CRAWL_SITEMAP_MAX_BYTES")
+        return data
+
+    def peek(self, size: int) -> bytes:
+        if len(self.head) < size:
+            self.head += self._read(size - len(self.head))
+        return self.head
+
+    def read(self, size: int = -1) -> bytes:
+        head, self.head = self.head, b''
+        if size is None or size < 0:
+            return head + self._read(-1)
+        if len(head) >= size:
+            self.head = head[size:]
+            return head[:size]
+        return head + self._read(size - len(head))
+
+
+def parse_sitemap(data: bytes, max_bytes: int = Config.CRAWL_SITEMAP_MAX_BYTES
+                  ) -> Tuple[List[Tuple[str, float]], List[str]]:
+    """(page URLs with priority, child sitemap URLs) from a urlset, sitemap index or text sitemap.
+
+    Gzip is detected by magic bytes; parsing streams and drops elements as it goes.
+    """
+    stream = io.BytesIO(data)
+    if data[:2] == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=stream)
+    reader = _LimitedReader(stream, max_bytes)
+    pages, sitemaps = [], []
+    try:
+        if not reader.peek(512).lstrip().startswith(b'<'):
+            # Text sitemap: one URL per line
+            text = reader.read().decode('utf-8', 'replace')
+            return [(line, 0.5) for line in text.split() if line.startswith('http')], []
+
+        for _, element in etree.iterparse(reader, events=('end',), tag=('{*}url', '{*}sitemap'),
+                                          recover=True, resolve_entities=False, no_network=True):
+            loc = (element.findtext('{*}loc') or '').strip()
+            if loc:
+                if etree.QName(element).localname == 'sitemap':
+                    sitemaps.append(loc)
+                else:
+                    try:
+                        priority = float(element.findtext('{*}priority') or 0.5)
+                    except ValueError:
+                        priority = 0.5
+                    pages.append((loc, priority))
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    except (etree.XMLSyntaxError, OSError, EOFError, ValueError) as e:
+        logger.warning(f"Sitemap parsed partially: {str(e)}")
+    return pages, sitemaps
+
+
+def extract_links(html: str, base_url: str) -> List[str]:
+    # Absolute hrefs of <a> elements, honouring <base href> and rel=nofollow
+    try:
+        try:
+            tree = lxml.html.document_fromstring(html, base_url=base_url)
+        except ValueError:
+            tree = lxml.html.document_fromstring(html.encode('utf-8'), base_url=base_url)
+        for meta in tree.iter('meta'):
+            if (meta.get('name') or '').lower() == 'robots' and 'nofollow' in (meta.get('content') or '').lower():
+                return []
+        tree.make_links_absolute(base_url, resolve_base_href=True, handle_failures='discard')
+    except Exception as e:
+        logger.warning(f"Could not parse links of {base_url}: {str(e)}")
+        return []
+    return [element.get('href') for element in tree.iter('a')
+            if element.get('href') and 'nofollow' not in (element.get('rel') or '').lower()]
+
+
+def _site(host: str) -> str:
+    host = (host or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+class SiteCrawler:
+    """Discovers a site's pages from robots.txt/sitemaps and in-domain links.
+
+    Memory stays flat: the frontier is bounded, sitemap entries are admitted only
+    as it drains, and seen URLs are kept as fingerprints or in a Bloom filter.
+    Feed jobs() into IngestionPipeline.run_jobs with on_fetched/on_finished wired
+    to this crawler, so links come from pages the pipeline has already downloaded.
+    """
+
+    def __init__(self, scraper: WebScraper, seeds: Iterable[str], db: Optional[DatabaseManager] = None,
+                 max_pages: int = Config.CRAWL_MAX_PAGES, max_depth: int = Config.CRAWL_MAX_DEPTH,
+                 frontier_size: int = Config.CRAWL_FRONTIER_SIZE, domains: Iterable[str] = (),
+                 use_sitemaps: bool = True, follow_links: bool = True, respect_robots: bool = True):
+        self.scraper = scraper
+        self.db = db
+        self.seeds = [seed.strip() for seed in seeds if seed.strip()]
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.use_sitemaps = use_sitemaps
+        self.follow_links = follow_links
+        self.respect_robots = respect_robots
+        self.domains = {_site(urlsplit(seed).hostname) for seed in self.seeds} | {_site(d) for d in domains}
+        self.frontier = Frontier(frontier_size)
+        self.seen = url_filter((max_pages or Config.CRAWL_EXPECTED_URLS) + frontier_size)
+        self.sitemaps_seen = UrlSet()
+        self.sitemap_queue = deque()
+        # Entries of the sitemap being expanded, waiting for room in the frontier
+        self.sitemap_backlog = deque()
+        self.robots: Dict[str, asyncio.Future] = {}
+        # url -> depth of pages handed out and not finished yet
+        self.in_flight: Dict[str, int] = {}
+        self.changed = asyncio.Event()
+        self.stats = {"pages": 0, "sitemaps": 0, "admitted": 0, "duplicate": 0, "dropped": 0, "filtered": 0}
+
+    def _count(self, source: str, outcome: str) -> bool:
+        self.stats[outcome] += 1
+        CRAWL_URLS.labels(source=source, outcome=outcome).inc()
+        return outcome == 'admitted'
+
+    async def _fetch_robots(self, origin: str) -> Optional[RobotFileParser]:
+        # robots.txt is text/plain, which the HTML-only content type check would refuse
+        fetched = await self.scraper.fetch_html(f"{origin}/robots.txt", binary=True, max_bytes=ROBOTS_MAX_BYTES)
+        if fetched.get('error'):
+            # Missing or unreadable robots.txt: everything is allowed
+            return None
+        parser = RobotFileParser(f"{origin}/robots.txt")
+        parser.parse(fetched['body'].decode('utf-8', errors='replace').splitlines())
+        return parser
+
+    async def _robots(self, url: str) -> Optional[RobotFileParser]:
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        task = self.robots.get(origin)
+        if task is None:
+            task = self.robots[origin] = asyncio.ensure_future(self._fetch_robots(origin))
+        return await task
+
+    async def _admit(self, url: str, depth: int, priority: float, source: str) -> bool:
+        parts = urlsplit(url)
+        if (parts.scheme not in ('http', 'https') or _site(parts.hostname) not in self.domains
+                or depth > self.max_depth
+                or parts.path[parts.path.rfind('.'):].lower() in SKIPPED_EXTENSIONS):
+            return self._count(source, 'filtered')
+        key = normalize_url(url)
+        if key in self.seen:
+            return self._count(source, 'duplicate')
+        if self.frontier.full():
+            # Not marked seen: the URL can still get in when it is linked again later
+            return self._count(source, 'dropped')
+        if self.respect_robots:
+            robots = await self._robots(url)
+            if robots is not None and not robots.can_fetch(Config.SCRAPER_USER_AGENT, url):
+                return self._count(source, 'filtered')
+        self.seen.add(key)
+        self.frontier.push(urlunsplit(parts._replace(fragment='')), depth, priority)
+        return self._count(source, 'admitted')
+
+    def _queue_sitemap(self, url: str):
+        if url not in self.sitemaps_seen:
+            self.sitemaps_seen.add(url)
+            self.sitemap_queue.append(url)
+
+    async def _expand_sitemap(self, url: str):
+        fetched = await self.scraper.fetch_html(url, binary=True)
+        if fetched.get('error'):
+            logger.warning(f"Sitemap {url}: {fetched['error']}")
+            return
+        pages, sitemaps = await asyncio.to_thread(parse_sitemap, fetched['body'])
+        self.stats["sitemaps"] += 1
+        logger.info(f"Sitemap {url}: {len(pages)} pages, {len(sitemaps)} sitemaps")
+        for sitemap in sitemaps:
+            self._queue_sitemap(sitemap)
+        self.sitemap_backlog.extend(pages)
+
+    async def _refill(self):
+        while not self.frontier.full():
+            if self.sitemap_backlog:
+                url, priority = self.sitemap_backlog.popleft()
+                await self._admit(url, 0, priority, 'sitemap')
+            elif self.sitemap_queue:
+                await self._expand_sitemap(self.sitemap_queue.popleft())
+            else:
+                return
+
+    async def _start(self):
+        for seed in self.seeds:
+            await self._admit(seed, 0, 1.0, 'seed')
+        if not self.use_sitemaps:
+            return
+        origins = dict.fromkeys(f"{urlsplit(seed).scheme}://{urlsplit(seed).netloc}" for seed in self.seeds)
+        for origin in origins:
+            robots = await self._robots(origin)
+            for sitemap in (robots.site_maps() if robots else None) or [f"{origin}/sitemap.xml"]:
+                self._queue_sitemap(sitemap)
+
+    async def urls(self) -> AsyncIterator[Tuple[str, int]]:
+        """(url, depth) in crawl order until the site, max_pages or max_depth is exhausted."""
+        await self._start()
+        while not self.max_pages or self.stats["pages"] < self.max_pages:
+            await self._refill()
+            self.changed.clear()
+            entry = self.frontier.pop()
+            if entry is None:
+                if not self.in_flight:
+                    return
+                # Pages still in the pipeline may yet add links
+                await self.changed.wait()
+                continue
+            self.stats["pages"] += 1
+            yield entry
+
+    async def jobs(self) -> AsyncIterator[PageJob]:
+        async for url, depth in self.urls():
+            self.in_flight[url] = depth
+            yield PageJob(url=url)
+
+    async def on_fetched(self, job: PageJob):
+        depth = self.in_flight.get(job.url)
+        if depth is None or not self.follow_links or depth >= self.max_depth:
+            return
+        html = job.html
+        if html is None and job.page_id and self.db is not None:
+            # 304: links come from the stored copy
+            html = await self.db.get_raw_html(job.page_id)
+        if not html:
+            return
+        for link in await asyncio.to_thread(extract_links, html, job.url):
+            await self._admit(link, depth + 1, 0.5, 'link')
+        self.changed.set()
+
+    async def on_finished(self, job: PageJob, error: Optional[str]):
+        self.in_flight.pop(job.url, None)
+        self.changed.set()
@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import Config
+from app.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+DUPLICATES = REGISTRY.counter("near_duplicates_total", "Pages and chunks recognised as near-duplicates", ["kind"])
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+
+def _permutations(num_perm: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Fixed seed: signatures must stay comparable across processes and runs
+    rng = np.random.RandomState(1)
+    a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+    b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.int64).astype(np.uint64)
+    return a, b
+
+
+def shingles(text: str, size: int = Config.DEDUP_SHINGLE_SIZE) -> set:
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """MinHash signatures of word shingles, split into LSH bands.
+
+    Two texts share a band bucket with probability 1 - (1 - J^rows)^bands for
+    Jaccard similarity J, so a bucket lookup finds likely duplicates without
+    scanning the dataset; candidates are then checked on the full signature.
+    """
+
+    def __init__(self, num_perm: int = Config.DEDUP_NUM_PERM, bands: int = Config.DEDUP_BANDS,
+                 shingle_size: int = Config.DEDUP_SHINGLE_SIZE):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.a, self.b = _permutations(num_perm)
+
+    def signature(self, text: str) -> Optional[bytes]:
+        items = shingles(text or '', self.shingle_size)
+        if not items:
+            return None
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(item.encode('utf-8'), digest_size=4).digest(), 'little')
+             for item in items),
+            dtype=np.uint64, count=len(items)
+        )
+        # (a * h + b) mod p stays below 2^64 because a, b < 2^31 and h < 2^32
+        permuted = (np.outer(hashes, self.a) + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype('<u4').tobytes()
+
+    def band_keys(self, signature: bytes) -> List[Tuple[int, int]]:
+        # (band, bucket) pairs; buckets are signed 64-bit for a Postgres bigint
+        rows = self.rows * 4
+        return [(band, int.from_bytes(hashlib.blake2b(signature[band * rows:(band + 1) * rows],
+                                                      digest_size=8).digest(), 'little', signed=True))
+                for band in range(self.bands)]
+
+    @staticmethod
+    def similarity(left: bytes, right: bytes) -> float:
+        # Share of equal minima estimates the Jaccard similarity of the shingle sets
+        if not left or not right or len(left) != len(right):
+            return 0.0
+        return float(np.mean(np.frombuffer(left, dtype='<u4') == np.frombuffer(right, dtype='<u4')))
+
+
+def find_duplicates(hasher: MinHasher, signatures: List[Optional[bytes]],
+                    candidates: Iterable[Tuple[int, int, str, bytes]],
+                    threshold: float = Config.DEDUP_THRESHOLD) -> List[Optional[str]]:
+    """For each signature, the id of its closest stored match at or above threshold.
+
+    candidates are (band, bucket, id, signature) rows sharing at least one bucket.
+    Signatures earlier in the list count as stored, so repeats within a page resolve
+    to their first occurrence (reported as '#<index>').
+    """
+    buckets: Dict[Tuple[int, int], List[Tuple[str, bytes]]] = {}
+    for band, bucket, item_id, signature in candidates:
+        buckets.setdefault((band, bucket), []).append((item_id, signature))
+
+    matches = []
+    for index, signature in enumerate(signatures):
+        best, best_similarity = None, threshold
+        if signature is not None:
+            keys = hasher.band_keys(signature)
+            seen = set()
+            for key in keys:
+                for item_id, other in buckets.get(key, ()):
+                    if item_id in seen:
+                        continue
+                    seen.add(item_id)
+                    similarity = hasher.similarity(signature, other)
+                    if similarity >= best_similarity:
+                        best, best_similarity = item_id, similarity
+            if best is None:
+                for key in keys:
+                    buckets.setdefault(key, []).append((f"#{index}", signature))
+        matches.append(best)
+    return matches
@@ -1,71 +1,217 @@
 import openai
 import asyncio
-from typing import List, Dict
+import json
+import tiktoken
+from typing import List, Dict, Optional
 import logging
 from app.config import Config
+from app.metrics import REGISTRY
+from app.processing.cache import CacheBackend, create_cache, make_key
+from app.processing.ratelimit import RateLimiter, get_rate_limiter
+from app.vectors import encode_vector, decode_vector
 
 logger = logging.getLogger(__name__)
 
+CACHE_LOOKUPS = REGISTRY.counter("openai_cache_lookups_total", "Embedding/completion cache lookups", ["model", "result"])
+
+CHAT_MODEL = "gpt-3.5-turbo"
+SUMMARY_PROMPT = "Создай краткое резюме текста на русском языке."
+CONTEXT_PROMPT = "Создай контекстное описание для поиска по этому тексту. Включи ключевые слова и темы."
+ENRICHMENT_PROMPT = (
+    "Ответь JSON-объектом с двумя строковыми полями. "
+    "\"summary\": " + SUMMARY_PROMPT + " "
+    "\"contextretrieval\": " + CONTEXT_PROMPT
+)
+
 class EmbeddingGenerator:
-    def __init__(self):
-        self.client = openai.AsyncOpenAI(api_key=Config.OPENAI_API_KEY)
-        self.model = Config.EMBEDDING_MODEL
-        self.semaphore = asyncio.Semaphore(10)  # Limit concurrent requests
+    def __init__(self, encoding: tiktoken.Encoding = None,
+                 batch_size: int = Config.EMBEDDING_BATCH_SIZE,
+                 batch_tokens: int = Config.EMBEDDING_BATCH_TOKENS,
+                 cache: CacheBackend = None, limiter: RateLimiter = None, model: str = None):
+        # Retries are handled by the rate limiter, which sees every 429
+        self.client = openai.AsyncOpenAI(api_key=Config.OPENAI_API_KEY, base_url=Config.OPENAI_BASE_URL,
+                                         max_retries=0)
+        # Default embedding model; datasets embedded with another one pass it per call
+        self.model = model or Config.EMBEDDING_MODEL
+        # Pass TextChunker.encoding to reuse the already loaded tokenizer
+        self.encoding = encoding or tiktoken.get_encoding("cl100k_base")
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        # Shared RPM/TPM budgets and adaptive concurrency per model
+        self.limiter = limiter or get_rate_limiter()
+        # Content-addressed cache keyed by (model, prompt, text)
+        self.cache = cache if cache is not None else create_cache()
+    
+    async def _cache_call(self, method, argument):
+        # A disk-backed cache runs off the event loop, one thread hop per batch
+        if self.cache.blocking:
+            return await asyncio.to_thread(method, argument)
+        return method(argument)
+    
+    async def _cache_get_many(self, model: str, prompt: str, texts: List[str]) -> List[Optional[bytes]]:
+        if self.cache is None:
+            return [None] * len(texts)
+        values = await self._cache_call(self.cache.get_many, [make_key(model, prompt, text) for text in texts])
+        hits = sum(1 for value in values if value is not None)
+        CACHE_LOOKUPS.labels(model=model, result='hit').inc(hits)
+        CACHE_LOOKUPS.labels(model=model, result='miss').inc(len(values) - hits)
+        return values
+    
+    async def _cache_set_many(self, model: str, prompt: str, items: List[tuple]):
+        # items: (text, value)
+        if self.cache is not None and items:
+            await self._cache_call(self.cache.set_many, [(make_key(model, prompt, text), value)
+                                                         for text, value in items])
     
-    async def generate_embedding(self, text: str) -> List[float]:
-        async with self.semaphore:
-            try:
-                response = await self.client.embeddings.create(
-                    model=self.model,
+    async def _cache_get(self, model: str, prompt: str, text: str) -> Optional[bytes]:
+        return (await self._cache_get_many(model, prompt, [text]))[0]
+    
+    async def _cache_set(self, model: str, prompt: str, text: str, value: bytes):
+        await self._cache_set_many(model, prompt, [(text, value)])
+    
+    async def generate_embedding(self, text: str, model: str = None) -> List[float]:
+        model = model or self.model
+        cached = await self._cache_get(model, '', text)
+        if cached is not None:
+            return decode_vector(cached)
+        
+        try:
+            response = await self.limiter.call(
+                model, len(self.encoding.encode(text)),
+                lambda: self.client.embeddings.with_raw_response.create(
+                    model=model,
                     input=text
                 )
-                return response.data[0].embedding
-            except Exception as e:
-                logger.error(f"Error generating embedding: {str(e)}")
-                return None
+            )
+            embedding = response.data[0].embedding
+        except Exception as e:
+            logger.error(f"Error generating embedding: {str(e)}")
+            return None
+        await self._cache_set(model, '', text, encode_vector(embedding))
+        return embedding
     
-    async def generate_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
-        tasks = [self.generate_embedding(text) for text in texts]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        embeddings = []
-        for i, result in enumerate(results):
-            if isinstance(result, Exception):
-                logger.error(f"Error generating embedding for text {i}: {str(result)}")
-                embeddings.append(None)
+    async def generate_embeddings_batch(self, texts: List[str],
+                                        token_counts: Optional[List[int]] = None,
+                                        model: str = None) -> List[List[float]]:
+        model = model or self.model
+        embeddings = [None] * len(texts)
+        missing = []
+        for i, cached in enumerate(await self._cache_get_many(model, '', texts)):
+            if cached is not None:
+                embeddings[i] = decode_vector(cached)
             else:
-                embeddings.append(result)
+                missing.append(i)
         
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            missing_counts = [token_counts[i] for i in missing] if token_counts else None
+            fetched = [None] * len(missing)
+            if missing_counts is None:
+                missing_counts = [len(tokens) for tokens in self.encoding.encode_ordinary_batch(missing_texts)]
+            batches = self._pack_batches(missing_texts, missing_counts)
+            await asyncio.gather(*(self._embed_batch(missing_texts, missing_counts, indices, fetched, model)
+                                   for indices in batches))
+            for i, embedding in zip(missing, fetched):
+                embeddings[i] = embedding
+            await self._cache_set_many(model, '', [(text, encode_vector(embedding))
+                                                   for text, embedding in zip(missing_texts, fetched)
+                                                   if embedding is not None])
+        
+        failed = sum(1 for embedding in embeddings if embedding is None)
+        if failed:
+            logger.error(f"Failed to generate {failed} of {len(texts)} embeddings")
         return embeddings
     
-    async def generate_summary(self, text: str, max_length: int = 150) -> str:
+    def _pack_batches(self, texts: List[str], token_counts: Optional[List[int]] = None) -> List[List[int]]:
+        # Greedily pack text indices into requests bounded by item count and token budget
+        batches = []
+        current, current_tokens = [], 0
+        for i, text in enumerate(texts):
+            tokens = token_counts[i] if token_counts else len(self.encoding.encode(text))
+            if current and (len(current) >= self.batch_size or current_tokens + tokens > self.batch_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+    
+    async def _embed_batch(self, texts: List[str], token_counts: List[int], indices: List[int],
+                           embeddings: List[List[float]], model: str):
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
+            response = await self.limiter.call(
+                model, sum(token_counts[i] for i in indices),
+                lambda: self.client.embeddings.with_raw_response.create(
+                    model=model,
+                    input=[texts[i] for i in indices]
+                )
+            )
+            for item in response.data:
+                embeddings[indices[item.index]] = item.embedding
+            return
+        except Exception as e:
+            logger.error(f"Error generating embeddings for batch of {len(indices)}: {str(e)}")
+        
+        # Split the failed batch and retry each half, so only the bad input is lost
+        if len(indices) > 1:
+            middle = len(indices) // 2
+            await asyncio.gather(
+                self._embed_batch(texts, token_counts, indices[:middle], embeddings, model),
+                self._embed_batch(texts, token_counts, indices[middle:], embeddings, model)
+            )
+    
+    async def _chat(self, prompt: str, text: str, max_tokens: int, json_mode: bool = False) -> str:
+        cache_prompt = f"{prompt}\0{max_tokens}"
+        cached = await self._cache_get(CHAT_MODEL, cache_prompt, text)
+        if cached is not None:
+            return cached.decode('utf-8')
+        
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+        # max_tokens counts against the TPM budget as well as the prompt
+        request_tokens = len(self.encoding.encode(prompt)) + len(self.encoding.encode(text)) + max_tokens
+        response = await self.limiter.call(
+            CHAT_MODEL, request_tokens,
+            lambda: self.client.chat.completions.with_raw_response.create(
+                model=CHAT_MODEL,
                 messages=[
-                    {"role": "system", "content": "Создай краткое резюме текста на русском языке."},
+                    {"role": "system", "content": prompt},
                     {"role": "user", "content": f"Текст: {text}"}
                 ],
-                max_tokens=max_length,
-                temperature=0.3
+                max_tokens=max_tokens,
+                temperature=0.3,
+                **extra
             )
-            return response.choices[0].message.content.strip()
+        )
+        content = response.choices[0].message.content.strip()
+        if json_mode:
+            # Never cache a reply that doesn't parse
+            json.loads(content)
+        await self._cache_set(CHAT_MODEL, cache_prompt, text, content.encode('utf-8'))
+        return content
+    
+    async def generate_summary(self, text: str, max_length: int = 150) -> str:
+        try:
+            return await self._chat(SUMMARY_PROMPT, text, max_length)
         except Exception as e:
             logger.error(f"Error generating summary: {str(e)}")
             return None
     
     async def generate_context_retrieval(self, text: str) -> str:
         try:
-            response = await self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "Создай контекстное описание для поиска по этому тексту. Включи ключевые слова и темы."},
-                    {"role": "user", "content": f"Текст: {text}"}
-                ],
-                max_tokens=100,
-                temperature=0.3
-            )
-            return response.choices[0].message.content.strip()
+            return await self._chat(CONTEXT_PROMPT, text, 100)
         except Exception as e:
             logger.error(f"Error generating context retrieval: {str(e)}")
             return None
+    
+    async def generate_enrichment(self, text: str) -> Dict[str, str]:
+        # Summary and context description from a single structured completion
+        try:
+            content = json.loads(await self._chat(ENRICHMENT_PROMPT, text, 300, json_mode=True))
+            return {
+                "summary": (content.get("summary") or "").strip() or None,
+                "contextretrieval": (content.get("contextretrieval") or "").strip() or None
+            }
+        except Exception as e:
+            logger.error(f"Error generating enrichment: {str(e)}")
+            return {"summary": None, "contextretrieval": None}
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from app.config import Config
+from app.database import DatabaseManager
+from app.processing.embedder import EmbeddingGenerator
+
+logger = logging.getLogger(__name__)
+
+
+class EnrichmentWorker:
+    """Fills summary/contextretrieval for chunks that were stored without them.
+
+    Chunks are claimed in batches with FOR UPDATE SKIP LOCKED, so several workers
+    can share a backlog. Chunks are searchable before this runs.
+    """
+
+    def __init__(self, db: DatabaseManager, embedder: EmbeddingGenerator = None,
+                 dataset_id: Optional[str] = None,
+                 batch_size: int = Config.ENRICHMENT_BATCH_SIZE,
+                 concurrency: int = Config.ENRICHMENT_CONCURRENCY):
+        self.db = db
+        self.embedder = embedder or EmbeddingGenerator()
+        self.dataset_id = dataset_id
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.stats = {"chunks_enriched": 0, "chunks_failed": 0}
+
+    async def _enrich(self, chunk: Dict) -> Dict:
+        async with self.semaphore:
+            enrichment = await self.embedder.generate_enrichment(chunk['text'])
+        return {"id": chunk['id'], **enrichment}
+
+    async def run_once(self) -> int:
+        chunks = await self.db.claim_unenriched_chunks(self.batch_size, dataset_id=self.dataset_id)
+        if not chunks:
+            return 0
+
+        enrichments = await asyncio.gather(*(self._enrich(chunk) for chunk in chunks))
+        await self.db.save_chunk_enrichments(enrichments)
+
+        failed = sum(1 for item in enrichments if not item['summary'] and not item['contextretrieval'])
+        self.stats["chunks_enriched"] += len(enrichments) - failed
+        self.stats["chunks_failed"] += failed
+        logger.info(f"Enriched {len(enrichments) - failed} chunks ({failed} failed)")
+        return len(chunks)
+
+    async def run(self, poll_interval: float = 10.0, stop_when_idle: bool = False) -> Dict[str, int]:
+        while True:
+            claimed = await self.run_once()
+            if claimed:
+                continue
+            if stop_when_idle:
+                return self.stats
+            await asyncio.sleep(poll_interval)
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional
+
+import lxml.etree
+import lxml.html
+import trafilatura
+
+from app.config import Config
+from app.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+TITLE_MAX_LENGTH = 500
+
+EXTRACT_SECONDS = REGISTRY.histogram("extract_seconds", "HTML extraction latency, including pool queueing")
+
+
+def _parse(html: str):
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # lxml refuses str input that carries an XML encoding declaration
+        return lxml.html.document_fromstring(html.encode('utf-8'))
+
+
+def _first_text(tree, tag: str) -> Optional[str]:
+    element = tree.find(f'.//{tag}')
+    if element is None:
+        return None
+    text = element.text_content().strip()
+    return text[:TITLE_MAX_LENGTH] if text else None
+
+
+def extract_content(html: str, url: str = None, heading_fallback: bool = False) -> Dict[str, Optional[str]]:
+    # Title, clean text and word count from a single lxml parse; runs inside the executor.
+    # The HTML is not returned: callers already hold it, and it would be pickled back
+    try:
+        try:
+            tree = _parse(html)
+        except lxml.etree.ParserError:
+            # Blank pages (nothing but whitespace or comments) have no document; not an error
+            return {"title": None, "cleantext": None, "wordcount": 0, "error": None}
+        title = _first_text(tree, 'title')
+        if title is None and heading_fallback:
+            title = _first_text(tree, 'h1')
+
+        # trafilatura accepts the parsed tree directly; it may modify it, so read the title first
+        clean_text = trafilatura.extract(tree, url=url, include_comments=False,
+                                         include_tables=True, include_links=True)
+        word_count = len(clean_text.split()) if clean_text else 0
+
+        return {
+            "title": title,
+            "cleantext": clean_text,
+            "wordcount": word_count,
+            "error": None
+        }
+    except Exception as e:
+        logger.error(f"Error extracting content from {url}: {str(e)}")
+        return {"error": str(e)}
+
+
+class ContentExtractor:
+    """Async front for extract_content running in a process (or thread) pool.
+
+    Keeps parsing off the event loop so downloads are not stalled by large pages.
+    The pool is created on first use.
+    """
+
+    def __init__(self, workers: int = Config.EXTRACTION_WORKERS, executor: str = Config.EXTRACTION_EXECUTOR):
+        if executor not in ('process', 'thread'):
+            raise ValueError(f"Unknown extraction executor: {executor}")
+        self.workers = workers
+        self.executor_kind = executor
+        self.executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self.executor is None:
+            if self.executor_kind == 'process':
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='extract')
+        return self.executor
+
+    async def extract(self, html: str, url: str = None, heading_fallback: bool = False) -> Dict[str, Optional[str]]:
+        loop = asyncio.get_running_loop()
+        # Includes queueing for a free worker and pickling the page across processes
+        with EXTRACT_SECONDS.time():
+            return await loop.run_in_executor(self._get_executor(), extract_content, html, url, heading_fallback)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
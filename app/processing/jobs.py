@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from app.config import Config
+from app.database import DatabaseManager
+from app.metrics import REGISTRY
+from app.processing.embedder import EmbeddingGenerator
+from app.processing.pipeline import IngestionPipeline, PageJob
+from app.processing.scraper import WebScraper
+from app.processing.urls import normalize_url
+
+logger = logging.getLogger(__name__)
+
+JOBS_FINISHED = REGISTRY.counter("jobs_finished_total", "Claimed pages by outcome", ["outcome"])
+
+
+async def enqueue_urls(db: DatabaseManager, dataset_id: str, urls: Iterable[str],
+                       batch_size: int = 1000) -> int:
+    enqueued = 0
+    batch = []
+    for url in urls:
+        batch.append((url, normalize_url(url)))
+        if len(batch) >= batch_size:
+            enqueued += await db.enqueue_pages(dataset_id, batch)
+            batch = []
+    if batch:
+        enqueued += await db.enqueue_pages(dataset_id, batch)
+    return enqueued
+
+
+class IngestionWorker:
+    """Processes pages enqueued in smart_pages; any number of these can run side by side.
+
+    Pages are claimed in batches with FOR UPDATE SKIP LOCKED and leased to this worker,
+    and claiming goes on while fewer than max_in_flight pages are being processed, so
+    each dataset's pipeline is fed continuously instead of draining between batches.
+    A background heartbeat keeps the leases alive. A crashed worker's pages become
+    claimable again once its leases expire. Failed pages are retried with exponential
+    backoff until max_attempts; failures that would repeat (4xx, refused content) are not.
+    """
+
+    def __init__(self, db: DatabaseManager, dataset_id: Optional[str] = None,
+                 batch_size: int = Config.JOB_BATCH_SIZE,
+                 lease_seconds: int = Config.JOB_LEASE_SECONDS,
+                 heartbeat_interval: float = Config.JOB_HEARTBEAT_SECONDS,
+                 max_attempts: int = Config.JOB_MAX_ATTEMPTS,
+                 max_in_flight: int = Config.JOB_MAX_IN_FLIGHT,
+                 backoff_base: float = Config.JOB_BACKOFF_BASE,
+                 backoff_max: float = Config.JOB_BACKOFF_MAX,
+                 **pipeline_options):
+        self.db = db
+        self.dataset_id = dataset_id
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.max_attempts = max_attempts
+        self.max_in_flight = max(max_in_flight, batch_size)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # One HTTP session and OpenAI client for every dataset this worker touches
+        self.scraper = WebScraper()
+        self.embedder = EmbeddingGenerator()
+        self.pipeline_options = pipeline_options
+        self.pipelines: Dict[str, IngestionPipeline] = {}
+        # A long-lived run_jobs per dataset, fed through its queue; None ends it
+        self.feeds: Dict[str, asyncio.Queue] = {}
+        self.runs: Dict[str, asyncio.Task] = {}
+        self.attempts: Dict[str, int] = {}
+        self.in_flight = 0
+        self.finished = asyncio.Event()
+        self.stats = {"pages_done": 0, "pages_retried": 0, "pages_abandoned": 0}
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+
+    async def _pipeline(self, dataset_id: str) -> Optional[IngestionPipeline]:
+        pipeline = self.pipelines.get(dataset_id)
+        if pipeline is None:
+            pipeline = await IngestionPipeline.for_dataset(
+                self.db, dataset_id, scraper=self.scraper, embedder=self.embedder,
+                on_finished=self._on_finished, **self.pipeline_options
+            )
+            self.pipelines[dataset_id] = pipeline
+        return pipeline
+
+    async def _on_finished(self, job: PageJob, error: Optional[str]):
+        page_id = job.page_id
+        attempt = self.attempts.pop(page_id, 1)
+        try:
+            if error is None:
+                await self.db.complete_page_job(page_id, self.worker_id)
+                self.stats["pages_done"] += 1
+                JOBS_FINISHED.labels(outcome='done').inc()
+            elif attempt < self.max_attempts and not job.permanent_error:
+                retry_in = self._backoff(attempt)
+                await self.db.retry_page_job(page_id, self.worker_id, error, retry_in)
+                self.stats["pages_retried"] += 1
+                JOBS_FINISHED.labels(outcome='retried').inc()
+                logger.warning(f"{job.url}: attempt {attempt} failed, retrying in {retry_in:.0f}s")
+            else:
+                await self.db.retry_page_job(page_id, self.worker_id, error, None)
+                self.stats["pages_abandoned"] += 1
+                JOBS_FINISHED.labels(outcome='abandoned').inc()
+                logger.error(f"{job.url}: giving up after {attempt} attempts: {error}")
+        finally:
+            # Frees a slot for the claim loop even if the status update failed (the lease expires)
+            self.in_flight -= 1
+            self.finished.set()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.db.extend_page_leases(self.worker_id, self.lease_seconds)
+            except Exception as e:
+                # A missed beat is harmless as long as the next one lands before the lease runs out
+                logger.warning(f"Heartbeat failed: {str(e)}")
+
+    @staticmethod
+    async def _drain(feed: asyncio.Queue) -> AsyncIterator[PageJob]:
+        while True:
+            job = await feed.get()
+            if job is None:
+                return
+            yield job
+
+    async def _submit(self, dataset_id: str, jobs: List[PageJob]):
+        if dataset_id not in self.feeds:
+            pipeline = await self._pipeline(dataset_id)
+            if pipeline is None:
+                for job in jobs:
+                    await self._on_finished(job, f"Dataset {dataset_id} not found")
+                return
+            self.feeds[dataset_id] = asyncio.Queue()
+            self.runs[dataset_id] = asyncio.create_task(pipeline.run_jobs(self._drain(self.feeds[dataset_id])))
+        for job in jobs:
+            self.feeds[dataset_id].put_nowait(job)
+
+    async def run_once(self) -> int:
+        # Claims up to a batch into the free slots and hands it to the pipelines without waiting for it
+        limit = min(self.batch_size, self.max_in_flight - self.in_flight)
+        if limit <= 0:
+            return 0
+        claimed = await self.db.claim_pages(limit, self.worker_id,
+                                            dataset_id=self.dataset_id, lease_seconds=self.lease_seconds)
+        if not claimed:
+            return 0
+
+        by_dataset: Dict[str, List[PageJob]] = defaultdict(list)
+        for row in claimed:
+            page_id = str(row['id'])
+            self.attempts[page_id] = row['attempts']
+            by_dataset[str(row['datasetid'])].append(PageJob(url=row['url'], page_id=page_id))
+        self.in_flight += len(claimed)
+        for dataset_id, jobs in by_dataset.items():
+            await self._submit(dataset_id, jobs)
+        return len(claimed)
+
+    def _check_runs(self):
+        # A pipeline that died would hold its pages' slots forever
+        for run in self.runs.values():
+            if run.done():
+                run.result()
+
+    async def run(self, poll_interval: float = 5.0, stop_when_idle: bool = False) -> Dict[str, int]:
+        logger.info(f"Worker {self.worker_id} started")
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                self._check_runs()
+                self.finished.clear()
+                if self.in_flight < self.max_in_flight:
+                    if await self.run_once():
+                        continue
+                    if not self.in_flight:
+                        if stop_when_idle:
+                            break
+                        await asyncio.sleep(poll_interval)
+                        continue
+                # Claim again as soon as a page finishes; the timeout re-polls an empty queue
+                try:
+                    await asyncio.wait_for(self.finished.wait(), poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            # Let the pipelines finish and stop their stage workers
+            for feed in self.feeds.values():
+                feed.put_nowait(None)
+            await asyncio.gather(*self.runs.values())
+            return self.stats
+        finally:
+            heartbeat.cancel()
+            for run in self.runs.values():
+                run.cancel()
+            self.feeds.clear()
+            self.runs.clear()
+            await self.scraper.close()
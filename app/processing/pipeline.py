@@ -0,0 +1,438 @@
+import asyncio
+import logging
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+
+from app.config import Config
+from app.database import ChunkVersionChanged, DatabaseManager
+from app.metrics import REGISTRY
+from app.processing.scraper import WebScraper
+from app.processing.chunker import TextChunker, content_hash
+from app.processing.dedup import DUPLICATES, MinHasher, find_duplicates
+from app.processing.embedder import EmbeddingGenerator
+from app.processing.urls import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# Sentinel pushed through the queues to tell a stage worker to exit
+_STOP = object()
+
+STAGE_SECONDS = REGISTRY.histogram("pipeline_stage_seconds", "Handler latency per page", ["stage"])
+STAGE_IN_FLIGHT = REGISTRY.gauge("pipeline_stage_in_flight", "Pages being handled", ["stage"])
+STAGE_IDLE_SECONDS = REGISTRY.counter("pipeline_stage_idle_seconds_total", "Worker time spent waiting for input",
+                                      ["stage"])
+STAGE_BLOCKED_SECONDS = REGISTRY.counter("pipeline_stage_blocked_seconds_total",
+                                         "Worker time spent waiting for room in the next queue", ["stage"])
+QUEUE_DEPTH = REGISTRY.gauge("pipeline_queue_depth", "Pages waiting in front of a stage", ["stage"])
+PIPELINE_PAGES = REGISTRY.gauge("pipeline_pages", "Pages by result in the current run", ["result"])
+
+
+@dataclass
+class PageJob:
+    url: str
+    normalizedurl: Optional[str] = None
+    html: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content: Dict = field(default_factory=dict)
+    contenthash: Optional[str] = None
+    chunks: List[Dict] = field(default_factory=list)
+    page_id: Optional[str] = None
+    # Row of a previous crawl of the same (dataset, normalized URL), if any
+    existing: Optional[Dict] = None
+    stale_chunk_ids: List[str] = field(default_factory=list)
+    minhash: Optional[bytes] = None
+    page_bands: List[tuple] = field(default_factory=list)
+    duplicate_of: Optional[str] = None
+    # The failure will repeat on retry (4xx, refused content type or size)
+    permanent_error: bool = False
+
+
+class IngestionPipeline:
+    """Scrape -> extract -> chunk -> embed/enrich -> persist, linked by bounded queues.
+
+    Every stage runs its own pool of workers, so a slow dependency only holds back
+    the stages behind it once the queue in front of it is full.
+    """
+
+    def __init__(self, db: DatabaseManager, dataset_id: str,
+                 chunk_size: int = Config.DEFAULT_CHUNK_SIZE,
+                 chunk_overlap: int = Config.DEFAULT_CHUNK_OVERLAP,
+                 scraper: WebScraper = None, chunker: TextChunker = None,
+                 embedder: EmbeddingGenerator = None,
+                 queue_size: int = Config.PIPELINE_QUEUE_SIZE,
+                 scrape_workers: int = Config.PIPELINE_SCRAPE_WORKERS,
+                 extract_workers: int = Config.PIPELINE_EXTRACT_WORKERS,
+                 chunk_workers: int = Config.PIPELINE_CHUNK_WORKERS,
+                 dedup_workers: int = Config.PIPELINE_DEDUP_WORKERS,
+                 embed_workers: int = Config.PIPELINE_EMBED_WORKERS,
+                 persist_workers: int = Config.PIPELINE_PERSIST_WORKERS,
+                 enrichment_mode: str = Config.ENRICHMENT_MODE,
+                 dedup_mode: str = Config.DEDUP_MODE,
+                 dedup_threshold: float = Config.DEDUP_THRESHOLD,
+                 chunk_version: int = None, embedding_model: str = None,
+                 on_finished: Callable[[PageJob, Optional[str]], Awaitable[None]] = None,
+                 on_fetched: Callable[[PageJob], Awaitable[None]] = None):
+        if enrichment_mode not in ('inline', 'deferred'):
+            raise ValueError(f"Unknown enrichment mode: {enrichment_mode}")
+        if dedup_mode not in ('off', 'skip', 'link'):
+            raise ValueError(f"Unknown dedup mode: {dedup_mode}")
+        self.db = db
+        self.dataset_id = dataset_id
+        self.owns_scraper = scraper is None
+        self.scraper = scraper or WebScraper()
+        self.chunker = chunker or TextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.embedder = embedder or EmbeddingGenerator(encoding=self.chunker.encoding)
+        self.queue_size = queue_size
+        # Chunk set the pages are written into and the model its embeddings come from;
+        # refreshed when a re-chunk switches the dataset over (see refresh_settings)
+        self.chunk_version = chunk_version
+        self.embedding_model = embedding_model
+        # 'deferred' stores chunks right after embedding; EnrichmentWorker fills summaries later
+        self.enrichment_mode = enrichment_mode
+        # Called once per page with the error (None on success); the job queue hooks in here
+        self.on_finished = on_finished
+        # Called after a successful fetch, html is None for 304s; the crawler discovers links here
+        self.on_fetched = on_fetched
+        # Near-duplicate pages and chunks are caught between chunking and embedding
+        self.dedup_mode = dedup_mode
+        self.dedup_threshold = dedup_threshold
+        self.hasher = MinHasher() if dedup_mode != 'off' else None
+        self.stages = [
+            ("scrape", self._scrape, scrape_workers),
+            ("extract", self._extract, extract_workers),
+            ("chunk", self._chunk, chunk_workers),
+            ("dedup", self._dedup, dedup_workers),
+            ("embed", self._embed, embed_workers),
+            ("persist", self._persist, persist_workers),
+        ]
+        if self.hasher is None:
+            self.stages = [stage for stage in self.stages if stage[0] != 'dedup']
+        self.stats = {"pages_processed": 0, "pages_unchanged": 0, "pages_failed": 0, "pages_duplicate": 0,
+                      "chunks_created": 0, "chunks_reused": 0, "chunks_deleted": 0, "chunks_duplicate": 0}
+
+    @classmethod
+    async def for_dataset(cls, db: DatabaseManager, dataset_id: str, **kwargs) -> Optional["IngestionPipeline"]:
+        dataset_info = await db.get_dataset_info(dataset_id)
+        if not dataset_info:
+            return None
+        return cls(db, dataset_id,
+                   chunk_size=dataset_info['chunksize'],
+                   chunk_overlap=dataset_info['chunkoverlap'],
+                   chunk_version=dataset_info['chunkversion'],
+                   embedding_model=dataset_info['embeddingmodel'],
+                   **kwargs)
+
+    async def refresh_settings(self):
+        # Picks up the chunking settings and model of the dataset's active chunk version
+        dataset_info = await self.db.get_dataset_info(self.dataset_id)
+        if not dataset_info or dataset_info['chunkversion'] == self.chunk_version:
+            return
+        if (dataset_info['chunksize'], dataset_info['chunkoverlap']) != \
+                (self.chunker.chunk_size, self.chunker.chunk_overlap):
+            self.chunker = TextChunker(chunk_size=dataset_info['chunksize'],
+                                       chunk_overlap=dataset_info['chunkoverlap'])
+        self.chunk_version = dataset_info['chunkversion']
+        self.embedding_model = dataset_info['embeddingmodel']
+        logger.info(f"Dataset {self.dataset_id} switched to chunk version {self.chunk_version}")
+
+    async def run(self, urls: Iterable[str]) -> Dict[str, Any]:
+        return await self.run_jobs(PageJob(url=url.strip()) for url in urls if url.strip())
+
+    async def run_jobs(self, jobs: Union[Iterable[PageJob], AsyncIterable[PageJob]]) -> Dict[str, Any]:
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        runners = []
+        for (name, _, _), queue in zip(self.stages, queues):
+            QUEUE_DEPTH.labels(stage=name).set_function(queue.qsize)
+        for result in ("pages_processed", "pages_unchanged", "pages_failed"):
+            PIPELINE_PAGES.labels(result=result[len("pages_"):]).set_function(lambda key=result: self.stats[key])
+        for i, (name, handler, workers) in enumerate(self.stages):
+            out_queue = queues[i + 1] if i + 1 < len(queues) else None
+            next_workers = self.stages[i + 1][2] if out_queue else 0
+            runners.append(self._run_stage(name, handler, workers, queues[i], out_queue, next_workers))
+
+        try:
+            await asyncio.gather(self._feed(jobs, queues[0]), *runners)
+        finally:
+            if self.owns_scraper:
+                await self.scraper.close()
+        if self.embedder.cache is not None:
+            self.stats["cache"] = self.embedder.cache.stats()
+        logger.info(f"Ingestion finished: {self.stats}")
+        return self.stats
+
+    async def _feed(self, jobs: Union[Iterable[PageJob], AsyncIterable[PageJob]], queue: asyncio.Queue):
+        if hasattr(jobs, '__aiter__'):
+            async for job in jobs:
+                await queue.put(job)
+        else:
+            for job in jobs:
+                await queue.put(job)
+        for _ in range(self.stages[0][2]):
+            await queue.put(_STOP)
+
+    async def _run_stage(self, name: str, handler: Callable[[PageJob], Awaitable[Optional[PageJob]]],
+                         workers: int, in_queue: asyncio.Queue, out_queue: Optional[asyncio.Queue],
+                         next_workers: int):
+        seconds, in_flight = STAGE_SECONDS.labels(stage=name), STAGE_IN_FLIGHT.labels(stage=name)
+        idle, blocked = STAGE_IDLE_SECONDS.labels(stage=name), STAGE_BLOCKED_SECONDS.labels(stage=name)
+
+        async def worker():
+            while True:
+                waiting = time.perf_counter()
+                job = await in_queue.get()
+                started = time.perf_counter()
+                idle.inc(started - waiting)
+                if job is _STOP:
+                    return
+                try:
+                    with in_flight.track():
+                        result = await handler(job)
+                except Exception as e:
+                    logger.error(f"Stage {name} failed for {job.url}: {str(e)}")
+                    await self._fail(job, str(e))
+                    continue
+                finally:
+                    seconds.observe(time.perf_counter() - started)
+                if result is not None and out_queue is not None:
+                    waiting = time.perf_counter()
+                    await out_queue.put(result)
+                    blocked.inc(time.perf_counter() - waiting)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        if out_queue is not None:
+            for _ in range(next_workers):
+                await out_queue.put(_STOP)
+
+    async def _fail(self, job: PageJob, error: str):
+        self.stats["pages_failed"] += 1
+        if job.page_id:
+            await self.db.update_page_status(job.page_id, 'error', error)
+        await self._finish(job, error)
+
+    async def _finish(self, job: PageJob, error: Optional[str] = None):
+        if self.on_finished is None:
+            return
+        try:
+            await self.on_finished(job, error)
+        except Exception as e:
+            logger.error(f"Completion hook failed for {job.url}: {str(e)}")
+
+    async def _scrape(self, job: PageJob) -> Optional[PageJob]:
+        logger.info(f"Обрабатываем URL: {job.url}")
+        job.normalizedurl = normalize_url(job.url)
+        if job.page_id:
+            # Claimed from the job queue: the row already exists
+            page = await self.db.get_page(job.page_id)
+            job.existing = asdict(page) if page else None
+        else:
+            job.existing = await self.db.get_page_by_url(self.dataset_id, job.normalizedurl)
+        if job.existing:
+            job.page_id = str(job.existing['id'])
+
+        validators = {}
+        # A stored content hash means the page's chunks are complete, whatever its queue status
+        if job.existing and job.existing['contenthash']:
+            validators = {"etag": job.existing['etag'], "last_modified": job.existing['lastmodified']}
+        fetched = await self.scraper.fetch_html(job.url, **validators)
+        if fetched.get('error'):
+            logger.error(f"Ошибка при парсинге {job.url}: {fetched['error']}")
+            job.permanent_error = fetched.get('permanent', False)
+            self.stats["pages_failed"] += 1
+            await self._finish(job, fetched['error'])
+            return None
+        if fetched.get('not_modified'):
+            await self._fetched(job)
+            await self._unchanged(job)
+            return None
+        job.html = fetched['html']
+        job.etag = fetched.get('etag')
+        job.last_modified = fetched.get('last_modified')
+        await self._fetched(job)
+        return job
+
+    async def _fetched(self, job: PageJob):
+        if self.on_fetched is None:
+            return
+        try:
+            await self.on_fetched(job)
+        except Exception as e:
+            logger.error(f"Fetch hook failed for {job.url}: {str(e)}")
+
+    async def _unchanged(self, job: PageJob):
+        await self.db.touch_page(job.page_id, job.etag, job.last_modified)
+        self.stats["pages_unchanged"] += 1
+        logger.info(f"Страница {job.url} не изменилась")
+        await self._finish(job)
+
+    async def _extract(self, job: PageJob) -> Optional[PageJob]:
+        content = await self.scraper.extract_content(job.html, job.url)
+        job.html = None
+        if content.get('error'):
+            logger.error(f"Ошибка при парсинге {job.url}: {content['error']}")
+            self.stats["pages_failed"] += 1
+            await self._finish(job, content['error'])
+            return None
+        job.content = content
+        if content.get('cleantext'):
+            job.contenthash = content_hash(content['cleantext'])
+        if job.existing and job.contenthash and job.existing['contenthash'] == job.contenthash:
+            await self._unchanged(job)
+            return None
+        return job
+
+    async def _chunk(self, job: PageJob) -> PageJob:
+        if job.content.get('cleantext'):
+            # The splitter and tokenizer release the GIL, so a thread keeps the loop responsive
+            job.chunks = await asyncio.to_thread(self.chunker.chunk_text, job.content['cleantext'])
+
+        if job.existing:
+            # Keep chunks whose text survived the edit, drop the rest
+            existing_hashes = await self.db.get_chunk_hashes(job.page_id)
+            for chunk in job.chunks:
+                kept_ids = existing_hashes.get(chunk['contenthash'])
+                if kept_ids:
+                    chunk['id'] = kept_ids.pop()
+            job.stale_chunk_ids = [chunk_id for chunk_ids in existing_hashes.values() for chunk_id in chunk_ids]
+        return job
+
+    async def _dedup(self, job: PageJob) -> PageJob:
+        cleantext = job.content.get('cleantext')
+        if not cleantext:
+            return job
+        new_chunks = [chunk for chunk in job.chunks if 'id' not in chunk]
+        texts = [cleantext] + [chunk['text'] for chunk in new_chunks]
+        # numpy releases the GIL for the permutation arithmetic
+        signatures = await asyncio.to_thread(lambda: [self.hasher.signature(text) for text in texts])
+        job.minhash, chunk_signatures = signatures[0], signatures[1:]
+
+        if job.minhash is not None:
+            page_keys = self.hasher.band_keys(job.minhash)
+            candidates = await self.db.find_near_duplicates('page', self.dataset_id, page_keys,
+                                                            exclude_page_id=job.page_id)
+            job.duplicate_of = find_duplicates(self.hasher, [job.minhash], candidates, self.dedup_threshold)[0]
+            if job.duplicate_of:
+                # Same article under another URL: keep the page row, drop all of its chunks
+                DUPLICATES.labels(kind='page').inc()
+                self.stats["pages_duplicate"] += 1
+                logger.info(f"Страница {job.url} - почти дубликат {job.duplicate_of}")
+                job.stale_chunk_ids += [chunk['id'] for chunk in job.chunks if 'id' in chunk]
+                job.chunks = []
+                return job
+            job.page_bands = page_keys
+
+        keys = list({key for signature in chunk_signatures if signature is not None
+                     for key in self.hasher.band_keys(signature)})
+        candidates = await self.db.find_near_duplicates('chunk', self.dataset_id, keys,
+                                                        exclude_page_id=job.page_id)
+        matches = iter(find_duplicates(self.hasher, chunk_signatures, candidates, self.dedup_threshold))
+        signatures = iter(chunk_signatures)
+        kept = []
+        for chunk in job.chunks:
+            if 'id' in chunk:
+                kept.append(chunk)
+                continue
+            signature, match = next(signatures), next(matches)
+            chunk['minhash'] = signature
+            if match is None:
+                chunk['bands'] = self.hasher.band_keys(signature) if signature is not None else []
+                kept.append(chunk)
+                continue
+            DUPLICATES.labels(kind='chunk').inc()
+            self.stats["chunks_duplicate"] += 1
+            # Repeats within the page ('#<index>') are always dropped
+            if self.dedup_mode == 'link' and not match.startswith('#'):
+                chunk['canonicalid'] = match
+                chunk['status'] = 'duplicate'
+                kept.append(chunk)
+        job.chunks = kept
+        return job
+
+    async def _embed(self, job: PageJob) -> PageJob:
+        # Linked near-duplicates are stored without an embedding
+        new_chunks = [chunk for chunk in job.chunks if 'id' not in chunk and not chunk.get('canonicalid')]
+        if not new_chunks:
+            return job
+        texts = [chunk['text'] for chunk in new_chunks]
+        embedding_task = self.embedder.generate_embeddings_batch(texts, [chunk['tokencount'] for chunk in new_chunks],
+                                                                 model=self.embedding_model)
+        if self.enrichment_mode == 'deferred':
+            enrichments = [{}] * len(new_chunks)
+            embeddings = await embedding_task
+        else:
+            embeddings, enrichments = await asyncio.gather(
+                embedding_task,
+                asyncio.gather(*(self.embedder.generate_enrichment(text) for text in texts)),
+            )
+        missing = sum(1 for embedding in embeddings if embedding is None)
+        if missing:
+            # Never store chunks without an embedding; the page is marked failed and can be retried
+            raise RuntimeError(f"{missing} of {len(new_chunks)} embeddings failed")
+        for chunk, embedding, enrichment in zip(new_chunks, embeddings, enrichments):
+            chunk['embedding'] = embedding
+            chunk['summary'] = enrichment.get('summary')
+            chunk['contextretrieval'] = enrichment.get('contextretrieval')
+        return job
+
+    async def _persist(self, job: PageJob) -> None:
+        content = job.content
+        new_chunks = [chunk for chunk in job.chunks if 'id' not in chunk]
+        page_fields = dict(
+            title=content.get('title'),
+            rawhtml=content.get('rawhtml'),
+            cleantext=content.get('cleantext'),
+            wordcount=content.get('wordcount'),
+            # Pages without extracted text keep the default status, as before
+            status='processed' if content.get('cleantext') else 'pending',
+            etag=job.etag,
+            lastmodified=job.last_modified,
+            contenthash=job.contenthash,
+            minhash=job.minhash,
+            duplicateof=job.duplicate_of,
+            bands=job.page_bands
+        )
+
+        try:
+            if job.existing:
+                await self.db.update_page_with_chunks(
+                    page_id=job.page_id,
+                    chunks=new_chunks,
+                    stale_chunk_ids=job.stale_chunk_ids,
+                    chunk_version=self.chunk_version,
+                    **page_fields
+                )
+            else:
+                job.page_id = await self.db.save_page_with_chunks(
+                    dataset_id=self.dataset_id,
+                    url=job.url,
+                    chunks=new_chunks,
+                    normalizedurl=job.normalizedurl,
+                    chunk_version=self.chunk_version,
+                    **page_fields
+                )
+        except ChunkVersionChanged:
+            # The chunks were cut for the old version; the page fails and its retry uses the new settings
+            await self.refresh_settings()
+            raise
+
+        await self._finish(job)
+        if not content.get('cleantext'):
+            return None
+
+        self.stats["chunks_created"] += sum(1 for chunk in new_chunks if not chunk.get('canonicalid'))
+        self.stats["chunks_reused"] += len(job.chunks) - len(new_chunks)
+        self.stats["chunks_deleted"] += len(job.stale_chunk_ids)
+        self.stats["pages_processed"] += 1
+        logger.info(f"Страница {job.url} обработана успешно "
+                    f"({len(new_chunks)} новых чанков, {len(job.stale_chunk_ids)} удалено)")
+        return None
+
+
+def read_urls(stream) -> Iterable[str]:
+    # Accepts one URL per line; comma separated lists are split as well
+    for line in stream:
+        for url in line.split(','):
+            url = url.strip()
+            if url and not url.startswith('#'):
+                yield url
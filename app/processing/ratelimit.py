@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import random
+import re
+import time
+from typing import Awaitable, Callable, Dict, Mapping, Optional
+
+import openai
+
+from app.config import Config
+from app.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+OPENAI_REQUEST_SECONDS = REGISTRY.histogram("openai_request_seconds", "OpenAI request latency per attempt",
+                                            ["model", "outcome"])
+OPENAI_WAIT_SECONDS = REGISTRY.histogram("openai_wait_seconds", "Time waiting for concurrency and RPM/TPM budget",
+                                         ["model"])
+OPENAI_TOKENS = REGISTRY.counter("openai_tokens_total", "Tokens sent (estimated before the request)", ["model"])
+OPENAI_IN_FLIGHT = REGISTRY.gauge("openai_in_flight", "OpenAI requests in flight", ["model"])
+OPENAI_CONCURRENCY = REGISTRY.gauge("openai_concurrency_limit", "Current adaptive concurrency limit", ["model"])
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    # OpenAI reset headers look like "20ms", "1s", "6m0s"
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, capacity: float = None):
+        # Bursts up to capacity, a minute's worth by default; starts full
+        self.capacity = per_minute if capacity is None else capacity
+        self.available = self.capacity
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def consume(self, amount: float):
+        self.available -= min(amount, self.capacity)
+
+    def clamp(self, remaining: float):
+        # The server knows better (other processes share the quota)
+        self._refill()
+        self.available = min(self.available, remaining)
+
+
+class ModelLimiter:
+    """RPM/TPM budget and adaptive concurrency for one model.
+
+    Concurrency grows by one after a window of successful calls and halves on a 429
+    (AIMD), between 1 and max_concurrency.
+    """
+
+    def __init__(self, model: str, rpm: float, tpm: float, max_concurrency: int):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.limit = max(1, max_concurrency // 2)
+        self.in_flight = 0
+        self.successes = 0
+        self.paused_until = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # Created on first use in the running loop: the limiter is shared process-wide and may
+        # outlive the loop it was first used in
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition, self._loop = asyncio.Condition(), loop
+        return self._condition
+
+    async def acquire(self, tokens: int):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        try:
+            while True:
+                delay = max(self.requests.delay_for(1), self.tokens.delay_for(tokens),
+                            self.paused_until - time.monotonic())
+                if delay <= 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(tokens)
+                    return
+                await asyncio.sleep(delay)
+        except BaseException:
+            # Cancelled while waiting for budget: call() never gets to release the slot
+            await self.release(succeeded=False)
+            raise
+
+    async def release(self, throttled: bool = False, succeeded: bool = True):
+        async with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+                logger.warning(f"{self.model}: throttled, concurrency lowered to {self.limit}")
+            elif succeeded:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        remaining_requests = headers.get('x-ratelimit-remaining-requests')
+        remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+        if remaining_requests is not None:
+            self.requests.clamp(float(remaining_requests))
+            if float(remaining_requests) <= 0:
+                self.pause(parse_reset(headers.get('x-ratelimit-reset-requests')) or 1.0)
+        if remaining_tokens is not None:
+            self.tokens.clamp(float(remaining_tokens))
+            if float(remaining_tokens) <= 0:
+                self.pause(parse_reset(headers.get('x-ratelimit-reset-tokens')) or 1.0)
+
+
+class RateLimiter:
+    def __init__(self, max_concurrency: int = Config.OPENAI_MAX_CONCURRENCY,
+                 max_retries: int = Config.OPENAI_MAX_RETRIES, share: float = 1.0):
+        if not 0 < share <= 1:
+            raise ValueError("share must be in (0, 1]")
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        # Part of each model's quota this limiter may use; background jobs leave the rest to live traffic
+        self.share = share
+        self.models: Dict[str, ModelLimiter] = {}
+
+    def for_model(self, model: str) -> ModelLimiter:
+        limiter = self.models.get(model)
+        if limiter is None:
+            limits = Config.OPENAI_RATE_LIMITS.get(model, {})
+            limiter = ModelLimiter(
+                model,
+                rpm=limits.get('rpm', Config.OPENAI_DEFAULT_RPM) * self.share,
+                tpm=limits.get('tpm', Config.OPENAI_DEFAULT_TPM) * self.share,
+                max_concurrency=max(1, int(limits.get('concurrency', self.max_concurrency) * self.share))
+            )
+            self.models[model] = limiter
+            OPENAI_IN_FLIGHT.labels(model=model).set_function(lambda: limiter.in_flight)
+            OPENAI_CONCURRENCY.labels(model=model).set_function(lambda: limiter.limit)
+        return limiter
+
+    def _backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return retry_after + random.uniform(0, 0.5)
+        return min(60.0, 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def call(self, model: str, tokens: int, request: Callable[[], Awaitable]):
+        # request() must return a raw response (client.<...>.with_raw_response.create)
+        limiter = self.for_model(model)
+        for attempt in range(self.max_retries + 1):
+            final = attempt == self.max_retries
+            with OPENAI_WAIT_SECONDS.labels(model=model).time():
+                await limiter.acquire(tokens)
+            OPENAI_TOKENS.labels(model=model).inc(tokens)
+            throttled = succeeded = False
+            outcome = 'error'
+            started = time.perf_counter()
+            try:
+                raw = await request()
+                limiter.update_from_headers(raw.headers)
+                succeeded = True
+                outcome = 'ok'
+                return raw.parse()
+            except openai.RateLimitError as e:
+                outcome = 'throttled'
+                if e.code == 'insufficient_quota' or final:
+                    raise
+                throttled = True
+                retry_after = parse_reset(e.response.headers.get('retry-after-ms'))
+                if retry_after is not None:
+                    retry_after /= 1000
+                else:
+                    retry_after = parse_reset(e.response.headers.get('retry-after'))
+                delay = self._backoff(attempt, retry_after)
+                limiter.pause(delay)
+                logger.warning(f"{model}: rate limited, retrying in {delay:.1f}s")
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                if final:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"{model}: {type(e).__name__}, retrying in {delay:.1f}s")
+            finally:
+                OPENAI_REQUEST_SECONDS.labels(model=model, outcome=outcome).observe(time.perf_counter() - started)
+                await limiter.release(throttled=throttled, succeeded=succeeded)
+            await asyncio.sleep(delay)
+
+
+_shared_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    # One limiter per process, shared by every EmbeddingGenerator
+    global _shared_limiter
+    if _shared_limiter is None:
+        _shared_limiter = RateLimiter()
+    return _shared_limiter
@@ -0,0 +1,244 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from app.config import Config
+from app.database import SEARCH_SETTINGS_TTL, DatabaseManager
+from app.metrics import REGISTRY
+from app.processing.chunker import TextChunker
+from app.processing.dedup import DUPLICATES, MinHasher, find_duplicates
+from app.processing.embedder import EmbeddingGenerator
+from app.processing.ratelimit import RateLimiter, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+RECHUNK_PAGES = REGISTRY.counter("rechunk_pages_total", "Pages handled by a chunk version rebuild", ["outcome"])
+
+
+class RechunkJob:
+    """Rebuilds a dataset's chunks with new chunking settings or a new embedding model.
+
+    The new chunks are written as the next chunk version while search keeps reading
+    the active one. Progress is each page's chunkversion, so a stopped job resumes
+    where it left off, and pages recrawled in the meantime drop back to the active
+    version and come round in the next pass. Once no page is left the dataset is
+    switched over in one short transaction and the old chunks are deleted in batches.
+
+    Pages are read and embedded at a bounded rate, with only api_share of the OpenAI
+    quota, so live ingestion and search keep their headroom. Summaries and (for an
+    unchanged model) embeddings of chunks whose text survived carry over; the rest is
+    left for EnrichmentWorker.
+    """
+
+    def __init__(self, db: DatabaseManager, dataset_id: str,
+                 chunk_size: int = None, chunk_overlap: int = None, embedding_model: str = None,
+                 embedder: EmbeddingGenerator = None,
+                 batch_pages: int = Config.RECHUNK_BATCH_PAGES,
+                 pages_per_second: float = Config.RECHUNK_PAGES_PER_SECOND,
+                 api_share: float = Config.RECHUNK_API_SHARE,
+                 dedup_mode: str = Config.DEDUP_MODE,
+                 dedup_threshold: float = Config.DEDUP_THRESHOLD,
+                 gc_batch: int = Config.RECHUNK_GC_BATCH,
+                 gc_pause: float = Config.RECHUNK_GC_PAUSE,
+                 max_passes: int = 10):
+        if dedup_mode not in ('off', 'skip', 'link'):
+            raise ValueError(f"Unknown dedup mode: {dedup_mode}")
+        self.db = db
+        self.dataset_id = dataset_id
+        # None keeps the setting of the version being built, or else the dataset's current one
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embedding_model = embedding_model
+        self.embedder = embedder
+        self.api_share = api_share
+        self.batch_pages = batch_pages
+        # Bursts of one batch at most, so the rate holds from the first batch on
+        self.pages = TokenBucket(pages_per_second * 60, capacity=batch_pages) if pages_per_second > 0 else None
+        self.dedup_mode = dedup_mode
+        self.dedup_threshold = dedup_threshold
+        self.hasher = MinHasher() if dedup_mode != 'off' else None
+        self.gc_batch = gc_batch
+        self.gc_pause = gc_pause
+        self.max_passes = max_passes
+        self.version: Optional[int] = None
+        self.stats = {"pages_rebuilt": 0, "pages_changed": 0, "pages_failed": 0, "chunks_created": 0,
+                      "chunks_duplicate": 0, "embeddings_reused": 0, "enrichments_reused": 0,
+                      "chunks_collected": 0, "switched": False}
+
+    async def start(self) -> Dict:
+        dataset = await self.db.get_dataset_info(self.dataset_id)
+        if not dataset:
+            raise ValueError(f"Dataset {self.dataset_id} not found")
+        self.active_model = dataset['embeddingmodel'] or Config.EMBEDDING_MODEL
+        building = next((row for row in await self.db.get_chunk_versions(self.dataset_id)
+                         if row['status'] == 'building'), None)
+        defaults = building or {"chunksize": dataset['chunksize'], "chunkoverlap": dataset['chunkoverlap'],
+                                "embeddingmodel": self.active_model}
+        version = await self.db.start_chunk_version(
+            self.dataset_id,
+            self.chunk_size if self.chunk_size is not None else defaults['chunksize'],
+            self.chunk_overlap if self.chunk_overlap is not None else defaults['chunkoverlap'],
+            self.embedding_model or defaults['embeddingmodel']
+        )
+        self.version = version['version']
+        self.model = version['embeddingmodel']
+        self.chunker = TextChunker(chunk_size=version['chunksize'], chunk_overlap=version['chunkoverlap'])
+        # Vectors of another model are not comparable, so only an unchanged model reuses them
+        self.reuse_embeddings = self.model == self.active_model
+        if self.embedder is None:
+            self.embedder = EmbeddingGenerator(encoding=self.chunker.encoding,
+                                               limiter=RateLimiter(share=self.api_share))
+        logger.info(f"Building chunk version {self.version} of dataset {self.dataset_id}: "
+                    f"chunk size {version['chunksize']}, overlap {version['chunkoverlap']}, model {self.model}")
+        return version
+
+    async def _throttle(self, pages: int):
+        if self.pages is None:
+            return
+        while True:
+            delay = self.pages.delay_for(pages)
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        self.pages.consume(pages)
+
+    def _reuse(self, pages: List, chunk_lists: List[List[Dict]], reusable: Dict[tuple, Dict]):
+        for row, chunks in zip(pages, chunk_lists):
+            for chunk in chunks:
+                old = reusable.get((str(row['id']), chunk['contenthash']))
+                if old is None:
+                    continue
+                for key in ('summary', 'contextretrieval', 'domainmeta1', 'domainmeta2'):
+                    chunk[key] = old[key]
+                if old['summary'] or old['contextretrieval']:
+                    chunk['status'] = 'enriched'
+                    self.stats["enrichments_reused"] += 1
+                if self.reuse_embeddings and old.get('embedding') is not None:
+                    chunk['embedding'] = old['embedding']
+                    self.stats["embeddings_reused"] += 1
+
+    async def _dedup(self, pages: List, chunk_lists: List[List[Dict]]) -> List[List[Dict]]:
+        # Against chunks already in the new version; the batch's own pages only have leftovers there
+        flat = [chunk for chunks in chunk_lists for chunk in chunks]
+        signatures = await asyncio.to_thread(lambda: [self.hasher.signature(chunk['text']) for chunk in flat])
+        keys = list({key for signature in signatures if signature is not None
+                     for key in self.hasher.band_keys(signature)})
+        candidates = await self.db.find_near_duplicates(
+            'chunk', self.dataset_id, keys, version=self.version,
+            exclude_page_ids=[str(row['id']) for row in pages],
+            limit=Config.DEDUP_MAX_CANDIDATES * len(pages)
+        )
+        matches = iter(find_duplicates(self.hasher, signatures, candidates, self.dedup_threshold))
+        signatures = iter(signatures)
+        result = []
+        for chunks in chunk_lists:
+            kept = []
+            for chunk in chunks:
+                signature, match = next(signatures), next(matches)
+                chunk['minhash'] = signature
+                if match is None:
+                    chunk['bands'] = self.hasher.band_keys(signature) if signature is not None else []
+                    kept.append(chunk)
+                    continue
+                DUPLICATES.labels(kind='chunk').inc()
+                self.stats["chunks_duplicate"] += 1
+                if chunk.get('embedding') is not None:
+                    # Counted by _reuse, but a duplicate is dropped or stored without its vector
+                    self.stats["embeddings_reused"] -= 1
+                # Repeats within the batch ('#<index>') are dropped, as during ingestion
+                if self.dedup_mode == 'link' and not match.startswith('#'):
+                    chunk.update(canonicalid=match, status='duplicate', embedding=None)
+                    kept.append(chunk)
+            result.append(kept)
+        return result
+
+    async def _process(self, rows: List) -> int:
+        await self._throttle(len(rows))
+        # Near-duplicate pages and pages without text have no chunks in any version
+        pages = [row for row in rows if row['cleantext'] and not row['duplicateof']]
+        chunk_lists = await asyncio.to_thread(self.chunker.chunk_many, [row['cleantext'] for row in pages])
+        reusable = await self.db.get_reusable_chunks([str(row['id']) for row in pages],
+                                                     include_embeddings=self.reuse_embeddings)
+        self._reuse(pages, chunk_lists, reusable)
+        if self.hasher is not None and pages:
+            chunk_lists = await self._dedup(pages, chunk_lists)
+
+        new_chunks = [chunk for chunks in chunk_lists for chunk in chunks
+                      if chunk.get('embedding') is None and not chunk.get('canonicalid')]
+        if new_chunks:
+            embeddings = await self.embedder.generate_embeddings_batch(
+                [chunk['text'] for chunk in new_chunks], [chunk['tokencount'] for chunk in new_chunks],
+                model=self.model
+            )
+            for chunk, embedding in zip(new_chunks, embeddings):
+                chunk['embedding'] = embedding
+
+        chunks_by_page = {str(row['id']): chunks for row, chunks in zip(pages, chunk_lists)}
+        save, failed = [], 0
+        for row in rows:
+            page_id = str(row['id'])
+            chunks = chunks_by_page.get(page_id, [])
+            if any(chunk.get('embedding') is None and not chunk.get('canonicalid') for chunk in chunks):
+                # Never store chunks without an embedding; the page comes round in the next pass
+                failed += 1
+                continue
+            save.append((page_id, row['contenthash'], chunks))
+        saved = set(await self.db.save_version_chunks(self.dataset_id, self.version, save)) if save else set()
+
+        changed = len(save) - len(saved)
+        self.stats["pages_rebuilt"] += len(saved)
+        self.stats["pages_changed"] += changed
+        self.stats["pages_failed"] += failed
+        self.stats["chunks_created"] += sum(len(chunks) for page_id, _, chunks in save if page_id in saved)
+        RECHUNK_PAGES.labels(outcome='rebuilt').inc(len(saved))
+        RECHUNK_PAGES.labels(outcome='changed').inc(changed)
+        RECHUNK_PAGES.labels(outcome='failed').inc(failed)
+        return len(rows)
+
+    async def run_pass(self) -> int:
+        # Pages seen in this pass; pages edited while it ran are left for the next one
+        seen = 0
+        async for rows in self.db.iter_pages_for_version(self.dataset_id, self.version, self.batch_pages):
+            seen += await self._process(rows)
+            logger.info(f"Chunk version {self.version}: {self.stats['pages_rebuilt']} pages rebuilt")
+        return seen
+
+    async def build(self, switch: bool = True) -> bool:
+        # Passes until none is left, then the switch; True once the new version is active
+        if self.version is None:
+            await self.start()
+        for _ in range(self.max_passes):
+            if await self.run_pass():
+                continue
+            if not switch:
+                return False
+            if await self.db.switch_chunk_version(self.dataset_id, self.version):
+                self.stats["switched"] = True
+                logger.info(f"Dataset {self.dataset_id} switched to chunk version {self.version}")
+                return True
+            # A page was rewritten under the old version, or live writes held the lock too long
+            logger.info(f"Chunk version {self.version} not switched yet, running another pass")
+            await asyncio.sleep(1.0)
+        logger.warning(f"Chunk version {self.version} still has pages left after {self.max_passes} passes")
+        return False
+
+    async def collect(self) -> int:
+        # Deletes chunks of retired and aborted versions in small batches with pauses in between
+        collected = 0
+        while True:
+            deleted = await self.db.collect_chunk_versions(self.dataset_id, self.gc_batch)
+            if not deleted:
+                break
+            collected += deleted
+            await asyncio.sleep(self.gc_pause)
+        self.stats["chunks_collected"] += collected
+        if collected:
+            logger.info(f"Deleted {collected} chunks of old versions of dataset {self.dataset_id}")
+        return collected
+
+    async def run(self, switch: bool = True, collect: bool = True) -> Dict:
+        if await self.build(switch) and collect:
+            # Searchers keep their cached (model, version) settings this long after the switch
+            await asyncio.sleep(SEARCH_SETTINGS_TTL)
+            await self.collect()
+        return self.stats
@@ -1,56 +1,273 @@
 import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
-import trafilatura
+import codecs
+import random
+import re
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 from typing import Dict, Optional
 import logging
+from app.config import Config
+from app.metrics import REGISTRY
+from app.processing.extractor import ContentExtractor, extract_content
 
 logger = logging.getLogger(__name__)
 
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+FETCH_SECONDS = REGISTRY.histogram("fetch_seconds", "HTTP fetch latency per attempt", ["outcome"])
+FETCH_WAIT_SECONDS = REGISTRY.histogram("fetch_wait_seconds", "Time waiting for the per-host limiter and a connection slot")
+FETCH_IN_FLIGHT = REGISTRY.gauge("fetch_in_flight", "HTTP requests in flight")
+DOWNLOADED_BYTES = REGISTRY.counter("downloaded_bytes_total", "Response bytes downloaded (after transfer decoding)")
+FETCH_REJECTED = REGISTRY.counter("fetch_rejected_total", "Responses refused by content type or size", ["reason"])
+
+READ_CHUNK_SIZE = 64 * 1024
+_META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_:.-]+)', re.IGNORECASE)
+_BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+
+class FetchRejected(Exception):
+    """Response refused by content type or size; fetching it again will not help."""
+    
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+def sniff_encoding(head: bytes) -> Optional[str]:
+    # BOM, then <meta charset> or http-equiv within the first KB, like the HTML prescan
+    for bom, name in _BOMS:
+        if head.startswith(bom):
+            return name
+    match = _META_CHARSET.search(head[:1024])
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            return None
+    return None
+
+def check_content_type(response: aiohttp.ClientResponse, allowed=Config.SCRAPER_CONTENT_TYPES):
+    # Decided from the headers alone; a missing Content-Type is given the benefit of the doubt
+    if 'Content-Type' in response.headers and response.content_type not in allowed:
+        raise FetchRejected('content_type', f"Unsupported content type: {response.content_type}")
+
+async def read_body(response: aiohttp.ClientResponse, max_bytes: int = Config.SCRAPER_MAX_BYTES) -> bytearray:
+    # Streams into one growing buffer and stops as soon as the cap is crossed
+    if response.content_length is not None and response.content_length > max_bytes:
+        raise FetchRejected('size', f"Body of {response.content_length} bytes exceeds {max_bytes}")
+    buffer = bytearray()
+    async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+        if len(buffer) + len(chunk) > max_bytes:
+            raise FetchRejected('size', f"Body exceeds {max_bytes} bytes")
+        buffer += chunk
+    return buffer
+
+def decode_html(buffer: bytearray, charset: Optional[str] = None) -> str:
+    # One decode straight from the buffer; only the first KB is sniffed, never the whole body
+    encoding = charset or sniff_encoding(bytes(buffer[:1024]))
+    if encoding:
+        try:
+            return buffer.decode(encoding, errors='replace')
+        except LookupError:
+            pass
+    try:
+        return buffer.decode('utf-8')
+    except UnicodeDecodeError:
+        return buffer.decode(Config.SCRAPER_FALLBACK_ENCODING, errors='replace')
+
+async def read_html(response: aiohttp.ClientResponse, max_bytes: int = Config.SCRAPER_MAX_BYTES) -> str:
+    check_content_type(response)
+    return decode_html(await read_body(response, max_bytes), response.charset)
+
+class HostLimiter:
+    """Per-domain concurrency cap plus a minimum spacing between request starts."""
+    
+    def __init__(self, concurrency: int, rate: float):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def wait_turn(self):
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            now = loop.time()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    def pause(self, seconds: float):
+        # Push back every queued request for this host (429 / Retry-After)
+        loop = asyncio.get_running_loop()
+        self.next_slot = max(self.next_slot, loop.time() + seconds)
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
 class WebScraper:
-    def __init__(self, timeout: int = 30, max_concurrent: int = 5):
+    def __init__(self, timeout: int = Config.REQUEST_TIMEOUT, max_concurrent: int = Config.SCRAPER_MAX_CONNECTIONS,
+                 max_per_host: int = Config.SCRAPER_MAX_PER_HOST, host_rate: float = Config.SCRAPER_HOST_RATE,
+                 max_retries: int = Config.SCRAPER_MAX_RETRIES, extractor: ContentExtractor = None,
+                 max_bytes: int = Config.SCRAPER_MAX_BYTES):
         self.timeout = aiohttp.ClientTimeout(total=timeout)
         self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self.max_per_host = max_per_host
+        self.host_rate = host_rate
+        self.max_retries = max_retries
+        self.max_bytes = max_bytes
+        self.host_limiters: Dict[str, HostLimiter] = {}
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.extractor = extractor or ContentExtractor()
+    
+    async def __aenter__(self):
+        self._get_session()
+        return self
+    
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        # One long-lived session: keep-alive connections, DNS cache and TLS sessions are reused
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_concurrent,
+                limit_per_host=self.max_per_host,
+                ttl_dns_cache=Config.SCRAPER_DNS_TTL,
+                enable_cleanup_closed=True
+            )
+            self.session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=connector,
+                headers={"User-Agent": Config.SCRAPER_USER_AGENT}
+            )
+        return self.session
+    
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.extractor.close()
+    
+    def _host_limiter(self, url: str) -> HostLimiter:
+        host = (urlsplit(url).hostname or '').lower()
+        limiter = self.host_limiters.get(host)
+        if limiter is None:
+            overrides = Config.SCRAPER_DOMAIN_LIMITS.get(host, {})
+            limiter = HostLimiter(
+                concurrency=overrides.get('concurrency', self.max_per_host),
+                rate=overrides.get('rate', self.host_rate)
+            )
+            self.host_limiters[host] = limiter
+        return limiter
+    
+    def _backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return min(retry_after, Config.SCRAPER_MAX_RETRY_AFTER)
+        return Config.SCRAPER_BACKOFF_BASE * (2 ** attempt) * (0.5 + random.random())
+    
+    async def fetch_html(self, url: str, etag: Optional[str] = None,
+                         last_modified: Optional[str] = None, binary: bool = False,
+                         max_bytes: Optional[int] = None) -> Dict[str, Optional[str]]:
+        # binary=True returns the undecoded body of any content type under "body" (gzipped sitemaps).
+        # "permanent" in an error result means retrying later is pointless (4xx, refused content).
+        session = self._get_session()
+        limiter = self._host_limiter(url)
+        # Conditional request: an unchanged page answers 304 without a body
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
         
+        for attempt in range(self.max_retries + 1):
+            final = attempt == self.max_retries
+            waiting = time.perf_counter()
+            async with limiter.semaphore:
+                await limiter.wait_turn()
+                async with self.semaphore:
+                    started = time.perf_counter()
+                    FETCH_WAIT_SECONDS.observe(started - waiting)
+                    outcome = 'error'
+                    try:
+                        with FETCH_IN_FLIGHT.track():
+                            async with session.get(url, headers=headers) as response:
+                                outcome = str(response.status)
+                                if response.status == 304:
+                                    return {"not_modified": True, "error": None}
+                                if response.status == 200 and binary:
+                                    body = await read_body(response, max_bytes or self.max_bytes)
+                                    DOWNLOADED_BYTES.inc(response.content.total_bytes)
+                                    return {"body": bytes(body), "error": None}
+                                if response.status == 200:
+                                    html_content = await read_html(response, max_bytes or self.max_bytes)
+                                    DOWNLOADED_BYTES.inc(response.content.total_bytes)
+                                    return {
+                                        "html": html_content,
+                                        "etag": response.headers.get('ETag'),
+                                        "last_modified": response.headers.get('Last-Modified'),
+                                        "error": None
+                                    }
+                                if response.status not in RETRY_STATUSES or final:
+                                    logger.error(f"Failed to fetch {url}: HTTP {response.status}")
+                                    return {"error": f"HTTP {response.status}",
+                                            "permanent": response.status not in RETRY_STATUSES}
+                                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                                delay = self._backoff(attempt, retry_after)
+                                if response.status in (429, 503):
+                                    limiter.pause(delay)
+                                logger.warning(f"HTTP {response.status} for {url}, retrying in {delay:.1f}s")
+                    except FetchRejected as e:
+                        outcome = 'rejected'
+                        FETCH_REJECTED.labels(reason=e.reason).inc()
+                        DOWNLOADED_BYTES.inc(response.content.total_bytes)
+                        logger.warning(f"Skipping {url}: {str(e)}")
+                        return {"error": str(e), "permanent": True}
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        if final:
+                            logger.error(f"Error scraping {url}: {str(e)}")
+                            return {"error": str(e) or type(e).__name__}
+                        delay = self._backoff(attempt)
+                        logger.warning(f"Error scraping {url}: {str(e)}, retrying in {delay:.1f}s")
+                    except Exception as e:
+                        logger.error(f"Error scraping {url}: {str(e)}")
+                        return {"error": str(e)}
+                    finally:
+                        FETCH_SECONDS.labels(outcome=outcome).observe(time.perf_counter() - started)
+            await asyncio.sleep(delay)
+    
     async def scrape_url(self, url: str) -> Dict[str, Optional[str]]:
-        async with self.semaphore:
-            try:
-                async with aiohttp.ClientSession(timeout=self.timeout) as session:
-                    async with session.get(url) as response:
-                        if response.status == 200:
-                            html_content = await response.text()
-                            return self._extract_content(html_content, url)
-                        else:
-                            logger.error(f"Failed to fetch {url}: HTTP {response.status}")
-                            return {"error": f"HTTP {response.status}"}
-            except Exception as e:
-                logger.error(f"Error scraping {url}: {str(e)}")
-                return {"error": str(e)}
+        fetched = await self.fetch_html(url)
+        if fetched.get('error'):
+            return fetched
+        return await self.extract_content(fetched['html'], url)
+    
+    async def extract_content(self, html: str, url: str) -> Dict[str, Optional[str]]:
+        return self._with_html(await self.extractor.extract(html, url), html)
     
     def _extract_content(self, html: str, url: str) -> Dict[str, Optional[str]]:
-        try:
-            # Extract clean text using trafilatura
-            clean_text = trafilatura.extract(html, include_comments=False, 
-                                           include_tables=True, include_links=True)
-            
-            # Extract title using BeautifulSoup
-            soup = BeautifulSoup(html, 'html.parser')
-            title = soup.find('title')
-            title_text = title.get_text().strip() if title else None
-            
-            # Count words
-            word_count = len(clean_text.split()) if clean_text else 0
-            
-            return {
-                "title": title_text,
-                "rawhtml": html,
-                "cleantext": clean_text,
-                "wordcount": word_count,
-                "error": None
-            }
-        except Exception as e:
-            logger.error(f"Error extracting content from {url}: {str(e)}")
-            return {"error": str(e)}
+        # Synchronous variant, parses on the calling thread
+        return self._with_html(extract_content(html, url), html)
+    
+    @staticmethod
+    def _with_html(content: Dict[str, Optional[str]], html: str) -> Dict[str, Optional[str]]:
+        # The pool returns only the extracted fields; the page is attached here, not sent back
+        if not content.get('error'):
+            content['rawhtml'] = html
+        return content
     
     async def scrape_multiple_urls(self, urls: list) -> Dict[str, Dict]:
         tasks = [self.scrape_url(url) for url in urls]
@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Optional
+
+import zstandard
+
+from app.config import Config
+from app.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RAW_BYTES = REGISTRY.counter("raw_store_bytes_total", "Raw HTML bytes before and after compression", ["kind"])
+
+
+def raw_hash(html: str) -> str:
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+
+class RawContentStore(ABC):
+    """Content-addressed raw HTML, kept out of smart_pages.
+
+    Pages point at their HTML by sha256 (smart_pages.rawhash), so identical pages
+    share one copy. Every method takes the caller's connection, which lets the
+    Postgres store write inside the page's transaction.
+
+    put() also refreshes the entry's timestamp when the content is already stored.
+    Garbage collection leaves entries touched within the grace period alone, so
+    content whose page row has not committed yet is never deleted.
+    """
+
+    codec = 'zstd'
+
+    def __init__(self, level: int = Config.RAW_STORE_LEVEL):
+        self.level = level
+
+    def compress(self, html: str) -> bytes:
+        raw = html.encode('utf-8')
+        # Compressor objects are not safe to share between threads; they are cheap to create
+        data = zstandard.ZstdCompressor(level=self.level).compress(raw)
+        RAW_BYTES.labels(kind='raw').inc(len(raw))
+        RAW_BYTES.labels(kind='stored').inc(len(data))
+        return data
+
+    def decompress(self, data: bytes) -> str:
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+
+    @abstractmethod
+    async def put(self, conn, html: str) -> str:
+        ...
+
+    @abstractmethod
+    async def get(self, conn, rawhash: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def hashes(self, conn, older_than: float = 0) -> List[str]:
+        ...
+
+    @abstractmethod
+    async def delete(self, conn, rawhashes: Iterable[str], older_than: float = 0):
+        ...
+
+    async def collect_garbage(self, conn, batch_size: int = 1000, grace: float = Config.RAW_STORE_GC_GRACE) -> int:
+        # Drops content that no page references any more and nothing has stored for grace seconds
+        removed = 0
+        stored = await self.hashes(conn, older_than=grace)
+        for start in range(0, len(stored), batch_size):
+            batch = stored[start:start + batch_size]
+            referenced = {row['rawhash'] for row in await conn.fetch(
+                "SELECT DISTINCT rawhash FROM smart_pages WHERE rawhash = ANY($1::text[])", batch)}
+            orphans = [rawhash for rawhash in batch if rawhash not in referenced]
+            if orphans:
+                await self.delete(conn, orphans, older_than=grace)
+                removed += len(orphans)
+        return removed
+
+
+class PostgresRawStore(RawContentStore):
+    """zstd-compressed bytea rows in smart_page_raw."""
+
+    async def put(self, conn, html: str) -> str:
+        rawhash = raw_hash(html)
+        exists = await conn.fetchval("""
+            UPDATE smart_page_raw SET touchedat = NOW() WHERE hash = $1 RETURNING 1
+        """, rawhash)
+        if not exists:
+            data = await asyncio.to_thread(self.compress, html)
+            await conn.execute("""
+                INSERT INTO smart_page_raw (hash, codec, rawsize, data)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (hash) DO NOTHING
+            """, rawhash, self.codec, len(html), data)
+        return rawhash
+
+    async def get(self, conn, rawhash: str) -> Optional[str]:
+        data = await conn.fetchval("SELECT data FROM smart_page_raw WHERE hash = $1", rawhash)
+        return self.decompress(data) if data is not None else None
+
+    async def hashes(self, conn, older_than: float = 0) -> List[str]:
+        return [row['hash'] for row in await conn.fetch("""
+            SELECT hash FROM smart_page_raw WHERE touchedat < NOW() - make_interval(secs => $1)
+        """, float(older_than))]
+
+    async def delete(self, conn, rawhashes: Iterable[str], older_than: float = 0):
+        # The age is checked again by the DELETE itself: a put() touching the row in the meantime
+        # holds its lock until commit, and the re-checked row is then skipped
+        await conn.execute("""
+            DELETE FROM smart_page_raw
+            WHERE hash = ANY($1::text[]) AND touchedat < NOW() - make_interval(secs => $2)
+        """, list(rawhashes), float(older_than))
+
+
+class BlobRawStore(RawContentStore):
+    """zstd files under <directory>/<aa>/<hash>.zst; the database keeps only the hash."""
+
+    def __init__(self, directory: str = Config.RAW_STORE_DIR, level: int = Config.RAW_STORE_LEVEL):
+        super().__init__(level)
+        self.directory = directory
+
+    def _path(self, rawhash: str) -> str:
+        return os.path.join(self.directory, rawhash[:2], rawhash + '.zst')
+
+    def _write(self, rawhash: str, html: str):
+        path = self._path(rawhash)
+        if os.path.exists(path):
+            # Already stored: the mtime marks it as in use for garbage collection
+            try:
+                os.utime(path)
+                return
+            except FileNotFoundError:
+                pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename, so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.compress(html))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _read(self, rawhash: str) -> Optional[str]:
+        try:
+            with open(self._path(rawhash), 'rb') as f:
+                return self.decompress(f.read())
+        except FileNotFoundError:
+            return None
+
+    async def put(self, conn, html: str) -> str:
+        rawhash = raw_hash(html)
+        await asyncio.to_thread(self._write, rawhash, html)
+        return rawhash
+
+    async def get(self, conn, rawhash: str) -> Optional[str]:
+        return await asyncio.to_thread(self._read, rawhash)
+
+    def _older(self, path: str, older_than: float) -> bool:
+        try:
+            return os.path.getmtime(path) < time.time() - older_than
+        except FileNotFoundError:
+            return False
+
+    async def hashes(self, conn, older_than: float = 0) -> List[str]:
+        def scan():
+            if not os.path.isdir(self.directory):
+                return []
+            return [name[:-len('.zst')]
+                    for prefix in os.listdir(self.directory)
+                    if os.path.isdir(os.path.join(self.directory, prefix))
+                    for name in os.listdir(os.path.join(self.directory, prefix))
+                    if name.endswith('.zst') and self._older(os.path.join(self.directory, prefix, name), older_than)]
+        return await asyncio.to_thread(scan)
+
+    async def delete(self, conn, rawhashes: Iterable[str], older_than: float = 0):
+        def remove():
+            for rawhash in rawhashes:
+                # Skips files a put() touched since they were listed
+                if not self._older(self._path(rawhash), older_than):
+                    continue
+                try:
+                    os.unlink(self._path(rawhash))
+                except FileNotFoundError:
+                    pass
+        await asyncio.to_thread(remove)
+
+
+def create_raw_store(backend: str = Config.RAW_STORE) -> Optional[RawContentStore]:
+    if backend == 'postgres':
+        return PostgresRawStore()
+    if backend == 'blob':
+        return BlobRawStore()
+    if backend in ('', 'inline'):
+        # Legacy: uncompressed smart_pages.rawhtml
+        return None
+    raise ValueError(f"Unknown raw store backend: {backend}")
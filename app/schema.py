@@ -0,0 +1,387 @@
+import logging
+import math
+import uuid
+from typing import Dict, List, Optional
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Ordered, idempotent schema migrations; applied names are recorded in smart_schema_migrations
+MIGRATIONS = [
+    ("001_chunks_datasetid", """
+        ALTER TABLE smart_chunks ADD COLUMN IF NOT EXISTS datasetid uuid;
+
+        UPDATE smart_chunks c SET datasetid = p.datasetid
+        FROM smart_pages p
+        WHERE c.pageid = p.id AND c.datasetid IS NULL;
+
+        CREATE INDEX IF NOT EXISTS smart_chunks_datasetid_idx ON smart_chunks (datasetid);
+
+        CREATE OR REPLACE FUNCTION smart_chunks_set_datasetid() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.datasetid IS NULL THEN
+                SELECT datasetid INTO NEW.datasetid FROM smart_pages WHERE id = NEW.pageid;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS smart_chunks_set_datasetid ON smart_chunks;
+        CREATE TRIGGER smart_chunks_set_datasetid
+            BEFORE INSERT ON smart_chunks
+            FOR EACH ROW EXECUTE FUNCTION smart_chunks_set_datasetid();
+    """),
+    ("002_incremental_recrawl", """
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS normalizedurl text;
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS etag text;
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS lastmodified text;
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS contenthash text;
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS updatedat timestamptz;
+        ALTER TABLE smart_chunks ADD COLUMN IF NOT EXISTS contenthash text;
+
+        -- Existing rows predate URL normalization; the raw URL is the best available key
+        UPDATE smart_pages SET normalizedurl = url WHERE normalizedurl IS NULL;
+
+        CREATE INDEX IF NOT EXISTS smart_pages_dataset_url_idx ON smart_pages (datasetid, normalizedurl);
+        CREATE INDEX IF NOT EXISTS smart_chunks_page_hash_idx ON smart_chunks (pageid, contenthash);
+    """),
+    ("003_deferred_enrichment", """
+        ALTER TABLE smart_chunks ADD COLUMN IF NOT EXISTS enrichclaimedat timestamptz;
+
+        CREATE INDEX IF NOT EXISTS smart_chunks_unenriched_idx ON smart_chunks (datasetid)
+            WHERE summary IS NULL AND contextretrieval IS NULL AND status IN ('created', 'enriching');
+    """),
+    ("004_raw_content_store", """
+        CREATE TABLE IF NOT EXISTS smart_page_raw (
+            hash text PRIMARY KEY,
+            codec text NOT NULL,
+            rawsize integer NOT NULL,
+            data bytea NOT NULL,
+            createdat timestamptz NOT NULL DEFAULT now()
+        );
+        -- Already zstd-compressed: skip pglz and go straight to TOAST
+        ALTER TABLE smart_page_raw ALTER COLUMN data SET STORAGE EXTERNAL;
+
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS rawhash text;
+        CREATE INDEX IF NOT EXISTS smart_pages_rawhash_idx ON smart_pages (rawhash);
+    """),
+    ("005_page_job_queue", """
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0;
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS nextattemptat timestamptz;
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS claimedby text;
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS leaseexpiresat timestamptz;
+
+        -- Only enqueued rows (nextattemptat set) and live claims are indexed; finished pages cost nothing
+        CREATE INDEX IF NOT EXISTS smart_pages_queue_pending_idx ON smart_pages (nextattemptat)
+            WHERE status = 'pending' AND nextattemptat IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS smart_pages_queue_leased_idx ON smart_pages (leaseexpiresat)
+            WHERE status = 'processing';
+    """),
+    ("006_coarse_search", """
+        -- NULL coarsequantization: search the full-precision embedding directly
+        ALTER TABLE smart_datasets ADD COLUMN IF NOT EXISTS coarsedimensions integer;
+        ALTER TABLE smart_datasets ADD COLUMN IF NOT EXISTS coarsequantization text;
+        ALTER TABLE smart_datasets ADD COLUMN IF NOT EXISTS rerankfactor integer NOT NULL DEFAULT 4;
+    """),
+    ("007_chunk_fulltext", """
+        -- Russian stems for morphology, 'simple' tokens for exact codes and product names;
+        -- enrichment context ranks below the chunk text. Adding the column rewrites smart_chunks once.
+        ALTER TABLE smart_chunks ADD COLUMN IF NOT EXISTS searchvector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('russian', coalesce(text, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(text, '')), 'B') ||
+                setweight(to_tsvector('russian', coalesce(contextretrieval, '')), 'C') ||
+                setweight(to_tsvector('simple', coalesce(contextretrieval, '')), 'D')
+            ) STORED;
+
+        CREATE INDEX IF NOT EXISTS smart_chunks_searchvector_idx ON smart_chunks USING gin (searchvector);
+    """),
+    ("008_near_duplicates", """
+        -- MinHash signatures; a duplicate points at its canonical page or chunk
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS minhash bytea;
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS duplicateof uuid REFERENCES smart_pages (id) ON DELETE SET NULL;
+        ALTER TABLE smart_chunks ADD COLUMN IF NOT EXISTS minhash bytea;
+        ALTER TABLE smart_chunks ADD COLUMN IF NOT EXISTS canonicalid uuid REFERENCES smart_chunks (id) ON DELETE SET NULL;
+        CREATE INDEX IF NOT EXISTS smart_pages_duplicateof_idx ON smart_pages (duplicateof) WHERE duplicateof IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS smart_chunks_canonicalid_idx ON smart_chunks (canonicalid) WHERE canonicalid IS NOT NULL;
+
+        -- LSH band buckets of canonical pages and chunks: lookups touch only colliding rows
+        CREATE TABLE IF NOT EXISTS smart_page_bands (
+            datasetid uuid NOT NULL,
+            band smallint NOT NULL,
+            bucket bigint NOT NULL,
+            pageid uuid NOT NULL REFERENCES smart_pages (id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS smart_page_bands_bucket_idx ON smart_page_bands (datasetid, band, bucket);
+        CREATE INDEX IF NOT EXISTS smart_page_bands_pageid_idx ON smart_page_bands (pageid);
+
+        CREATE TABLE IF NOT EXISTS smart_chunk_bands (
+            datasetid uuid NOT NULL,
+            band smallint NOT NULL,
+            bucket bigint NOT NULL,
+            chunkid uuid NOT NULL REFERENCES smart_chunks (id) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS smart_chunk_bands_bucket_idx ON smart_chunk_bands (datasetid, band, bucket);
+        CREATE INDEX IF NOT EXISTS smart_chunk_bands_chunkid_idx ON smart_chunk_bands (chunkid);
+    """),
+    ("009_chunk_versions", """
+        -- Search reads the dataset's active chunk version while scripts/rechunk_dataset.py builds
+        -- the next one. A page's chunkversion is the version its chunks were last built for;
+        -- versions only grow, so pages still to be built sort below the version being built.
+        -- NULL embeddingmodel means Config.EMBEDDING_MODEL.
+        ALTER TABLE smart_datasets ADD COLUMN IF NOT EXISTS chunkversion integer NOT NULL DEFAULT 1;
+        ALTER TABLE smart_datasets ADD COLUMN IF NOT EXISTS embeddingmodel text;
+        ALTER TABLE smart_chunks ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1;
+        ALTER TABLE smart_pages ADD COLUMN IF NOT EXISTS chunkversion integer NOT NULL DEFAULT 1;
+
+        CREATE INDEX IF NOT EXISTS smart_chunks_dataset_version_idx ON smart_chunks (datasetid, version);
+        DROP INDEX IF EXISTS smart_chunks_datasetid_idx;
+        CREATE INDEX IF NOT EXISTS smart_pages_dataset_chunkversion_idx ON smart_pages (datasetid, chunkversion, id);
+
+        -- status: building -> active -> retired -> collected, or building -> aborted -> collected
+        CREATE TABLE IF NOT EXISTS smart_chunk_versions (
+            datasetid uuid NOT NULL REFERENCES smart_datasets (id) ON DELETE CASCADE,
+            version integer NOT NULL,
+            chunksize integer NOT NULL,
+            chunkoverlap integer NOT NULL,
+            embeddingmodel text NOT NULL,
+            status text NOT NULL DEFAULT 'building',
+            pagesdone integer NOT NULL DEFAULT 0,
+            chunkscreated integer NOT NULL DEFAULT 0,
+            createdat timestamptz NOT NULL DEFAULT NOW(),
+            switchedat timestamptz,
+            PRIMARY KEY (datasetid, version)
+        );
+    """),
+    ("010_promote_duplicate_chunks", """
+        -- Deleting a canonical chunk promotes its oldest surviving linked duplicate, which takes over
+        -- the canonical's embedding and LSH bands (they are near-identical texts); the other duplicates
+        -- are relinked to it. The promoted chunk goes back to 'created' to be enriched, and its
+        -- createdat moves forward so the local index exports it. Statement-level, after the delete:
+        -- heirs removed by the same statement are already gone. Chunks of versions that are neither
+        -- active nor being built are only unlinked, they are garbage-collected anyway.
+        CREATE OR REPLACE FUNCTION smart_chunks_promote_duplicates() RETURNS trigger AS $$
+        DECLARE
+            rec record;
+        BEGIN
+            FOR rec IN
+                SELECT DISTINCT ON (c.canonicalid) c.canonicalid AS oldid, c.id AS heir, d.embedding
+                FROM smart_chunks c
+                JOIN deleted d ON d.id = c.canonicalid
+                JOIN smart_datasets ds ON ds.id = c.datasetid
+                WHERE c.version = ds.chunkversion
+                   OR c.version IN (SELECT v.version FROM smart_chunk_versions v
+                                    WHERE v.datasetid = c.datasetid AND v.status = 'building')
+                ORDER BY c.canonicalid, c.createdat, c.id
+            LOOP
+                UPDATE smart_chunks
+                SET canonicalid = NULL, embedding = rec.embedding, status = 'created', createdat = clock_timestamp()
+                WHERE id = rec.heir;
+                UPDATE smart_chunks SET canonicalid = rec.heir WHERE canonicalid = rec.oldid;
+                UPDATE smart_chunk_bands SET chunkid = rec.heir WHERE chunkid = rec.oldid;
+            END LOOP;
+            UPDATE smart_chunks SET canonicalid = NULL WHERE canonicalid IN (SELECT id FROM deleted);
+            DELETE FROM smart_chunk_bands WHERE chunkid IN (SELECT id FROM deleted);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS smart_chunks_promote_duplicate ON smart_chunks;
+        DROP FUNCTION IF EXISTS smart_chunks_promote_duplicate();
+        DROP TRIGGER IF EXISTS smart_chunks_promote_duplicates ON smart_chunks;
+        CREATE TRIGGER smart_chunks_promote_duplicates AFTER DELETE ON smart_chunks
+            REFERENCING OLD TABLE AS deleted
+            FOR EACH STATEMENT EXECUTE FUNCTION smart_chunks_promote_duplicates();
+
+        -- The cascades would run before the trigger and take the links and bands with them; the
+        -- trigger handles both, and the deferred checks still catch anything it missed at commit
+        ALTER TABLE smart_chunks DROP CONSTRAINT IF EXISTS smart_chunks_canonicalid_fkey;
+        ALTER TABLE smart_chunks ADD CONSTRAINT smart_chunks_canonicalid_fkey
+            FOREIGN KEY (canonicalid) REFERENCES smart_chunks (id) DEFERRABLE INITIALLY DEFERRED;
+        ALTER TABLE smart_chunk_bands DROP CONSTRAINT IF EXISTS smart_chunk_bands_chunkid_fkey;
+        ALTER TABLE smart_chunk_bands ADD CONSTRAINT smart_chunk_bands_chunkid_fkey
+            FOREIGN KEY (chunkid) REFERENCES smart_chunks (id) DEFERRABLE INITIALLY DEFERRED;
+
+        -- Duplicates orphaned before this: drop them and clear their pages' content hash, so the
+        -- next crawl of those pages rebuilds the missing chunks
+        UPDATE smart_pages SET contenthash = NULL
+        WHERE id IN (SELECT pageid FROM smart_chunks
+                     WHERE status = 'duplicate' AND canonicalid IS NULL AND embedding IS NULL);
+        DELETE FROM smart_chunks WHERE status = 'duplicate' AND canonicalid IS NULL AND embedding IS NULL;
+    """),
+    ("011_chunks_created_idx", """
+        -- Local index export: one version of a dataset read in (createdat, id) order from a watermark
+        CREATE INDEX IF NOT EXISTS smart_chunks_dataset_created_idx ON smart_chunks (datasetid, version, createdat, id);
+    """),
+    ("012_raw_touchedat", """
+        -- Last time put() stored or reused the content; garbage collection spares recent entries
+        ALTER TABLE smart_page_raw ADD COLUMN IF NOT EXISTS touchedat timestamptz NOT NULL DEFAULT now();
+    """),
+]
+
+INDEX_METHODS = {
+    'hnsw': "USING hnsw ({expression} {opclass}) WITH (m = {m}, ef_construction = {ef_construction})",
+    'ivfflat': "USING ivfflat ({expression} {opclass}) WITH (lists = {lists})",
+}
+
+# Coarse representations for two-phase search: (operator class, distance operator, bytes per dimension)
+QUANTIZATIONS = {
+    'vector': ('vector_cosine_ops', '<=>', 4),
+    'halfvec': ('halfvec_cosine_ops', '<=>', 2),
+    'bit': ('bit_hamming_ops', '<~>', 1 / 8),
+}
+
+
+async def apply_migrations(conn) -> List[str]:
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS smart_schema_migrations (
+            name text PRIMARY KEY,
+            appliedat timestamptz NOT NULL DEFAULT NOW()
+        )
+    """)
+    applied = {row['name'] for row in await conn.fetch("SELECT name FROM smart_schema_migrations")}
+
+    newly_applied = []
+    for name, sql in MIGRATIONS:
+        if name in applied:
+            continue
+        async with conn.transaction():
+            await conn.execute(sql)
+            await conn.execute("INSERT INTO smart_schema_migrations (name) VALUES ($1)", name)
+        logger.info(f"Applied migration {name}")
+        newly_applied.append(name)
+    return newly_applied
+
+
+def vector_index_name(method: str, dataset_id: Optional[str] = None) -> str:
+    if dataset_id:
+        return f"smart_chunks_embedding_{method}_{uuid.UUID(dataset_id).hex}"
+    return f"smart_chunks_embedding_{method}"
+
+
+async def create_vector_index(conn, method: str = 'hnsw', dataset_id: Optional[str] = None,
+                              m: int = 16, ef_construction: int = 64, lists: Optional[int] = None) -> str:
+    # Global index, or a partial one per dataset so filtered queries don't lose recall to post-filtering
+    if method not in INDEX_METHODS:
+        raise ValueError(f"Unknown index method: {method}")
+
+    where = ""
+    if dataset_id:
+        where = f" WHERE datasetid = '{uuid.UUID(dataset_id)}'"
+
+    if method == 'ivfflat' and lists is None:
+        lists = await suggest_ivfflat_lists(conn, dataset_id)
+
+    name = vector_index_name(method, dataset_id)
+    using = INDEX_METHODS[method].format(expression='embedding', opclass='vector_cosine_ops',
+                                         m=int(m), ef_construction=int(ef_construction), lists=lists)
+    await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON smart_chunks {using}{where}")
+    logger.info(f"Created vector index {name}")
+    return name
+
+
+def coarse_expression(operand: str, dimensions: int, quantization: str) -> str:
+    # Leading dimensions of a text-embedding-3 vector are what the API returns for `dimensions`
+    # (before normalization, which cosine distance ignores), so no second embedding is needed.
+    # Hamming distance on binary_quantize is likewise scale-free.
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization: {quantization}")
+    dimensions = int(dimensions)
+    expression = operand
+    if dimensions != Config.EMBEDDING_DIMENSIONS:
+        expression = f"subvector({operand}, 1, {dimensions})"
+    if quantization == 'bit':
+        return f"(binary_quantize({expression})::bit({dimensions}))"
+    return f"({expression}::{quantization}({dimensions}))"
+
+
+def coarse_index_name(method: str, dataset_id: str) -> str:
+    return f"smart_chunks_coarse_{method}_{uuid.UUID(dataset_id).hex}"
+
+
+async def create_coarse_index(conn, dataset_id: str, dimensions: int, quantization: str,
+                              method: str = 'hnsw', m: int = 16, ef_construction: int = 64,
+                              lists: Optional[int] = None) -> str:
+    # Partial expression index over the shortened/quantized embedding of one dataset
+    if method not in INDEX_METHODS:
+        raise ValueError(f"Unknown index method: {method}")
+    opclass = QUANTIZATIONS[quantization][0]
+    if method == 'ivfflat' and lists is None:
+        lists = await suggest_ivfflat_lists(conn, dataset_id)
+
+    name = coarse_index_name(method, dataset_id)
+    await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+    using = INDEX_METHODS[method].format(expression=coarse_expression('embedding', dimensions, quantization),
+                                         opclass=opclass, m=int(m), ef_construction=int(ef_construction),
+                                         lists=lists)
+    await conn.execute(f"CREATE INDEX CONCURRENTLY {name} ON smart_chunks {using} "
+                       f"WHERE datasetid = '{uuid.UUID(dataset_id)}'")
+    logger.info(f"Created coarse index {name}")
+    return name
+
+
+async def dataset_footprint(conn, dataset_id: str) -> Dict:
+    # Vector bytes of the dataset: stored embeddings, its indexes, and what the coarse form costs per row
+    dataset_uuid = uuid.UUID(dataset_id)
+    settings = await conn.fetchrow("""
+        SELECT coarsedimensions, coarsequantization FROM smart_datasets WHERE id = $1
+    """, dataset_uuid)
+    stats = await conn.fetchrow("""
+        SELECT count(*) AS chunks, COALESCE(sum(pg_column_size(embedding)), 0) AS embedding_bytes
+        FROM smart_chunks WHERE datasetid = $1
+    """, dataset_uuid)
+    indexes = await conn.fetch("""
+        SELECT i.indexname AS name, pg_relation_size(format('%I.%I', i.schemaname, i.indexname)::regclass) AS size
+        FROM pg_indexes i
+        WHERE i.tablename = 'smart_chunks' AND i.indexname LIKE '%' || $1
+    """, dataset_uuid.hex)
+
+    full_vector_bytes = Config.EMBEDDING_DIMENSIONS * 4 + 8
+    report = {
+        "chunks": stats['chunks'],
+        "embedding_bytes": stats['embedding_bytes'],
+        "indexes": {row['name']: row['size'] for row in indexes},
+        "full_vector_bytes": full_vector_bytes,
+    }
+    if settings and settings['coarsequantization']:
+        dimensions = settings['coarsedimensions'] or Config.EMBEDDING_DIMENSIONS
+        coarse_bytes = math.ceil(dimensions * QUANTIZATIONS[settings['coarsequantization']][2]) + 8
+        report.update({
+            "coarse": f"{settings['coarsequantization']}({dimensions})",
+            "coarse_vector_bytes": coarse_bytes,
+            "compression": full_vector_bytes / coarse_bytes,
+        })
+    return report
+
+
+async def suggest_ivfflat_lists(conn, dataset_id: Optional[str] = None) -> int:
+    # pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) above that
+    if dataset_id:
+        rows = await conn.fetchval("SELECT count(*) FROM smart_chunks WHERE datasetid = $1", uuid.UUID(dataset_id))
+    else:
+        rows = await conn.fetchval("SELECT count(*) FROM smart_chunks")
+    if rows > 1_000_000:
+        return int(math.sqrt(rows))
+    return max(rows // 1000, 10)
+
+
+async def drop_vector_index(conn, name: str):
+    await conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+async def reindex_vector_index(conn, name: str):
+    # IVFFlat centroids are fixed at build time; rebuild after the table has grown substantially
+    await conn.execute(f'REINDEX INDEX CONCURRENTLY "{name}"')
+
+
+async def list_vector_indexes(conn) -> List[Dict]:
+    rows = await conn.fetch("""
+        SELECT i.indexname AS name, i.indexdef AS definition,
+               pg_relation_size(format('%I.%I', i.schemaname, i.indexname)::regclass) AS size
+        FROM pg_indexes i
+        WHERE i.tablename = 'smart_chunks'
+          AND (i.indexdef ILIKE '%USING hnsw%' OR i.indexdef ILIKE '%USING ivfflat%')
+        ORDER BY i.indexname
+    """)
+    return [dict(row) for row in rows]
@@ -0,0 +1,258 @@
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import Config
+from app.database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+SEARCH_BLOCK_ROWS = 65536
+
+
+class LocalVectorIndex:
+    """Memory-mapped copy of a dataset's embeddings for in-process top-k search.
+
+    Layout in <directory>/<dataset_id>/:
+      vectors.bin  row-major matrix of L2-normalized embeddings (float32, float16 or int8)
+      scales.bin   float32 per-row dequantization scale (int8 only)
+      ids.bin      16-byte chunk UUIDs in row order
+      created.bin  float64 chunk createdat (epoch seconds) in row order
+      deleted.bin  uint8 per row, 1 for chunks deleted from the database since export
+      meta.json    dtype, dimensions, row count, the (createdat, id) export watermark
+                   and the dataset chunk version the rows belong to
+
+    meta.json is the source of truth: rows past its count (from an interrupted
+    append) are truncated on open. A switch to another chunk version rebuilds the
+    index from scratch, and so does a sync that finds more than rebuild_ratio of
+    the rows deleted; below that, deleted rows are masked out of top_k.
+
+    createdat is the inserting transaction's start time, so a chunk can commit after
+    a sync that already passed its timestamp. Each sync therefore re-reads
+    rescan_seconds behind the watermark and skips ids it already holds.
+    """
+
+    def __init__(self, directory: str, dataset_id: str, dtype: str = None,
+                 rescan_seconds: float = Config.LOCAL_INDEX_RESCAN_SECONDS,
+                 rebuild_ratio: float = Config.LOCAL_INDEX_REBUILD_RATIO):
+        # dtype None keeps the stored one (float32 for a new index)
+        if dtype is not None and dtype not in DTYPES:
+            raise ValueError(f"Unsupported index dtype: {dtype}")
+        self.dataset_id = dataset_id
+        self.rescan_seconds = rescan_seconds
+        self.rebuild_ratio = rebuild_ratio
+        self.path = os.path.join(directory, dataset_id)
+        self.meta = {"dtype": dtype or 'float32', "dimensions": None, "count": 0, "watermark": None,
+                     "chunkversion": None}
+        self.vectors = None
+        self.scales = None
+        self.ids = None
+        self.created = None
+        self.deleted = None
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(self._file('meta.json')):
+            with open(self._file('meta.json')) as f:
+                self.meta = json.load(f)
+            if dtype is not None and dtype != self.meta['dtype']:
+                raise ValueError(f"Index {self.path} is stored as {self.meta['dtype']}, not {dtype}; "
+                                 f"delete it to rebuild with another dtype")
+        self._open()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @property
+    def dtype(self):
+        return DTYPES[self.meta['dtype']]
+
+    def __len__(self) -> int:
+        return self.meta['count']
+
+    def _open(self):
+        count, dimensions = self.meta['count'], self.meta['dimensions']
+        if not count:
+            self.vectors = self.scales = self.ids = self.created = self.deleted = None
+            return
+        row_bytes = dimensions * np.dtype(self.dtype).itemsize
+        self._truncate('vectors.bin', count * row_bytes)
+        self._truncate('ids.bin', count * 16)
+        self.vectors = np.memmap(self._file('vectors.bin'), dtype=self.dtype, mode='r', shape=(count, dimensions))
+        self.ids = np.memmap(self._file('ids.bin'), dtype='V16', mode='r', shape=(count,))
+        if self.meta['dtype'] == 'int8':
+            self._truncate('scales.bin', count * 4)
+            self.scales = np.memmap(self._file('scales.bin'), dtype=np.float32, mode='r', shape=(count,))
+        if not os.path.exists(self._file('created.bin')):
+            # Index from before created.bin: every row counts as recent for the next rescan
+            with open(self._file('created.bin'), 'wb') as f:
+                f.write(np.full(count, self._watermark()[0].timestamp(), dtype=np.float64).tobytes())
+        self._truncate('created.bin', count * 8)
+        self.created = np.memmap(self._file('created.bin'), dtype=np.float64, mode='r', shape=(count,))
+        self.deleted = None
+        if os.path.exists(self._file('deleted.bin')):
+            # Rows appended after the file was last written are live
+            deleted = np.fromfile(self._file('deleted.bin'), dtype=np.uint8, count=count).astype(bool)
+            self.deleted = np.concatenate([deleted, np.zeros(count - len(deleted), dtype=bool)])
+
+    def _watermark(self) -> Optional[Tuple[datetime, uuid.UUID]]:
+        if not self.meta['watermark']:
+            return None
+        return datetime.fromisoformat(self.meta['watermark'][0]), uuid.UUID(self.meta['watermark'][1])
+
+    def _truncate(self, name: str, size: int):
+        if os.path.getsize(self._file(name)) > size:
+            with open(self._file(name), 'r+b') as f:
+                f.truncate(size)
+
+    def _write_meta(self):
+        tmp = self._file('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._file('meta.json'))
+
+    def reset(self, chunkversion: int = None):
+        self.vectors = self.scales = self.ids = self.created = self.deleted = None
+        for name in ('vectors.bin', 'scales.bin', 'ids.bin', 'created.bin', 'deleted.bin'):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        self.meta = {"dtype": self.meta['dtype'], "dimensions": None, "count": 0, "watermark": None,
+                     "chunkversion": chunkversion}
+        self._write_meta()
+
+    def append(self, chunk_ids: List[uuid.UUID], embeddings: np.ndarray, created: List[datetime],
+               watermark: Tuple[datetime, uuid.UUID]):
+        if not len(chunk_ids):
+            return
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        if self.meta['dimensions'] is None:
+            self.meta['dimensions'] = matrix.shape[1]
+        elif matrix.shape[1] != self.meta['dimensions']:
+            raise ValueError(f"Expected {self.meta['dimensions']} dimensions, got {matrix.shape[1]}")
+
+        if self.meta['dtype'] == 'int8':
+            scales = np.abs(matrix).max(axis=1) / 127
+            scales[scales == 0] = 1
+            rows = np.round(matrix / scales[:, None]).astype(np.int8)
+            with open(self._file('scales.bin'), 'ab') as f:
+                f.write(scales.astype(np.float32).tobytes())
+        else:
+            rows = matrix.astype(self.dtype)
+
+        with open(self._file('vectors.bin'), 'ab') as f:
+            f.write(rows.tobytes())
+        with open(self._file('ids.bin'), 'ab') as f:
+            f.write(b''.join(chunk_id.bytes for chunk_id in chunk_ids))
+        with open(self._file('created.bin'), 'ab') as f:
+            f.write(np.array([value.timestamp() for value in created], dtype=np.float64).tobytes())
+
+        self.meta['count'] += len(chunk_ids)
+        self.meta['watermark'] = [watermark[0].isoformat(), str(watermark[1])]
+        self._write_meta()
+
+    async def _mark_deleted(self, db: DatabaseManager, version: Optional[int]) -> int:
+        # Rows whose chunk is gone (recrawls, re-chunk GC) are flagged in deleted.bin
+        if not len(self):
+            return 0
+        live = [chunk_id.bytes async for chunk_id in db.iter_chunk_ids(self.dataset_id, version=version)]
+        ids = np.asarray(self.ids).view('S16')
+        deleted = ~np.isin(ids, np.array(live, dtype='S16'))
+        tmp = self._file('deleted.bin.tmp')
+        deleted.astype(np.uint8).tofile(tmp)
+        os.replace(tmp, self._file('deleted.bin'))
+        self.deleted = deleted
+        return int(deleted.sum())
+
+    async def sync(self, db: DatabaseManager, batch_size: int = 4096) -> int:
+        # Export chunks created after the watermark and mask the deleted ones; rows are never
+        # rewritten, the index is rebuilt instead once too many of them are dead
+        settings = await db.get_search_settings(self.dataset_id)
+        version = settings['chunkversion'] if settings else None
+        # Indexes written before chunk versions existed hold the dataset's only version
+        if self.meta.setdefault('chunkversion', version) != version:
+            logger.info(f"Local index for dataset {self.dataset_id}: chunk version {self.meta['chunkversion']} "
+                        f"replaced by {version}, rebuilding")
+            self.reset(version)
+        elif len(self) and await self._mark_deleted(db, version) > len(self) * self.rebuild_ratio:
+            logger.info(f"Local index for dataset {self.dataset_id}: {int(self.deleted.sum())} of {len(self)} "
+                        f"rows deleted, rebuilding")
+            self.reset(version)
+        watermark, after, known = self._watermark(), None, set()
+        if watermark:
+            # Rows held from the re-scan window on are the only ones it can return again
+            since = watermark[0] - timedelta(seconds=self.rescan_seconds)
+            after = (since, uuid.UUID(int=0))
+            if self.created is not None:
+                known = {self.ids[i].tobytes() for i in np.nonzero(self.created >= since.timestamp())[0]}
+
+        added = 0
+        ids, embeddings, created, last = [], [], [], watermark
+        async for row in db.iter_chunk_embeddings(self.dataset_id, after=after, version=version):
+            if last is None or (row['createdat'], row['id']) > last:
+                last = (row['createdat'], row['id'])
+            if row['id'].bytes in known:
+                continue
+            ids.append(row['id'])
+            embeddings.append(row['embedding'])
+            created.append(row['createdat'])
+            if len(ids) >= batch_size:
+                self.append(ids, embeddings, created, last)
+                added += len(ids)
+                ids, embeddings, created = [], [], []
+        if ids:
+            self.append(ids, embeddings, created, last)
+            added += len(ids)
+
+        self._open()
+        logger.info(f"Local index for dataset {self.dataset_id}: +{added} rows, {len(self)} total")
+        return added
+
+    def top_k(self, query_embedding: List[float], k: int = 10) -> List[Tuple[str, float]]:
+        if self.vectors is None:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, len(self), SEARCH_BLOCK_ROWS):
+            block = self.vectors[start:start + SEARCH_BLOCK_ROWS]
+            scores = block.astype(np.float32, copy=False) @ query
+            if self.scales is not None:
+                scores *= self.scales[start:start + SEARCH_BLOCK_ROWS]
+            if self.deleted is not None:
+                scores[self.deleted[start:start + SEARCH_BLOCK_ROWS]] = -np.inf
+            if len(scores) > k:
+                top = np.argpartition(scores, -k)[-k:]
+            else:
+                top = np.arange(len(scores))
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            if len(best_scores) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+
+        order = np.argsort(-best_scores)
+        return [(str(uuid.UUID(bytes=self.ids[best_rows[i]].tobytes())), float(best_scores[i]))
+                for i in order if best_scores[i] > -np.inf]
+
+    async def search(self, db: DatabaseManager, query_embedding: List[float], limit: int = 10) -> List[Dict]:
+        # Same result shape as DatabaseManager.search_similar_chunks. Chunks deleted since the
+        # last sync drop out here, so k grows until limit rows are found or the index runs out
+        k = limit
+        while True:
+            winners = self.top_k(query_embedding, k)
+            rows = await db.get_chunks_by_ids([chunk_id for chunk_id, _ in winners]) if winners else {}
+            results = [{**rows[chunk_id], "similarity": score} for chunk_id, score in winners if chunk_id in rows]
+            if len(results) >= limit or len(winners) < k:
+                return results[:limit]
+            k *= 2
+
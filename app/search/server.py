@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+from app.config import Config
+from app.database import EF_SEARCH_MAX, DatabaseManager
+from app.metrics import REGISTRY, prometheus_handler
+from app.processing.embedder import EmbeddingGenerator
+
+logger = logging.getLogger(__name__)
+
+SEARCH_SECONDS = REGISTRY.histogram("search_seconds", "Search latency by phase", ["phase"])
+SEARCH_BATCH_INPUTS = REGISTRY.histogram("search_embedding_batch_inputs", "Queries per embeddings request",
+                                         buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+
+class QueryEmbeddingCache:
+    """LRU of query embeddings with a time-to-live per entry."""
+
+    def __init__(self, max_entries: int = Config.SEARCH_CACHE_SIZE, ttl: float = Config.SEARCH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query: str) -> Optional[List[float]]:
+        entry = self.entries.get(query)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[query]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(query)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, query: str, embedding: List[float]):
+        self.entries[query] = (time.monotonic() + self.ttl, embedding)
+        self.entries.move_to_end(query)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class QueryEmbeddingBatcher:
+    """Collects concurrent queries for up to max_wait seconds and embeds them in one request."""
+
+    def __init__(self, embedder: EmbeddingGenerator, max_batch: int = Config.SEARCH_BATCH_SIZE,
+                 max_wait: float = Config.SEARCH_BATCH_WAIT_MS / 1000, model: str = None):
+        self.embedder = embedder
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending: Dict[str, List[asyncio.Future]] = {}
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.tasks = set()
+        self.batch_sizes = SEARCH_BATCH_INPUTS.labels()
+
+    async def embed(self, query: str) -> Optional[List[float]]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Identical concurrent queries share one input
+        self.pending.setdefault(query, []).append(future)
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.pending:
+            batch, self.pending = self.pending, {}
+            task = asyncio.ensure_future(self._run(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, batch: Dict[str, List[asyncio.Future]]):
+        queries = list(batch)
+        self.batch_sizes.observe(len(queries))
+        try:
+            embeddings = await self.embedder.generate_embeddings_batch(queries, model=self.model)
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for query, embedding in zip(queries, embeddings):
+            for future in batch[query]:
+                if not future.done():
+                    future.set_result(embedding)
+
+
+class SearchService:
+    def __init__(self, db: DatabaseManager = None, embedder: EmbeddingGenerator = None):
+        self.db = db or DatabaseManager()
+        self.embedder = embedder or EmbeddingGenerator()
+        self.cache = QueryEmbeddingCache()
+        # One batcher per embedding model: a request carries a single model
+        self.batchers: Dict[Optional[str], QueryEmbeddingBatcher] = {None: QueryEmbeddingBatcher(self.embedder)}
+        self.latency = {name: SEARCH_SECONDS.labels(phase=name) for name in ("total", "embedding", "database")}
+
+    async def start(self):
+        await self.db.connect()
+
+    async def stop(self):
+        await self.db.close()
+
+    async def embed_query(self, query: str, model: str = None) -> Optional[List[float]]:
+        # model None is the embedder's default; datasets re-embedded with another model name theirs
+        embedding = self.cache.get((model, query))
+        if embedding is None:
+            batcher = self.batchers.get(model)
+            if batcher is None:
+                batcher = self.batchers[model] = QueryEmbeddingBatcher(self.embedder, model=model)
+            embedding = await batcher.embed(query)
+            if embedding is not None:
+                self.cache.set((model, query), embedding)
+        return embedding
+
+    async def _query_target(self, dataset_id: Optional[str]) -> tuple:
+        # (model, chunk version) from one settings snapshot: after a re-chunk switch the query keeps
+        # reading the version its model belongs to until the cached settings expire
+        if not dataset_id:
+            return None, None
+        settings = await self.db.get_search_settings(dataset_id)
+        return (settings['embeddingmodel'], settings['chunkversion']) if settings else (None, None)
+
+    async def search(self, query: str, dataset_id: str = None, limit: int = 10,
+                     ef_search: int = None, probes: int = None, hybrid: bool = False,
+                     vector_weight: float = 1.0, text_weight: float = 1.0) -> List[Dict]:
+        started = time.perf_counter()
+        model, chunk_version = await self._query_target(dataset_id)
+        embedding = await self.embed_query(query, model)
+        embedded = time.perf_counter()
+        self.latency["embedding"].observe(embedded - started)
+        if embedding is None:
+            raise RuntimeError("Failed to embed query")
+
+        options = {"chunk_version": chunk_version}
+        if ef_search:
+            options["ef_search"] = ef_search
+        if probes:
+            options["probes"] = probes
+        if hybrid:
+            results = await self.db.hybrid_search_chunks(embedding, query, dataset_id=dataset_id, limit=limit,
+                                                         vector_weight=vector_weight, text_weight=text_weight,
+                                                         **options)
+        else:
+            results = await self.db.search_similar_chunks(embedding, dataset_id=dataset_id, limit=limit, **options)
+
+        finished = time.perf_counter()
+        self.latency["database"].observe(finished - embedded)
+        self.latency["total"].observe(finished - started)
+        return results
+
+    def metrics(self) -> Dict:
+        return {
+            "latency_seconds": {name: histogram.snapshot() for name, histogram in self.latency.items()},
+            "embedding_batch_size": SEARCH_BATCH_INPUTS.labels().snapshot(),
+            "query_cache": {"hits": self.cache.hits, "misses": self.cache.misses,
+                            "entries": len(self.cache.entries)},
+        }
+
+
+def _serialize(row: Dict) -> Dict:
+    return {key: str(value) if isinstance(value, uuid.UUID) else value for key, value in row.items()}
+
+
+def _int_param(params, name: str, default: int = None) -> Optional[int]:
+    value = params.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text=f"{name} must be an integer")
+
+
+def _float_param(params, name: str, default: float = None) -> Optional[float]:
+    value = params.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text=f"{name} must be a number")
+
+
+def _uuid_param(params, name: str) -> Optional[str]:
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be a UUID")
+
+
+def _bool_param(params, name: str) -> bool:
+    value = params.get(name)
+    return value is True or str(value).lower() in ('1', 'true', 'yes')
+
+
+def create_app(service: SearchService = None) -> web.Application:
+    service = service or SearchService()
+    app = web.Application()
+
+    async def search(request: web.Request) -> web.Response:
+        params = request.query
+        if request.method == 'POST':
+            try:
+                params = await request.json()
+            except ValueError:
+                raise web.HTTPBadRequest(text="body must be valid JSON")
+            if not isinstance(params, dict):
+                raise web.HTTPBadRequest(text="body must be a JSON object")
+        query = (params.get('q') or params.get('query') or '').strip()
+        if not query:
+            raise web.HTTPBadRequest(text="q is required")
+        limit = _int_param(params, 'limit', 10)
+        if limit < 1:
+            raise web.HTTPBadRequest(text="limit must be positive")
+        ef_search, probes = _int_param(params, 'ef_search'), _int_param(params, 'probes')
+        try:
+            results = await service.search(
+                query,
+                dataset_id=_uuid_param(params, 'dataset_id'),
+                limit=min(limit, Config.SEARCH_MAX_LIMIT),
+                ef_search=min(max(ef_search, 1), EF_SEARCH_MAX) if ef_search is not None else None,
+                probes=max(probes, 1) if probes is not None else None,
+                hybrid=_bool_param(params, 'hybrid'),
+                vector_weight=_float_param(params, 'vector_weight', 1.0),
+                text_weight=_float_param(params, 'text_weight', 1.0)
+            )
+        except RuntimeError as e:
+            logger.error(f"Search failed for {query!r}: {str(e)}")
+            raise web.HTTPServiceUnavailable(text=str(e))
+        return web.json_response({"query": query, "results": [_serialize(row) for row in results]})
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.json_response(service.metrics())
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def on_startup(app):
+        await service.start()
+
+    async def on_cleanup(app):
+        await service.stop()
+
+    app.router.add_get('/search', search)
+    app.router.add_post('/search', search)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/metrics/prometheus', prometheus_handler())
+    app.router.add_get('/health', health)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app['search_service'] = service
+    return app
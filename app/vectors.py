@@ -0,0 +1,39 @@
+import struct
+import sys
+from array import array
+from typing import List
+
+# pgvector binary wire format: int16 dimensions, int16 unused, float32[dimensions], big-endian
+_HEADER = struct.Struct('>HH')
+_SWAP = sys.byteorder == 'little'
+
+
+def encode_vector(values: List[float]) -> bytes:
+    data = array('f', values)
+    if _SWAP:
+        data.byteswap()
+    return _HEADER.pack(len(data), 0) + data.tobytes()
+
+
+def decode_vector(payload: bytes) -> List[float]:
+    dimensions, _ = _HEADER.unpack_from(payload)
+    data = array('f')
+    data.frombytes(payload[_HEADER.size:_HEADER.size + 4 * dimensions])
+    if _SWAP:
+        data.byteswap()
+    return data.tolist()
+
+
+def _passthrough(payload: bytes) -> bytes:
+    return payload
+
+
+async def register_vector_codecs(conn, raw: bool = False):
+    # raw leaves vectors in the wire format, for bulk transfers that convert whole batches at once
+    schema = await conn.fetchval("""
+        SELECT typnamespace::regnamespace::text FROM pg_type WHERE typname = 'vector'
+    """)
+    if schema is None:
+        return
+    encoder, decoder = (_passthrough, _passthrough) if raw else (encode_vector, decode_vector)
+    await conn.set_type_codec('vector', schema=schema, encoder=encoder, decoder=decoder, format='binary')
@@ -0,0 +1,102 @@
+import argparse
+import asyncio
+import json
+import sys
+import os
+import time
+import uuid
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import DatabaseManager
+from app.schema import dataset_footprint
+
+# The pre-index query: exact scan joined to pages, used as ground truth and latency baseline
+EXACT_QUERY = """
+    SELECT c.id
+    FROM smart_chunks c
+    JOIN smart_pages p ON c.pageid = p.id
+    WHERE p.datasetid = $2
+    ORDER BY c.embedding <=> $1
+    LIMIT $3
+"""
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+def summarize(latencies):
+    return {"p50_ms": percentile(latencies, 0.5) * 1000, "p95_ms": percentile(latencies, 0.95) * 1000}
+
+async def sample_queries(db, dataset_id, count):
+    async with db.pool.acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT embedding FROM smart_chunks
+            WHERE datasetid = $1 AND embedding IS NOT NULL
+            ORDER BY random() LIMIT $2
+        """, uuid.UUID(dataset_id), count)
+    return [row['embedding'] for row in rows]
+
+async def exact_search(db, embedding, dataset_id, k):
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SET LOCAL enable_indexscan = off")
+            rows = await conn.fetch(EXACT_QUERY, embedding, uuid.UUID(dataset_id), k)
+    return [str(row['id']) for row in rows]
+
+async def benchmark(args):
+    db = DatabaseManager()
+    await db.connect()
+
+    try:
+        queries = await sample_queries(db, args.dataset_id, args.queries)
+        truth, exact_latencies = [], []
+        for embedding in queries:
+            started = time.perf_counter()
+            truth.append(await exact_search(db, embedding, args.dataset_id, args.k))
+            exact_latencies.append(time.perf_counter() - started)
+
+        async with db.pool.acquire() as conn:
+            footprint = await dataset_footprint(conn, args.dataset_id)
+        report = {"dataset_id": args.dataset_id, "k": args.k, "queries": len(queries),
+                  "footprint": footprint, "exact": summarize(exact_latencies), "ann": []}
+
+        for ef_search in args.ef_search:
+            latencies, recalls = [], []
+            for embedding, expected in zip(queries, truth):
+                started = time.perf_counter()
+                results = await db.search_similar_chunks(embedding, dataset_id=args.dataset_id,
+                                                         limit=args.k, ef_search=ef_search,
+                                                         probes=args.probes)
+                latencies.append(time.perf_counter() - started)
+                found = {str(row['id']) for row in results}
+                recalls.append(len(found & set(expected)) / max(len(expected), 1))
+            report["ann"].append({"ef_search": ef_search, "probes": args.probes,
+                                  "recall_at_k": sum(recalls) / max(len(recalls), 1),
+                                  **summarize(latencies)})
+    finally:
+        await db.close()
+
+    if args.json:
+        print(json.dumps(report))
+        return
+
+    footprint = report["footprint"]
+    print(f"{footprint['chunks']} chunks, {footprint.get('coarse', 'full vectors')}; " +
+          ", ".join(f"{name} {size / 1024 / 1024:.1f} MB" for name, size in footprint["indexes"].items()))
+    print(f"exact scan: p50 {report['exact']['p50_ms']:.2f} ms, p95 {report['exact']['p95_ms']:.2f} ms")
+    for row in report["ann"]:
+        print(f"ef_search={row['ef_search']} probes={row['probes']}: recall@{args.k} {row['recall_at_k']:.3f}, "
+              f"p50 {row['p50_ms']:.2f} ms, p95 {row['p95_ms']:.2f} ms")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Recall@k and latency of ANN search (or two-phase coarse search) against the exact scan")
+    parser.add_argument("dataset_id")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100, 200])
+    parser.add_argument("--probes", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="Print a machine-readable report")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(benchmark(parse_args()))
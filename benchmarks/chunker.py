@@ -0,0 +1,79 @@
+import argparse
+import json
+import sys
+import os
+import random
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tiktoken
+from semantic_text_splitter import TextSplitter
+
+from app.processing.chunker import TextChunker
+
+WORDS = ("система для парсинга веб страниц создания эмбеддингов семантического поиска "
+         "the quick brown fox jumps over lazy dog while indexing large documents").split()
+
+def synthetic_corpus(documents, paragraphs, seed=0):
+    rng = random.Random(seed)
+    return [
+        "\n\n".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 200)))
+                    for _ in range(paragraphs))
+        for _ in range(documents)
+    ]
+
+def load_corpus(directory):
+    texts = []
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), encoding='utf-8') as f:
+            texts.append(f.read())
+    return texts
+
+def legacy_chunk_text(text, chunk_size, chunk_overlap, encoding):
+    # The previous implementation: new splitter per call, re-encode every chunk
+    splitter = TextSplitter.from_tiktoken_model("gpt-3.5-turbo", capacity=chunk_size, overlap=chunk_overlap)
+    return [{"text": chunk, "tokencount": len(encoding.encode(chunk)), "chunk_index": i}
+            for i, chunk in enumerate(splitter.chunks(text))]
+
+def measure(name, func, texts):
+    started = time.perf_counter()
+    results = func(texts)
+    elapsed = time.perf_counter() - started
+    chunks = sum(len(chunks) for chunks in results)
+    return {"name": name, "seconds": elapsed, "chunks": chunks, "chunks_per_sec": chunks / elapsed}
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunks/sec of TextChunker before and after splitter reuse and chunk_many")
+    parser.add_argument("--corpus-dir", help="Directory of .txt documents (default: synthetic corpus)")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--paragraphs", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="Print a machine-readable report")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.corpus_dir) if args.corpus_dir else synthetic_corpus(args.documents, args.paragraphs)
+    encoding = tiktoken.get_encoding("cl100k_base")
+    chunker = TextChunker(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+
+    report = {
+        "documents": len(texts),
+        "characters": sum(len(text) for text in texts),
+        "runs": [
+            measure("legacy", lambda docs: [legacy_chunk_text(text, args.chunk_size, args.chunk_overlap, encoding)
+                                            for text in docs], texts),
+            measure("chunk_text", lambda docs: [chunker.chunk_text(text) for text in docs], texts),
+            measure("chunk_many", chunker.chunk_many, texts),
+        ]
+    }
+
+    if args.json:
+        print(json.dumps(report))
+        return
+
+    print(f"{report['documents']} documents, {report['characters']} characters")
+    for run in report["runs"]:
+        print(f"{run['name']:>10}: {run['chunks']} chunks in {run['seconds']:.2f}s ({run['chunks_per_sec']:.0f} chunks/sec)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import os
+import time
+import uuid
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+from app.config import Config
+from app.database import DatabaseManager
+from app.metrics import REGISTRY
+from app import schema
+from app.processing.chunker import TextChunker
+from app.processing.embedder import EmbeddingGenerator
+from app.processing.pipeline import IngestionPipeline
+from app.processing.ratelimit import RateLimiter
+from app.processing.scraper import WebScraper
+from app.search.server import SearchService
+from benchmarks.fake_openai import FakeOpenAI
+from benchmarks.fake_site import FakeSite
+
+# Runs every component against local stand-ins: a fake OpenAI API, a synthetic site
+# and the Postgres+pgvector instance from DATABASE_URL (a scratch dataset is created and dropped)
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+def latency_summary(latencies):
+    return {"count": len(latencies), "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+async def start_server(app, host='127.0.0.1'):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+class Counters:
+    """Snapshot of fake API calls and DB statements, diffed around each phase."""
+
+    def __init__(self, openai, db):
+        self.openai = openai
+        self.db = db
+
+    def take(self):
+        return {**self.openai.calls, "db_round_trips": self.db.round_trips}
+
+    async def diff(self, before):
+        # Query logger callbacks are scheduled with call_soon
+        await asyncio.sleep(0)
+        after = self.take()
+        return {key: after[key] - before[key] for key in after}
+
+async def bench_scraper(args, urls):
+    async with WebScraper(max_per_host=args.max_per_host, host_rate=args.host_rate) as scraper:
+        started = time.perf_counter()
+        pages = await asyncio.gather(*(scraper.fetch_html(url) for url in urls))
+        fetched = time.perf_counter()
+        contents = await asyncio.gather(*(scraper.extract_content(page['html'], url)
+                                          for url, page in zip(urls, pages) if page.get('html')))
+        finished = time.perf_counter()
+
+    return contents, {
+        "pages": len(urls),
+        "errors": sum(1 for page in pages if page.get('error')),
+        "fetch_pages_per_sec": len(urls) / (fetched - started),
+        "extract_pages_per_sec": len(contents) / max(finished - fetched, 1e-9),
+    }
+
+def bench_chunker(args, texts):
+    chunker = TextChunker(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    started = time.perf_counter()
+    single = [chunker.chunk_text(text) for text in texts]
+    middle = time.perf_counter()
+    chunker.chunk_many(texts)
+    finished = time.perf_counter()
+
+    total = sum(len(chunks) for chunks in single)
+    return chunker, single, {
+        "chunks": total,
+        "chunk_text_chunks_per_sec": total / (middle - started),
+        "chunk_many_chunks_per_sec": total / (finished - middle),
+    }
+
+async def bench_embedder(args, chunker, chunked, counters):
+    embedder = EmbeddingGenerator(encoding=chunker.encoding, limiter=RateLimiter())
+    chunks = [chunk for chunks in chunked for chunk in chunks]
+    before = counters.take()
+    started = time.perf_counter()
+    embeddings = await embedder.generate_embeddings_batch([chunk['text'] for chunk in chunks],
+                                                          [chunk['tokencount'] for chunk in chunks])
+    elapsed = time.perf_counter() - started
+    calls = await counters.diff(before)
+
+    # Enrichment is one completion per chunk; a slice is enough to measure it
+    sample = chunks[:args.enrich_sample]
+    started = time.perf_counter()
+    await asyncio.gather(*(embedder.generate_enrichment(chunk['text']) for chunk in sample))
+    enrich_elapsed = time.perf_counter() - started
+
+    for chunk, embedding in zip(chunks, embeddings):
+        chunk['embedding'] = embedding
+    return {
+        "chunks": len(chunks),
+        "failed": sum(1 for embedding in embeddings if embedding is None),
+        "embed_chunks_per_sec": len(chunks) / elapsed,
+        "embedding_requests": calls["embeddings"],
+        "enrich_chunks_per_sec": len(sample) / max(enrich_elapsed, 1e-9),
+    }
+
+async def bench_database(db, dataset_id, urls, contents, chunked, counters):
+    before = counters.take()
+    started = time.perf_counter()
+    for url, content, chunks in zip(urls, contents, chunked):
+        await db.save_page_with_chunks(dataset_id, url + "#db", chunks, title=content.get('title'),
+                                       rawhtml=content.get('rawhtml'), cleantext=content.get('cleantext'),
+                                       wordcount=content.get('wordcount'))
+    elapsed = time.perf_counter() - started
+    calls = await counters.diff(before)
+    return {
+        "pages_per_sec": len(contents) / elapsed,
+        "chunks_per_sec": sum(len(chunks) for chunks in chunked) / elapsed,
+        "round_trips_per_page": calls["db_round_trips"] / max(len(contents), 1),
+    }
+
+async def bench_pipeline(args, db, dataset_id, urls, counters):
+    results = {}
+    # First pass ingests everything, the second one only revalidates (ETag -> 304)
+    for run in ("cold", "recrawl"):
+        chunker = TextChunker(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+        pipeline = IngestionPipeline(
+            db, dataset_id, chunker=chunker,
+            scraper=WebScraper(max_per_host=args.max_per_host, host_rate=args.host_rate),
+            embedder=EmbeddingGenerator(encoding=chunker.encoding, limiter=RateLimiter()),
+            enrichment_mode=args.enrichment_mode
+        )
+        before = counters.take()
+        started = time.perf_counter()
+        try:
+            stats = await pipeline.run(urls)
+        finally:
+            await pipeline.scraper.close()
+        elapsed = time.perf_counter() - started
+        calls = await counters.diff(before)
+        pages = max(len(urls), 1)
+        results[run] = {
+            "seconds": elapsed,
+            "pages_per_sec": len(urls) / elapsed,
+            "chunks_per_sec": stats["chunks_created"] / elapsed,
+            "api_calls_per_page": (calls["embeddings"] + calls["chat"]) / pages,
+            "embedding_requests_per_page": calls["embeddings"] / pages,
+            "chat_requests_per_page": calls["chat"] / pages,
+            "throttled": calls["throttled"],
+            "db_round_trips_per_page": calls["db_round_trips"] / pages,
+            "stats": {key: value for key, value in stats.items() if key != "cache"},
+        }
+    return results
+
+async def bench_search(args, db, dataset_id):
+    service = SearchService(db=db, embedder=EmbeddingGenerator(limiter=RateLimiter()))
+    queries = [f"поиск {i % args.distinct_queries} семантического индекса" for i in range(args.queries)]
+    semaphore = asyncio.Semaphore(args.search_concurrency)
+    latencies = []
+
+    async def one(query):
+        async with semaphore:
+            started = time.perf_counter()
+            await service.search(query, dataset_id=dataset_id, limit=10)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(query) for query in queries))
+    elapsed = time.perf_counter() - started
+
+    database = service.latency["database"]
+    return {**latency_summary(latencies), "queries_per_sec": len(queries) / elapsed,
+            "database_p50_ms": database.quantile(0.5) * 1000,
+            "database_p99_ms": database.quantile(0.99) * 1000}
+
+async def drop_dataset(db, dataset_id):
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM smart_chunks WHERE datasetid = $1", uuid.UUID(dataset_id))
+            await conn.execute("DELETE FROM smart_pages WHERE datasetid = $1", uuid.UUID(dataset_id))
+            await conn.execute("DELETE FROM smart_datasets WHERE id = $1", uuid.UUID(dataset_id))
+
+async def benchmark(args):
+    openai_stub = FakeOpenAI(latency=args.openai_latency, jitter=args.openai_latency / 4,
+                             rpm=args.openai_rpm, tpm=args.openai_tpm)
+    site = FakeSite(pages=args.pages, paragraphs=args.paragraphs, latency=args.site_latency)
+    openai_runner, openai_url = await start_server(openai_stub.create_app())
+    site_runner, site_url = await start_server(site.create_app())
+    Config.OPENAI_BASE_URL = openai_url + "/v1"
+    Config.OPENAI_API_KEY = "benchmark"
+    urls = site.urls(site_url)
+
+    db = DatabaseManager()
+    await db.connect()
+    counters = Counters(openai_stub, db)
+    report = {"commit": git_commit(), "timestamp": time.time(),
+              "params": {key: value for key, value in vars(args).items() if key not in ("json", "output")}}
+    dataset_id = None
+    try:
+        async with db.pool.acquire() as conn:
+            await schema.apply_migrations(conn)
+        dataset_id = await db.create_dataset(f"benchmark {uuid.uuid4().hex[:8]}", chunksize=args.chunk_size,
+                                             chunkoverlap=args.chunk_overlap)
+
+        contents, report["scraper"] = await bench_scraper(args, urls)
+        texts = [content['cleantext'] or '' for content in contents]
+        chunker, chunked, report["chunker"] = bench_chunker(args, texts)
+        report["embedder"] = await bench_embedder(args, chunker, chunked, counters)
+        report["database"] = await bench_database(db, dataset_id, urls, contents, chunked, counters)
+        await drop_dataset(db, dataset_id)
+
+        dataset_id = await db.create_dataset(f"benchmark {uuid.uuid4().hex[:8]}", chunksize=args.chunk_size,
+                                             chunkoverlap=args.chunk_overlap)
+        report["pipeline"] = await bench_pipeline(args, db, dataset_id, urls, counters)
+        report["search"] = await bench_search(args, db, dataset_id)
+        report["metrics"] = REGISTRY.summary()
+    finally:
+        if dataset_id and not args.keep:
+            await drop_dataset(db, dataset_id)
+        await db.close()
+        await openai_runner.cleanup()
+        await site_runner.cleanup()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    if args.json:
+        print(output)
+        return
+
+    cold = report["pipeline"]["cold"]
+    print(f"scrape: {report['scraper']['fetch_pages_per_sec']:.1f} pages/s, "
+          f"extract: {report['scraper']['extract_pages_per_sec']:.1f} pages/s")
+    print(f"chunk: {report['chunker']['chunk_many_chunks_per_sec']:.0f} chunks/s, "
+          f"embed: {report['embedder']['embed_chunks_per_sec']:.0f} chunks/s, "
+          f"db: {report['database']['round_trips_per_page']:.1f} round trips/page")
+    print(f"process_urls: {cold['pages_per_sec']:.1f} pages/s, {cold['chunks_per_sec']:.0f} chunks/s, "
+          f"{cold['api_calls_per_page']:.1f} API calls/page, {cold['db_round_trips_per_page']:.1f} DB round trips/page")
+    recrawl = report["pipeline"]["recrawl"]
+    print(f"recrawl: {recrawl['pages_per_sec']:.1f} pages/s, {recrawl['api_calls_per_page']:.1f} API calls/page")
+    print(f"search: p50 {report['search']['p50_ms']:.2f} ms, p99 {report['search']['p99_ms']:.2f} ms")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark against a fake OpenAI API and a synthetic site")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--paragraphs", type=int, default=12, help="Average paragraphs per page")
+    parser.add_argument("--chunk-size", type=int, default=Config.DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=Config.DEFAULT_CHUNK_OVERLAP)
+    parser.add_argument("--enrichment-mode", choices=["inline", "deferred"], default=Config.ENRICHMENT_MODE)
+    parser.add_argument("--enrich-sample", type=int, default=200, help="Chunks to enrich in the embedder phase")
+    parser.add_argument("--openai-latency", type=float, default=0.05, help="Fake API latency, seconds")
+    parser.add_argument("--openai-rpm", type=int, default=0, help="Fake API quota, 0 = unlimited")
+    parser.add_argument("--openai-tpm", type=int, default=0)
+    parser.add_argument("--site-latency", type=float, default=0.0)
+    parser.add_argument("--host-rate", type=float, default=1000.0, help="Scraper requests/sec to the fake site")
+    parser.add_argument("--max-per-host", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--distinct-queries", type=int, default=100)
+    parser.add_argument("--search-concurrency", type=int, default=16)
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark dataset")
+    parser.add_argument("--json", action="store_true", help="Print a machine-readable report")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(benchmark(parse_args()))
@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from aiohttp import web
+
+from app.config import Config
+
+def fake_embedding(text, dimensions=Config.EMBEDDING_DIMENSIONS):
+    # Deterministic unit vector seeded by the text, so reruns produce identical indexes
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+def count_tokens(text):
+    # Close enough to cl100k for quota accounting
+    return max(1, len(text) // 4)
+
+class Window:
+    """Requests and tokens spent in the current one-minute window."""
+
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.started = time.monotonic()
+        self.requests = 0
+        self.tokens = 0
+
+    def admit(self, tokens):
+        now = time.monotonic()
+        if now - self.started >= 60:
+            self.started, self.requests, self.tokens = now, 0, 0
+        reset = 60 - (now - self.started)
+        if (self.rpm and self.requests + 1 > self.rpm) or (self.tpm and self.tokens + tokens > self.tpm):
+            return False, reset
+        self.requests += 1
+        self.tokens += tokens
+        return True, reset
+
+    def headers(self, reset):
+        headers = {"x-ratelimit-reset-requests": f"{reset:.3f}s", "x-ratelimit-reset-tokens": f"{reset:.3f}s"}
+        if self.rpm:
+            headers["x-ratelimit-limit-requests"] = str(self.rpm)
+            headers["x-ratelimit-remaining-requests"] = str(max(0, self.rpm - self.requests))
+        if self.tpm:
+            headers["x-ratelimit-limit-tokens"] = str(self.tpm)
+            headers["x-ratelimit-remaining-tokens"] = str(max(0, self.tpm - self.tokens))
+        return headers
+
+class FakeOpenAI:
+    """OpenAI-compatible /v1/embeddings and /v1/chat/completions with latency and quotas.
+
+    rpm/tpm of 0 disable the limit; error_rate returns that share of requests as 500.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.02, per_token_latency=0.0, rpm=0, tpm=0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.per_token_latency = per_token_latency
+        self.error_rate = error_rate
+        self.windows = {}
+        self.rpm = rpm
+        self.tpm = tpm
+        self.calls = {"embeddings": 0, "embedding_inputs": 0, "chat": 0, "throttled": 0, "errors": 0}
+
+    def _window(self, model):
+        if model not in self.windows:
+            self.windows[model] = Window(self.rpm, self.tpm)
+        return self.windows[model]
+
+    async def _respond(self, model, tokens, body):
+        allowed, reset = self._window(model).admit(tokens)
+        headers = self._window(model).headers(reset)
+        if not allowed:
+            self.calls["throttled"] += 1
+            headers["retry-after-ms"] = str(int(reset * 1000))
+            return web.json_response({"error": {"message": "Rate limit reached", "type": "requests",
+                                                "code": "rate_limit_exceeded"}},
+                                     status=429, headers=headers)
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)
+                                + tokens * self.per_token_latency))
+        if self.error_rate and random.random() < self.error_rate:
+            self.calls["errors"] += 1
+            return web.json_response({"error": {"message": "Injected failure", "type": "server_error"}},
+                                     status=500, headers=headers)
+        return web.json_response(body, headers=headers)
+
+    async def embeddings(self, request):
+        payload = await request.json()
+        inputs = payload["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        self.calls["embeddings"] += 1
+        self.calls["embedding_inputs"] += len(inputs)
+        tokens = sum(count_tokens(text) for text in inputs)
+        dimensions = payload.get("dimensions") or Config.EMBEDDING_DIMENSIONS
+        body = {
+            "object": "list",
+            "model": payload["model"],
+            "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(text, dimensions)}
+                     for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+        return await self._respond(payload["model"], tokens, body)
+
+    async def chat(self, request):
+        payload = await request.json()
+        self.calls["chat"] += 1
+        text = payload["messages"][-1]["content"]
+        words = text.split()
+        summary = " ".join(words[:30])
+        if (payload.get("response_format") or {}).get("type") == "json_object":
+            content = json.dumps({"summary": summary, "contextretrieval": " ".join(words[:60])},
+                                 ensure_ascii=False)
+        else:
+            content = summary
+        prompt_tokens = sum(count_tokens(message["content"]) for message in payload["messages"])
+        completion_tokens = count_tokens(content)
+        body = {
+            "id": f"chatcmpl-{self.calls['chat']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+        return await self._respond(payload["model"], prompt_tokens + (payload.get("max_tokens") or 0), body)
+
+    async def stats(self, request):
+        return web.json_response(self.calls)
+
+    def create_app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post('/v1/embeddings', self.embeddings)
+        app.router.add_post('/v1/chat/completions', self.chat)
+        app.router.add_get('/stats', self.stats)
+        return app
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.05, help="Base response latency, seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--per-token-latency", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute per model, 0 = unlimited")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens per minute per model, 0 = unlimited")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = FakeOpenAI(latency=args.latency, jitter=args.jitter, per_token_latency=args.per_token_latency,
+                        rpm=args.rpm, tpm=args.tpm, error_rate=args.error_rate)
+    print(f"OPENAI_BASE_URL=http://{args.host}:{args.port}/v1")
+    web.run_app(server.create_app(), host=args.host, port=args.port, print=None)
@@ -0,0 +1,83 @@
+import argparse
+import asyncio
+import hashlib
+import random
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+WORDS = ("система для парсинга веб страниц создания эмбеддингов семантического поиска "
+         "данные модель индекс запрос документ текст раздел статья пример результат "
+         "the quick brown fox jumps over lazy dog while indexing large documents").split()
+
+def render_page(number, paragraphs, seed=0):
+    rng = random.Random(seed * 1_000_003 + number)
+    title = " ".join(rng.choice(WORDS) for _ in range(5)).capitalize()
+    body = "\n".join(
+        f"<p>{' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 160)))}.</p>"
+        for _ in range(rng.randint(max(1, paragraphs // 2), paragraphs * 3 // 2 + 1))
+    )
+    links = " ".join(f'<a href="/pages/{rng.randrange(10 ** 6)}.html">ещё</a>' for _ in range(5))
+    return (f"<!DOCTYPE html><html lang=\"ru\"><head><meta charset=\"utf-8\"><title>{title}</title></head>"
+            f"<body><nav>{links}</nav><main><article><h1>{title}</h1>\n{body}\n</article></main>"
+            f"<footer>© benchmark</footer></body></html>")
+
+class FakeSite:
+    """Synthetic corpus at /pages/<n>.html with ETag revalidation and a sitemap.
+
+    Pages are generated deterministically from (seed, n); bumping seed changes every page.
+    """
+
+    def __init__(self, pages=200, paragraphs=12, seed=0, latency=0.0):
+        self.pages = pages
+        self.paragraphs = paragraphs
+        self.seed = seed
+        self.latency = latency
+        self.requests = 0
+        self.not_modified = 0
+
+    def urls(self, base_url):
+        return [f"{base_url}/pages/{n}.html" for n in range(self.pages)]
+
+    async def page(self, request):
+        self.requests += 1
+        number = int(request.match_info['number'])
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        html = render_page(number, self.paragraphs, self.seed)
+        etag = '"' + hashlib.sha256(html.encode('utf-8')).hexdigest()[:16] + '"'
+        if request.headers.get('If-None-Match') == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=html, content_type='text/html', charset='utf-8', headers={"ETag": etag})
+
+    async def sitemap(self, request):
+        base_url = f"{request.scheme}://{request.host}"
+        entries = "".join(f"<url><loc>{url}</loc></url>" for url in self.urls(base_url))
+        return web.Response(text=f'<?xml version="1.0" encoding="UTF-8"?>'
+                                 f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</urlset>',
+                            content_type='application/xml')
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get(r'/pages/{number:\d+}.html', self.page)
+        app.router.add_get('/sitemap.xml', self.sitemap)
+        return app
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Static site with a synthetic corpus for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--paragraphs", type=int, default=12, help="Average paragraphs per page")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="Per-response delay, seconds")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    site = FakeSite(pages=args.pages, paragraphs=args.paragraphs, seed=args.seed, latency=args.latency)
+    print(f"http://{args.host}:{args.port}/sitemap.xml")
+    web.run_app(site.create_app(), host=args.host, port=args.port, print=None)
@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.database import DatabaseManager
+from app.search.local_index import LocalVectorIndex, DTYPES
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+async def build_index():
+    parser = argparse.ArgumentParser(description="Экспорт эмбеддингов датасета в локальный индекс (с дозаписью новых чанков)")
+    parser.add_argument("dataset_id", help="ID датасета")
+    parser.add_argument("--dir", default=Config.LOCAL_INDEX_DIR or "indexes", help="Каталог индексов")
+    parser.add_argument("--dtype", default=Config.LOCAL_INDEX_DTYPE, choices=sorted(DTYPES))
+    parser.add_argument("--every", type=float, default=0,
+                        help="Не выходить, а дозаписывать новые чанки каждые столько секунд (0 - один раз)")
+    args = parser.parse_args()
+
+    db = DatabaseManager()
+    await db.connect()
+
+    try:
+        try:
+            index = LocalVectorIndex(args.dir, args.dataset_id, dtype=args.dtype)
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return
+        while True:
+            added = await index.sync(db)
+            print(f"Добавлено векторов: {added}, всего в индексе: {len(index)}")
+            if args.every <= 0:
+                break
+            await asyncio.sleep(args.every)
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(build_index())
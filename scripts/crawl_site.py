@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.database import DatabaseManager
+from app.metrics import start_metrics_server
+from app.processing.crawler import SiteCrawler
+from app.processing.jobs import enqueue_urls
+from app.processing.pipeline import IngestionPipeline
+from app.processing.scraper import WebScraper
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Обход сайта (sitemap и ссылки внутри домена) с загрузкой в датасет")
+    parser.add_argument("seeds", nargs="+", help="Стартовые URL; их домены ограничивают обход")
+    parser.add_argument("--dataset-id", help="ID датасета")
+    parser.add_argument("--max-pages", type=int, default=Config.CRAWL_MAX_PAGES, help="Не больше страниц (0 - без ограничения)")
+    parser.add_argument("--max-depth", type=int, default=Config.CRAWL_MAX_DEPTH, help="Глубина переходов по ссылкам")
+    parser.add_argument("--frontier-size", type=int, default=Config.CRAWL_FRONTIER_SIZE,
+                        help="Сколько найденных URL держать в очереди обхода")
+    parser.add_argument("--domain", action="append", default=[], help="Дополнительный разрешённый домен")
+    parser.add_argument("--no-sitemaps", action="store_true", help="Не читать robots.txt и sitemap.xml")
+    parser.add_argument("--no-links", action="store_true", help="Не переходить по ссылкам")
+    parser.add_argument("--ignore-robots", action="store_true", help="Не соблюдать Disallow из robots.txt")
+    parser.add_argument("--enqueue", action="store_true",
+                        help="Только поставить URL из sitemap в очередь для scripts/ingest_worker.py (без ссылок)")
+    parser.add_argument("--list", action="store_true", help="Только вывести URL из sitemap (без ссылок)")
+    parser.add_argument("--defer-enrichment", action="store_true",
+                        help="Сохранять чанки сразу после эмбеддинга, резюме создаст scripts/enrich_chunks.py")
+    parser.add_argument("--metrics-port", type=int, default=Config.METRICS_PORT,
+                        help="Отдавать метрики Prometheus на этом порту во время работы (0 - выключено)")
+    return parser.parse_args()
+
+async def crawl_site():
+    args = parse_args()
+    discover_only = args.enqueue or args.list
+    if not args.list and not args.dataset_id:
+        args.dataset_id = input("Введите ID датасета: ")
+
+    db = DatabaseManager()
+    scraper = WebScraper()
+    crawler = SiteCrawler(
+        scraper, args.seeds, db=db, max_pages=args.max_pages, max_depth=args.max_depth,
+        frontier_size=args.frontier_size, domains=args.domain, use_sitemaps=not args.no_sitemaps,
+        # Links need the page bodies, which only the ingestion pipeline downloads
+        follow_links=not (args.no_links or discover_only), respect_robots=not args.ignore_robots
+    )
+
+    if args.list:
+        try:
+            async for url, _ in crawler.urls():
+                print(url)
+        finally:
+            await scraper.close()
+        return
+
+    await db.connect()
+    metrics_runner = await start_metrics_server(port=args.metrics_port) if args.metrics_port else None
+
+    try:
+        if not await db.get_dataset_info(args.dataset_id):
+            print("Датасет не найден!")
+            return
+
+        if args.enqueue:
+            enqueued, batch = 0, []
+            async for url, _ in crawler.urls():
+                batch.append(url)
+                if len(batch) >= 1000:
+                    enqueued += await enqueue_urls(db, args.dataset_id, batch)
+                    batch = []
+            enqueued += await enqueue_urls(db, args.dataset_id, batch)
+            print(f"Поставлено в очередь: {enqueued}")
+            return
+
+        options = {"enrichment_mode": "deferred"} if args.defer_enrichment else {}
+        pipeline = await IngestionPipeline.for_dataset(
+            db, args.dataset_id, scraper=scraper,
+            on_fetched=crawler.on_fetched, on_finished=crawler.on_finished, **options
+        )
+        stats = await pipeline.run_jobs(crawler.jobs())
+        print(f"Обработано страниц: {stats['pages_processed']}, без изменений: {stats['pages_unchanged']}, "
+              f"ошибок: {stats['pages_failed']}, чанков: {stats['chunks_created']}")
+        print(f"Обход: {json.dumps(crawler.stats, ensure_ascii=False)}")
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await scraper.close()
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(crawl_site())
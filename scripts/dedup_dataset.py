@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.database import DatabaseManager
+from app.processing.dedup import MinHasher, find_duplicates
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Сигнатуры MinHash и LSH-индекс почти дубликатов для уже загруженных страниц и чанков")
+    parser.add_argument("--dataset-id", required=True, help="ID датасета")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--threshold", type=float, default=Config.DEDUP_THRESHOLD, help="Порог сходства для отчёта")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Сначала удалить все сигнатуры датасета (после смены DEDUP_NUM_PERM/DEDUP_BANDS)")
+    return parser.parse_args()
+
+async def backfill(db, hasher, kind, args):
+    # Existing rows all stay canonical; near-duplicates among them are only counted
+    signed = duplicates = 0
+    batch = []
+
+    async def flush():
+        nonlocal signed, duplicates
+        signatures = await asyncio.to_thread(lambda: [hasher.signature(text) for _, text in batch])
+        keys = list({key for signature in signatures if signature is not None for key in hasher.band_keys(signature)})
+        candidates = await db.find_near_duplicates(kind, args.dataset_id, keys)
+        matches = find_duplicates(hasher, signatures, candidates, args.threshold)
+        duplicates += sum(1 for match in matches if match is not None)
+        await db.set_signatures(kind, args.dataset_id, [
+            (item_id, signature, hasher.band_keys(signature))
+            for (item_id, _), signature in zip(batch, signatures) if signature is not None
+        ])
+        signed += len(batch)
+        batch.clear()
+
+    async for row in db.iter_unsigned(kind, args.dataset_id):
+        batch.append((str(row['id']), row['text']))
+        if len(batch) >= args.batch_size:
+            await flush()
+    if batch:
+        await flush()
+    return signed, duplicates
+
+async def dedup_dataset():
+    args = parse_args()
+
+    db = DatabaseManager()
+    await db.connect()
+
+    try:
+        if not await db.get_dataset_info(args.dataset_id):
+            print("Датасет не найден!")
+            return
+        if args.rebuild:
+            await db.clear_signatures(args.dataset_id)
+
+        hasher = MinHasher()
+        for kind, label in (('page', 'Страниц'), ('chunk', 'Чанков')):
+            signed, duplicates = await backfill(db, hasher, kind, args)
+            print(f"{label} с новыми сигнатурами: {signed}, из них почти дубликатов: {duplicates}")
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(dedup_dataset())
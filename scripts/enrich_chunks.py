@@ -0,0 +1,38 @@
+import argparse
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.database import DatabaseManager
+from app.processing.enrichment import EnrichmentWorker
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Фоновое создание резюме и контекста для чанков без них")
+    parser.add_argument("--dataset-id", help="Только чанки этого датасета")
+    parser.add_argument("--concurrency", type=int, default=Config.ENRICHMENT_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=Config.ENRICHMENT_BATCH_SIZE)
+    parser.add_argument("--poll-interval", type=float, default=10.0, help="Пауза при пустой очереди, сек")
+    parser.add_argument("--once", action="store_true", help="Завершиться, когда очередь опустеет")
+    return parser.parse_args()
+
+async def enrich_chunks():
+    args = parse_args()
+
+    db = DatabaseManager()
+    await db.connect()
+
+    try:
+        worker = EnrichmentWorker(db, dataset_id=args.dataset_id,
+                                  batch_size=args.batch_size, concurrency=args.concurrency)
+        stats = await worker.run(poll_interval=args.poll_interval, stop_when_idle=args.once)
+        print(f"Обогащено чанков: {stats['chunks_enriched']}, ошибок: {stats['chunks_failed']}")
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(enrich_chunks())
@@ -0,0 +1,36 @@
+import argparse
+import asyncio
+import json
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.database import DatabaseManager
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Выгрузка датасета: метаданные в JSONL, эмбеддинги в embeddings.npy")
+    parser.add_argument("--dataset-id", required=True, help="ID датасета")
+    parser.add_argument("--output", required=True, help="Каталог архива (создаётся, не должен содержать архив)")
+    parser.add_argument("--no-compress", action="store_true", help="Не сжимать JSONL (zstd)")
+    parser.add_argument("--batch-size", type=int, default=Config.ARCHIVE_BATCH_SIZE, help="Строк за одно чтение курсора")
+    return parser.parse_args()
+
+async def export_dataset():
+    args = parse_args()
+
+    db = DatabaseManager()
+    try:
+        started = time.perf_counter()
+        counts = await db.export_dataset(args.dataset_id, args.output, compress=not args.no_compress,
+                                         batch_size=args.batch_size)
+        print(f"Выгружено за {time.perf_counter() - started:.1f} с: {json.dumps(counts, ensure_ascii=False)}")
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(export_dataset())
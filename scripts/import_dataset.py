@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+import json
+import sys
+import os
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.archive import ArchiveReader
+from app.config import Config
+from app.database import DatabaseManager
+from app.processing.dedup import MinHasher
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Загрузка датасета из архива scripts/export_dataset.py в новый датасет")
+    parser.add_argument("archive", help="Каталог архива")
+    parser.add_argument("--name", help="Название нового датасета (по умолчанию из архива)")
+    parser.add_argument("--batch-size", type=int, default=Config.ARCHIVE_BATCH_SIZE, help="Строк в одном COPY")
+    return parser.parse_args()
+
+async def import_dataset():
+    args = parse_args()
+    reader = ArchiveReader(args.archive)
+
+    db = DatabaseManager()
+    try:
+        started = time.perf_counter()
+        dataset_id = await db.import_dataset(args.archive, name=args.name, hasher=MinHasher(),
+                                             batch_size=args.batch_size)
+        print(f"Загружено за {time.perf_counter() - started:.1f} с: {json.dumps(reader.counts, ensure_ascii=False)}")
+        print(f"Датасет создан с ID: {dataset_id}")
+        if reader.dataset.get('coarsedimensions') or reader.dataset.get('coarsequantization'):
+            print("Индекс грубого поиска не переносится: постройте его через scripts/migrate.py --coarse")
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(import_dataset())
@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.database import DatabaseManager
+from app.metrics import start_metrics_server
+from app.processing.jobs import IngestionWorker
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Воркер очереди страниц: забирает URL в статусе pending и обрабатывает их")
+    parser.add_argument("--dataset-id", help="Только страницы этого датасета")
+    parser.add_argument("--batch-size", type=int, default=Config.JOB_BATCH_SIZE, help="Страниц за один захват")
+    parser.add_argument("--max-in-flight", type=int, default=Config.JOB_MAX_IN_FLIGHT,
+                        help="Сколько захваченных страниц обрабатывать одновременно")
+    parser.add_argument("--lease", type=int, default=Config.JOB_LEASE_SECONDS, help="Аренда страницы, сек")
+    parser.add_argument("--max-attempts", type=int, default=Config.JOB_MAX_ATTEMPTS)
+    parser.add_argument("--defer-enrichment", action="store_true",
+                        help="Сохранять чанки сразу после эмбеддинга, резюме создаст scripts/enrich_chunks.py")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="Пауза при пустой очереди, сек")
+    parser.add_argument("--once", action="store_true", help="Завершиться, когда очередь опустеет")
+    parser.add_argument("--status", action="store_true", help="Показать состояние очереди и выйти")
+    parser.add_argument("--metrics-port", type=int, default=Config.METRICS_PORT,
+                        help="Отдавать метрики Prometheus на этом порту (0 - выключено)")
+    return parser.parse_args()
+
+async def ingest_worker():
+    args = parse_args()
+
+    db = DatabaseManager()
+    await db.connect()
+    metrics_runner = None
+
+    try:
+        if args.status:
+            for state, pages in sorted((await db.get_queue_counts(args.dataset_id)).items()):
+                print(f"{state}: {pages}")
+            return
+
+        if args.metrics_port:
+            metrics_runner = await start_metrics_server(port=args.metrics_port)
+        options = {"enrichment_mode": "deferred"} if args.defer_enrichment else {}
+        worker = IngestionWorker(db, dataset_id=args.dataset_id, batch_size=args.batch_size,
+                                 max_in_flight=args.max_in_flight, lease_seconds=args.lease,
+                                 max_attempts=args.max_attempts, **options)
+        stats = await worker.run(poll_interval=args.poll_interval, stop_when_idle=args.once)
+        print(f"Обработано страниц: {stats['pages_done']}, отложено на повтор: {stats['pages_retried']}, "
+              f"отброшено: {stats['pages_abandoned']}")
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(ingest_worker())
@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.database import DatabaseManager
+from app import schema
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Миграции схемы и управление векторными индексами")
+    parser.add_argument("--create-index", choices=sorted(schema.INDEX_METHODS), help="Создать индекс hnsw или ivfflat")
+    parser.add_argument("--dataset-id", help="Частичный индекс только для этого датасета")
+    parser.add_argument("--m", type=int, default=16, help="HNSW: связей на узел")
+    parser.add_argument("--ef-construction", type=int, default=64, help="HNSW: ef_construction")
+    parser.add_argument("--lists", type=int, help="IVFFlat: число списков (по умолчанию по числу строк)")
+    parser.add_argument("--drop-index", help="Удалить индекс по имени")
+    parser.add_argument("--reindex", help="Перестроить индекс по имени")
+    parser.add_argument("--list", action="store_true", help="Показать векторные индексы")
+    parser.add_argument("--coarse", choices=sorted(schema.QUANTIZATIONS),
+                        help="Двухфазный поиск датасета: индекс по укороченным/квантованным векторам и точное переранжирование")
+    parser.add_argument("--coarse-dimensions", type=int, help="Размерность укороченного вектора (по умолчанию полная)")
+    parser.add_argument("--rerank-factor", type=int, default=4, help="Кандидатов на переранжирование: limit * factor")
+    parser.add_argument("--no-coarse", action="store_true", help="Вернуть датасет к поиску по полным векторам")
+    parser.add_argument("--footprint", action="store_true", help="Показать объём векторов и индексов датасета")
+    parser.add_argument("--offload-raw-html", action="store_true",
+                        help="Перенести rawhtml из smart_pages в хранилище RAW_STORE (сжатие zstd)")
+    parser.add_argument("--gc-raw-html", action="store_true", help="Удалить сырой HTML, на который не ссылается ни одна страница")
+    return parser.parse_args()
+
+async def migrate():
+    args = parse_args()
+
+    db = DatabaseManager()
+    await db.connect()
+
+    try:
+        async with db.pool.acquire() as conn:
+            applied = await schema.apply_migrations(conn)
+            print(f"Применено миграций: {len(applied)}")
+
+            if args.create_index:
+                name = await schema.create_vector_index(
+                    conn, args.create_index, dataset_id=args.dataset_id,
+                    m=args.m, ef_construction=args.ef_construction, lists=args.lists
+                )
+                print(f"Индекс {name} готов")
+            if args.drop_index:
+                await schema.drop_vector_index(conn, args.drop_index)
+            if args.reindex:
+                await schema.reindex_vector_index(conn, args.reindex)
+            if args.list:
+                for index in await schema.list_vector_indexes(conn):
+                    print(f"{index['name']} ({index['size'] / 1024 / 1024:.1f} MB): {index['definition']}")
+            if (args.coarse or args.no_coarse or args.footprint) and not args.dataset_id:
+                raise SystemExit("--coarse, --no-coarse и --footprint требуют --dataset-id")
+            if args.coarse:
+                dimensions = args.coarse_dimensions or Config.EMBEDDING_DIMENSIONS
+                name = await schema.create_coarse_index(
+                    conn, args.dataset_id, dimensions, args.coarse,
+                    method=args.create_index or 'hnsw', m=args.m,
+                    ef_construction=args.ef_construction, lists=args.lists
+                )
+                # Switch searches over only once the index exists
+                await db.set_search_settings(args.dataset_id, dimensions, args.coarse, args.rerank_factor)
+                print(f"Индекс {name} готов, поиск датасета двухфазный")
+            if args.no_coarse:
+                await db.set_search_settings(args.dataset_id)
+                for method in schema.INDEX_METHODS:
+                    await schema.drop_vector_index(conn, schema.coarse_index_name(method, args.dataset_id))
+                print("Поиск датасета по полным векторам")
+            if args.footprint:
+                footprint = await schema.dataset_footprint(conn, args.dataset_id)
+                print(json.dumps(footprint, ensure_ascii=False, indent=2))
+            if args.gc_raw_html:
+                if db.raw_store is None:
+                    print("RAW_STORE=inline: сырой HTML хранится в smart_pages.rawhtml, очищать нечего")
+                else:
+                    removed = await db.raw_store.collect_garbage(conn)
+                    print(f"Удалено неиспользуемых HTML: {removed}")
+
+        if args.offload_raw_html:
+            moved = await db.offload_raw_html()
+            print(f"Перенесено страниц: {moved}. Место в smart_pages освободит VACUUM FULL smart_pages")
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
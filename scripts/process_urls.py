@@ -1,91 +1,76 @@
+import argparse
 import asyncio
+import json
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from app.config import Config
 from app.database import DatabaseManager
-from app.processing.scraper import WebScraper
-from app.processing.chunker import TextChunker
-from app.processing.embedder import EmbeddingGenerator
+from app.metrics import REGISTRY, start_metrics_server
+from app.processing.jobs import enqueue_urls
+from app.processing.pipeline import IngestionPipeline, read_urls
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Обработка URL-адресов в датасет")
+    parser.add_argument("--dataset-id", help="ID датасета")
+    parser.add_argument("--urls-file", help="Файл со списком URL (по одному в строке), '-' для stdin")
+    parser.add_argument("--defer-enrichment", action="store_true",
+                        help="Сохранять чанки сразу после эмбеддинга, резюме создаст scripts/enrich_chunks.py")
+    parser.add_argument("--enqueue", action="store_true",
+                        help="Только поставить URL в очередь; обработают воркеры scripts/ingest_worker.py")
+    parser.add_argument("--metrics-port", type=int, default=Config.METRICS_PORT,
+                        help="Отдавать метрики Prometheus на этом порту во время работы (0 - выключено)")
+    parser.add_argument("--metrics-output", help="Записать JSON-сводку метрик по этапам в файл после завершения")
+    parser.add_argument("urls", nargs="*", help="URL-адреса")
+    return parser.parse_args()
+
 async def process_urls():
-    dataset_id = input("Введите ID датасета: ")
-    urls_input = input("Введите URL-адреса через запятую: ")
-    urls = [url.strip() for url in urls_input.split(',')]
-    
+    args = parse_args()
+
+    dataset_id = args.dataset_id or input("Введите ID датасета: ")
+    if args.urls_file == '-':
+        urls = read_urls(sys.stdin)
+    elif args.urls_file:
+        urls = read_urls(open(args.urls_file, encoding='utf-8'))
+    elif args.urls:
+        urls = read_urls(args.urls)
+    else:
+        urls = read_urls([input("Введите URL-адреса через запятую: ")])
+
     db = DatabaseManager()
     await db.connect()
-    
+    metrics_runner = await start_metrics_server(port=args.metrics_port) if args.metrics_port else None
+
     try:
-        # Get dataset info
-        dataset_info = await db.get_dataset_info(dataset_id)
-        if not dataset_info:
+        if args.enqueue:
+            if not await db.get_dataset_info(dataset_id):
+                print("Датасет не найден!")
+                return
+            print(f"Поставлено в очередь: {await enqueue_urls(db, dataset_id, urls)}")
+            return
+
+        options = {"enrichment_mode": "deferred"} if args.defer_enrichment else {}
+        pipeline = await IngestionPipeline.for_dataset(db, dataset_id, **options)
+        if not pipeline:
             print("Датасет не найден!")
             return
-        
-        print(f"Обрабатываем датасет: {dataset_info['name']}")
-        
-        # Initialize processors
-        scraper = WebScraper()
-        chunker = TextChunker(
-            chunk_size=dataset_info['chunksize'],
-            chunk_overlap=dataset_info['chunkoverlap']
-        )
-        embedder = EmbeddingGenerator()
-        
-        for url in urls:
-            logger.info(f"Обрабатываем URL: {url}")
-            
-            # Scrape content
-            content = await scraper.scrape_url(url)
-            
-            if content.get('error'):
-                logger.error(f"Ошибка при парсинге {url}: {content['error']}")
-                continue
-            
-            # Add page to database
-            page_id = await db.add_page(
-                dataset_id=dataset_id,
-                url=url,
-                title=content.get('title'),
-                rawhtml=content.get('rawhtml'),
-                cleantext=content.get('cleantext'),
-                wordcount=content.get('wordcount')
-            )
-            
-            # Chunk text
-            if content.get('cleantext'):
-                chunks = chunker.chunk_text(content['cleantext'])
-                
-                for chunk_data in chunks:
-                    # Generate embedding
-                    embedding = await embedder.generate_embedding(chunk_data['text'])
-                    
-                    # Generate summary and context
-                    summary = await embedder.generate_summary(chunk_data['text'])
-                    context = await embedder.generate_context_retrieval(chunk_data['text'])
-                    
-                    # Add chunk to database
-                    chunk_id = await db.add_chunk(
-                        page_id=page_id,
-                        text=chunk_data['text'],
-                        summary=summary,
-                        contextretrieval=context,
-                        embedding=embedding,
-                        tokencount=chunk_data['tokencount']
-                    )
-                    
-                    logger.info(f"Создан чанк {chunk_id}")
-                
-                # Update page status
-                await db.update_page_status(page_id, 'processed')
-                logger.info(f"Страница {url} обработана успешно")
-            
+
+        stats = await pipeline.run(urls)
+        print(f"Обработано страниц: {stats['pages_processed']}, "
+              f"ошибок: {stats['pages_failed']}, чанков: {stats['chunks_created']}")
+
+        if args.metrics_output:
+            with open(args.metrics_output, 'w', encoding='utf-8') as f:
+                json.dump(REGISTRY.summary(), f, ensure_ascii=False, indent=2)
+
     finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await db.close()
 
 if __name__ == "__main__":
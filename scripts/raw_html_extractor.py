@@ -1,21 +1,29 @@
+import argparse
 import asyncio
 import aiohttp
-import trafilatura
 from aiohttp import ClientTimeout
-from bs4 import BeautifulSoup
 import logging
 import sys
 import json
+import time
 import uuid
 import asyncpg
-from datetime import datetime
+from typing import Dict, Iterable, List
 import os
 from dotenv import load_dotenv
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.processing.extractor import ContentExtractor
+from app.processing.pipeline import read_urls
+from app.processing.scraper import read_html
+from app.processing.urls import normalize_url
+from app.rawstore import create_raw_store
 
 # Загружаем переменные окружения из .env
 load_dotenv()
 
-# Настройка логирования
+# Настройка логирования (в stderr: stdout занят результатами)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -23,11 +31,28 @@ logging.basicConfig(
 logger = logging.getLogger("raw_html_extractor")
 
 class RawHTMLExtractor:
-    def __init__(self, dataset_id: str):
+    """Fetches URLs with bounded concurrency on one session and saves pages in multi-row inserts.
+
+    Rows are buffered until batch_size or flush_interval; each URL's result is written
+    as a JSON line once its row is committed, so memory does not grow with the list.
+    """
+
+    def __init__(self, dataset_id: str, concurrency: int = Config.PIPELINE_SCRAPE_WORKERS,
+                 batch_size: int = 200, flush_interval: float = 5.0, output=sys.stdout):
         self.dataset_id = dataset_id
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.output = output
         self.session = None
         self.db_pool = None
-        
+        self.extractor = ContentExtractor()
+        self.raw_store = create_raw_store()
+        self.buffer: List[Dict] = []
+        self.flushed_at = time.monotonic()
+        self.flush_lock = asyncio.Lock()
+        self.stats = {"success": 0, "error": 0}
+
     async def __aenter__(self):
         database_url = os.getenv('DATABASE_URL')
         if not database_url:
@@ -40,76 +65,156 @@ class RawHTMLExtractor:
             "Accept-Language": "en-US,en;q=0.5",
             "Connection": "keep-alive"
         }
-        self.session = aiohttp.ClientSession(timeout=timeout, headers=headers)
+        # Every worker shares this session; the connector caps sockets overall and per host
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=Config.SCRAPER_MAX_PER_HOST,
+                                         ttl_dns_cache=Config.SCRAPER_DNS_TTL)
+        self.session = aiohttp.ClientSession(timeout=timeout, headers=headers, connector=connector)
         return self
-        
+
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         if self.session:
             await self.session.close()
         if self.db_pool:
             await self.db_pool.close()
+        self.extractor.close()
 
-    async def fetch_and_save(self, url: str) -> dict:
+    async def fetch(self, url: str) -> Dict:
         logger.info(f"Fetching URL: {url}")
+        row = {"id": uuid.uuid4(), "url": url, "normalizedurl": normalize_url(url)}
         try:
             async with self.session.get(url) as response:
                 if response.status != 200:
                     raise Exception(f"HTTP {response.status}")
-                html = await response.text()
-            
-            title = self.extract_title(html)
-            word_count = self.count_words(html)
-            page_id = await self.save_to_db(url, title, html, word_count)
-            logger.info(f"Saved page {page_id} for URL: {url}")
-            return {"url": url, "page_id": page_id, "title": title, "word_count": word_count, "status": "success"}
-            
+                # Streamed and size-capped; non-HTML is refused from the headers
+                html = await read_html(response)
+
+            # Title, clean text and word count come from one parse, off the event loop
+            content = await self.extractor.extract(html, url, heading_fallback=True)
+            if content.get('error'):
+                raise Exception(content['error'])
+            # Raw HTML goes to the store right away, so the buffer only holds the extracted text
+            rawhtml, rawhash = await self.store_raw_html(html)
+            row.update(title=content['title'] or "No title", rawhtml=rawhtml, rawhash=rawhash,
+                       cleantext=content['cleantext'] or '', wordcount=content['wordcount'],
+                       status="pending", errormessage=None)
+
         except Exception as e:
             logger.error(f"Error fetching {url}: {str(e)}")
-            await self.save_to_db(url, "Error", "", 0, status="error", error_message=str(e))
-            return {"url": url, "status": "error", "error": str(e)}
-
-    def extract_title(self, html: str) -> str:
-        soup = BeautifulSoup(html, 'html.parser')
-        title_tag = soup.find('title')
-        if title_tag and title_tag.text.strip():
-            return title_tag.text.strip()[:500]
-        h1_tag = soup.find('h1')
-        if h1_tag and h1_tag.text.strip():
-            return h1_tag.text.strip()[:500]
-        return "No title"
-
-    def count_words(self, html: str) -> int:
-        text = trafilatura.extract(html) or ""
-        return len(text.split())
-
-    async def save_to_db(self, url: str, title: str, rawhtml: str, word_count: int, status: str = "pending", error_message: str = None) -> str:
+            row.update(title="Error", rawhtml="", rawhash=None, cleantext='', wordcount=0,
+                       status="error", errormessage=str(e))
+        return row
+
+    async def store_raw_html(self, html: str) -> tuple:
+        # (value for smart_pages.rawhtml, value for smart_pages.rawhash); unreferenced content
+        # left by a failed insert is removed by migrate.py --gc-raw-html
+        if self.raw_store is None or not html:
+            return html, None
+        async with self.db_pool.acquire() as conn:
+            return None, await self.raw_store.put(conn, html)
+
+    async def add(self, row: Dict):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.flushed_at >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self):
+        async with self.flush_lock:
+            rows, self.buffer = self.buffer, []
+            self.flushed_at = time.monotonic()
+            if not rows:
+                return
+            try:
+                await self.save_to_db(rows)
+            except Exception as e:
+                # The batch is lost, not the run: its URLs are reported as errors and nothing was saved
+                logger.error(f"Error saving {len(rows)} pages: {str(e)}")
+                for row in rows:
+                    row.update(id=None, status="error", errormessage=f"Insert failed: {str(e)}")
+            for row in rows:
+                self.stats[row['status'] if row['status'] == 'error' else 'success'] += 1
+                self.output.write(json.dumps(self.result(row), ensure_ascii=False) + "\n")
+            self.output.flush()
+
+    @staticmethod
+    def result(row: Dict) -> Dict:
+        if row['status'] == 'error':
+            return {"url": row['url'], "page_id": str(row['id']) if row['id'] else None,
+                    "status": "error", "error": row['errormessage']}
+        return {"url": row['url'], "page_id": str(row['id']), "title": row['title'],
+                "word_count": row['wordcount'], "status": "success"}
+
+    async def save_to_db(self, rows: List[Dict]):
+        # One INSERT for the whole batch; ids are generated here so results need no RETURNING order
+        columns = ('id', 'url', 'normalizedurl', 'title', 'rawhtml', 'rawhash', 'cleantext', 'wordcount',
+                   'status', 'errormessage')
         async with self.db_pool.acquire() as conn:
-            page_id = await conn.fetchval("""
-                INSERT INTO smart_pages (datasetid, url, title, rawhtml, cleantext, wordcount, status, errormessage, createdat)
-                VALUES ($1, $2, $3, $4, '', $5, $6, $7, NOW())
-                RETURNING id
-            """, uuid.UUID(self.dataset_id), url, title, rawhtml, word_count, status, error_message)
-            return str(page_id)
+            await conn.execute("""
+                INSERT INTO smart_pages (datasetid, id, url, normalizedurl, title, rawhtml, rawhash, cleantext,
+                                         wordcount, status, errormessage, chunkversion, createdat)
+                SELECT $1, u.*, (SELECT chunkversion FROM smart_datasets WHERE id = $1), NOW()
+                FROM unnest($2::uuid[], $3::text[], $4::text[], $5::text[], $6::text[], $7::text[], $8::text[],
+                            $9::integer[], $10::text[], $11::text[]) AS u
+            """, uuid.UUID(self.dataset_id), *([row[column] for row in rows] for column in columns))
+        logger.info(f"Saved {len(rows)} pages")
+
+    async def run(self, urls: Iterable[str]) -> Dict[str, int]:
+        # A bounded queue between the URL reader and the fetchers keeps long lists out of memory
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                url = await queue.get()
+                if url is None:
+                    return
+                await self.add(await self.fetch(url))
+
+        async def produce():
+            for url in urls:
+                await queue.put(url)
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        # Awaited together: a worker that dies takes the producer down with it instead of
+        # leaving it blocked on a full queue
+        tasks = [asyncio.create_task(produce())] + [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.flush()
+        return self.stats
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Скачивание HTML страниц в датасет без чанков; результат по каждому URL - строка JSON в stdout")
+    parser.add_argument("dataset_id", help="ID датасета")
+    parser.add_argument("urls_json", nargs="?", default='[]', help="JSON-список URL или один URL")
+    parser.add_argument("--urls-file", help="Файл со списком URL (по одному в строке), '-' для stdin")
+    parser.add_argument("--concurrency", type=int, default=Config.PIPELINE_SCRAPE_WORKERS,
+                        help="Сколько URL скачивать одновременно")
+    parser.add_argument("--batch-size", type=int, default=200, help="Страниц в одном INSERT")
+    return parser.parse_args()
 
 async def main():
-    if len(sys.argv) < 2:
-        print("Usage: python raw_html_extractor.py <dataset_id> <urls_json>")
-        sys.exit(1)
-    
-    dataset_id = sys.argv[1]
-    urls_json = sys.argv[2] if len(sys.argv) > 2 else '[]'
-    
-    try:
-        urls = json.loads(urls_json)
-    except Exception:
-        urls = [urls_json]
-    
-    async with RawHTMLExtractor(dataset_id) as extractor:
-        results = []
-        for url in urls:
-            result = await extractor.fetch_and_save(url)
-            results.append(result)
-        print(json.dumps(results, ensure_ascii=False, indent=2))
+    args = parse_args()
+
+    if args.urls_file == '-':
+        urls = read_urls(sys.stdin)
+    elif args.urls_file:
+        urls = read_urls(open(args.urls_file, encoding='utf-8'))
+    else:
+        try:
+            urls = json.loads(args.urls_json)
+        except Exception:
+            urls = [args.urls_json]
+        if isinstance(urls, str):
+            urls = [urls]
+
+    async with RawHTMLExtractor(args.dataset_id, concurrency=args.concurrency,
+                                batch_size=args.batch_size) as extractor:
+        stats = await extractor.run(urls)
+    logger.info(f"Done: {stats}")
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import json
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import Config
+from app.database import DatabaseManager
+from app.metrics import start_metrics_server
+from app.processing.rechunk import RechunkJob
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Перестроение чанков датасета (новый размер чанка, перекрытие или модель эмбеддингов) "
+                    "в новую версию без остановки поиска")
+    parser.add_argument("--dataset-id", required=True, help="ID датасета")
+    parser.add_argument("--chunk-size", type=int, help="Новый размер чанка (по умолчанию текущий)")
+    parser.add_argument("--chunk-overlap", type=int, help="Новое перекрытие чанков (по умолчанию текущее)")
+    parser.add_argument("--model", help="Новая модель эмбеддингов (по умолчанию текущая)")
+    parser.add_argument("--batch-size", type=int, default=Config.RECHUNK_BATCH_PAGES, help="Страниц за раз")
+    parser.add_argument("--pages-per-second", type=float, default=Config.RECHUNK_PAGES_PER_SECOND,
+                        help="Не быстрее стольких страниц в секунду (0 - без ограничения)")
+    parser.add_argument("--api-share", type=float, default=Config.RECHUNK_API_SHARE,
+                        help="Доля лимитов OpenAI (RPM/TPM/параллельность), которую может занять перестроение")
+    parser.add_argument("--no-switch", action="store_true",
+                        help="Только построить новую версию, не переключая на неё поиск")
+    parser.add_argument("--no-gc", action="store_true", help="Не удалять чанки старой версии после переключения")
+    parser.add_argument("--gc-only", action="store_true", help="Только удалить чанки старых и прерванных версий")
+    parser.add_argument("--abort", action="store_true", help="Прервать перестроение; его чанки удалит --gc-only")
+    parser.add_argument("--status", action="store_true", help="Показать версии чанков датасета")
+    parser.add_argument("--metrics-port", type=int, default=Config.METRICS_PORT,
+                        help="Отдавать метрики Prometheus на этом порту во время работы (0 - выключено)")
+    return parser.parse_args()
+
+async def rechunk_dataset():
+    args = parse_args()
+
+    db = DatabaseManager()
+    await db.connect()
+    metrics_runner = None
+
+    try:
+        if not await db.get_dataset_info(args.dataset_id):
+            print("Датасет не найден!")
+            return
+
+        if args.status:
+            for row in await db.get_chunk_versions(args.dataset_id):
+                left = f", осталось страниц: {row['pagesleft']}" if row['pagesleft'] is not None else ""
+                print(f"Версия {row['version']} ({row['status']}): размер {row['chunksize']}, "
+                      f"перекрытие {row['chunkoverlap']}, модель {row['embeddingmodel']}, "
+                      f"чанков: {row['chunks']}{left}")
+            return
+        if args.abort:
+            version = await db.abort_chunk_version(args.dataset_id)
+            print(f"Перестроение версии {version} прервано" if version else "Перестроение не идёт")
+            return
+
+        job = RechunkJob(db, args.dataset_id, chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                         embedding_model=args.model, batch_pages=args.batch_size,
+                         pages_per_second=args.pages_per_second, api_share=args.api_share)
+        if args.gc_only:
+            print(f"Удалено чанков: {await job.collect()}")
+            return
+
+        metrics_runner = await start_metrics_server(port=args.metrics_port) if args.metrics_port else None
+        try:
+            stats = await job.run(switch=not args.no_switch, collect=not args.no_gc)
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        if stats["switched"]:
+            print(f"Поиск переключён на версию {job.version}")
+        elif not args.no_switch:
+            print("Версия не переключена: остались необработанные страницы, запустите скрипт ещё раз")
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(rechunk_dataset())
@@ -3,6 +3,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from app.config import Config
 from app.database import DatabaseManager
 from app.processing.embedder import EmbeddingGenerator
 
@@ -11,6 +12,7 @@ async def search():
     dataset_id = input("Введите ID датасета (опционально): ") or None
     limit = input("Количество результатов (по умолчанию 10): ")
     limit = int(limit) if limit else 10
+    hybrid = input("Гибридный поиск (вектор + полнотекстовый), y/N: ").strip().lower() in ('y', 'yes', 'д', 'да')
     
     db = DatabaseManager()
     embedder = EmbeddingGenerator()
@@ -18,19 +20,38 @@ async def search():
     await db.connect()
     
     try:
-        # Generate embedding for query
-        query_embedding = await embedder.generate_embedding(query)
+        # Generate embedding for query, with the model the dataset's chunks were embedded with
+        settings = await db.get_search_settings(dataset_id) if dataset_id else None
+        query_embedding = await embedder.generate_embedding(query, model=settings and settings['embeddingmodel'])
+        chunk_version = settings and settings['chunkversion']
         
         if not query_embedding:
             print("Ошибка при создании эмбеддинга запроса")
             return
         
-        # Search similar chunks
-        results = await db.search_similar_chunks(
-            query_embedding=query_embedding,
-            dataset_id=dataset_id,
-            limit=limit
-        )
+        # Search similar chunks, through the local index when one is configured; it is kept up to
+        # date by scripts/build_index.py, not per query
+        index = None
+        if Config.LOCAL_INDEX_DIR and dataset_id and not hybrid:
+            from app.search.local_index import LocalVectorIndex
+            index = LocalVectorIndex(Config.LOCAL_INDEX_DIR, dataset_id)
+            if not len(index) or index.meta.get('chunkversion') != chunk_version:
+                print("Локальный индекс пуст или устарел, поиск идёт по базе. Обновите его: "
+                      "python scripts/build_index.py " + dataset_id)
+                index = None
+        
+        if hybrid:
+            results = await db.hybrid_search_chunks(query_embedding, query, dataset_id=dataset_id, limit=limit,
+                                                    chunk_version=chunk_version)
+        elif index is not None:
+            results = await index.search(db, query_embedding, limit=limit)
+        else:
+            results = await db.search_similar_chunks(
+                query_embedding=query_embedding,
+                dataset_id=dataset_id,
+                limit=limit,
+                chunk_version=chunk_version
+            )
         
         print(f"\nНайдено {len(results)} результатов:\n")
         
@@ -0,0 +1,23 @@
+import argparse
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+from app.config import Config
+from app.search.server import create_app
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP-сервер семантического поиска (GET /search?q=...&dataset_id=...)")
+    parser.add_argument("--host", default=Config.SEARCH_SERVER_HOST)
+    parser.add_argument("--port", type=int, default=Config.SEARCH_SERVER_PORT)
+    args = parser.parse_args()
+
+    web.run_app(create_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
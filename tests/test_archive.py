@@ -0,0 +1,103 @@
+import os
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from app.archive import MANIFEST, ArchiveReader, ArchiveWriter, remap_id
+from app.processing.dedup import MinHasher
+from app.vectors import encode_vector
+
+CREATED = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+DATASET = {'name': 'docs', 'description': None, 'domainname': 'example.com', 'metatag1name': None,
+           'metatag2name': None, 'chunksize': 500, 'chunkoverlap': 50, 'coarsedimensions': None,
+           'coarsequantization': None, 'rerankfactor': None, 'status': 'ready', 'embeddingmodel': 'model'}
+
+
+def _page(page_id, status='ready', minhash=None, duplicateof=None):
+    return {'id': page_id, 'url': 'https://example.com/', 'normalizedurl': 'https://example.com/',
+            'title': 'Заголовок', 'cleantext': 'Текст страницы', 'wordcount': 2, 'status': status,
+            'errormessage': None, 'etag': None, 'lastmodified': None, 'contenthash': 'hash',
+            'minhash': minhash, 'duplicateof': duplicateof, 'createdat': CREATED, 'updatedat': CREATED}
+
+
+def _chunk(chunk_id, page_id, embedding, status='ready', canonicalid=None):
+    return {'id': chunk_id, 'pageid': page_id, 'text': 'Текст', 'summary': None, 'contextretrieval': None,
+            'domainmeta1': None, 'domainmeta2': None, 'tokencount': 1, 'contenthash': 'hash', 'minhash': None,
+            'canonicalid': canonicalid, 'status': status, 'createdat': CREATED,
+            'embedding': None if embedding is None else encode_vector(embedding)}
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_round_trip(tmp_path, compress):
+    hasher = MinHasher(num_perm=16, bands=4)
+    signature = hasher.signature("some words on the page to hash")
+    source_pages = [uuid.uuid4(), uuid.uuid4()]
+    source_chunks = [uuid.uuid4() for _ in range(3)]
+
+    writer = ArchiveWriter(str(tmp_path), compress=compress)
+    writer.write_pages([_page(source_pages[0], minhash=signature),
+                        _page(source_pages[1], status='processing', duplicateof=source_pages[0])])
+    writer.begin_embeddings(2, 3)
+    writer.write_chunks([_chunk(source_chunks[0], source_pages[0], [1.0, 2.0, 3.0]),
+                         _chunk(source_chunks[1], source_pages[0], None, status='enriching')])
+    writer.write_chunks([_chunk(source_chunks[2], source_pages[0], [4.0, 5.0, 6.0],
+                                canonicalid=source_chunks[0])])
+    writer.close(DATASET, 'source')
+
+    reader = ArchiveReader(str(tmp_path))
+    assert reader.dataset == DATASET
+    assert reader.counts == {'pages': 2, 'chunks': 3, 'embeddings': 2}
+    dataset_id = uuid.uuid4()
+
+    batches = list(reader.pages(dataset_id, batch_size=1, hasher=hasher))
+    assert len(batches) == 2
+    (first,), bands = batches[0]
+    assert first[0] == remap_id(dataset_id, str(source_pages[0]))
+    assert first[4] == 'Заголовок' and first[12] == signature and first[13] == CREATED
+    assert bands == [(first[0], key) for key in hasher.band_keys(signature)]
+    (second,), _ = batches[1]
+    assert second[7] == 'pending' and second[15] is not None
+
+    rows = [row for batch, _ in reader.chunks(dataset_id, batch_size=2) for row in batch]
+    assert [row[0] for row in rows] == [remap_id(dataset_id, str(chunk_id)) for chunk_id in source_chunks]
+    assert rows[0][8] == encode_vector([1.0, 2.0, 3.0])
+    assert rows[1][8] is None and rows[1][12] == 'created'
+    assert rows[2][8] == encode_vector([4.0, 5.0, 6.0])
+
+    assert list(reader.links('page', dataset_id, 10)) == [[(second[0], first[0])]]
+    assert list(reader.links('chunk', dataset_id, 10)) == [[(rows[2][0], rows[0][0])]]
+    assert np.load(os.path.join(str(tmp_path), 'embeddings.npy')).dtype == np.dtype('<f4')
+
+
+def test_archive_without_embeddings(tmp_path):
+    writer = ArchiveWriter(str(tmp_path))
+    writer.write_chunks([_chunk(uuid.uuid4(), uuid.uuid4(), None)])
+    writer.close(DATASET, 'source')
+    reader = ArchiveReader(str(tmp_path))
+    rows = [row for batch, _ in reader.chunks(uuid.uuid4(), batch_size=10) for row in batch]
+    assert len(rows) == 1 and rows[0][8] is None
+
+
+def test_writer_refuses_an_existing_archive(tmp_path):
+    ArchiveWriter(str(tmp_path)).close(DATASET, 'source')
+    with pytest.raises(FileExistsError):
+        ArchiveWriter(str(tmp_path))
+
+
+def test_embedding_count_is_checked(tmp_path):
+    writer = ArchiveWriter(str(tmp_path))
+    writer.begin_embeddings(2, 3)
+    writer.write_chunks([_chunk(uuid.uuid4(), uuid.uuid4(), [1.0, 2.0, 3.0])])
+    with pytest.raises(ValueError):
+        writer.close(DATASET, 'source')
+    assert not os.path.exists(os.path.join(str(tmp_path), MANIFEST))
+
+
+def test_dimension_mismatch(tmp_path):
+    writer = ArchiveWriter(str(tmp_path))
+    writer.begin_embeddings(2, 3)
+    with pytest.raises(ValueError):
+        writer.write_chunks([_chunk(uuid.uuid4(), uuid.uuid4(), [1.0, 2.0])])
+    writer.abort()
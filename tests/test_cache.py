@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from app.processing.cache import MemoryCache, SQLiteCache, create_cache, make_key
+
+
+def test_make_key():
+    key = make_key('model', 'prompt', 'text')
+    assert len(key) == 64
+    assert key == make_key('model', 'prompt', 'text')
+    assert key != make_key('model', '', 'prompt text')
+    # Parts are separated, so moving text across the boundary changes the key
+    assert make_key('model', 'ab', 'c') != make_key('model', 'a', 'bc')
+
+
+def test_memory_cache_lru_eviction():
+    cache = MemoryCache(max_bytes=10)
+    cache.set('a', b'1234')
+    cache.set('b', b'1234')
+    assert cache.get('a') == b'1234'
+    cache.set('c', b'1234')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1234' and cache.get('c') == b'1234'
+    assert cache.size() == 8
+    assert cache.stats() == {"hits": 3, "misses": 1, "bytes": 8}
+
+
+def test_memory_cache_replace():
+    cache = MemoryCache(max_bytes=100)
+    cache.set('a', b'12345')
+    cache.set('a', b'12')
+    assert cache.size() == 2
+    assert cache.get_many(['a', 'b']) == [b'12', None]
+
+
+def test_sqlite_cache_persists(tmp_path):
+    path = str(tmp_path / 'cache' / 'cache.sqlite')
+    cache = SQLiteCache(path=path, max_bytes=1000)
+    assert cache.blocking
+    cache.set_many([('a', b'one'), ('b', b'two')])
+    cache.set('a', b'three')
+    cache.close()
+
+    cache = SQLiteCache(path=path, max_bytes=1000)
+    assert cache.get_many(['a', 'b', 'c']) == [b'three', b'two', None]
+    assert cache.size() == 8
+    cache.close()
+
+
+def test_sqlite_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('app.processing.cache.time.time', lambda: now[0])
+
+    cache = SQLiteCache(path=str(tmp_path / 'cache.sqlite'), max_bytes=100)
+    for key in 'abcd':
+        now[0] += 1
+        cache.set(key, b'x' * 25)
+    now[0] += 1
+    assert cache.get('a') is not None
+    now[0] += 1
+    cache.set('e', b'x' * 25)
+    # Trimmed to 90 bytes: the two oldest untouched entries go
+    assert cache.get_many(['a', 'b', 'c', 'd', 'e']) == [b'x' * 25, None, None, b'x' * 25, b'x' * 25]
+    assert cache.size() == 75
+    cache.close()
+
+
+def test_sqlite_cache_from_threads(tmp_path):
+    cache = SQLiteCache(path=str(tmp_path / 'cache.sqlite'), max_bytes=10 ** 6)
+
+    async def scenario():
+        await asyncio.gather(*(asyncio.to_thread(cache.set, f'key{i}', b'value') for i in range(50)))
+        return await asyncio.to_thread(cache.get_many, [f'key{i}' for i in range(50)])
+
+    assert asyncio.run(scenario()) == [b'value'] * 50
+    cache.close()
+
+
+def test_create_cache():
+    assert isinstance(create_cache('memory'), MemoryCache)
+    assert create_cache('none') is None
+    with pytest.raises(ValueError):
+        create_cache('redis')
@@ -0,0 +1,94 @@
+import gzip
+
+from app.processing.crawler import BloomFilter, Frontier, UrlSet, extract_links, parse_sitemap, url_filter
+from app.processing.urls import normalize_url
+
+
+def test_normalize_url():
+    assert normalize_url(" HTTPS://Example.COM:443/Path?b=2&utm_source=x&a=1&fbclid=y#top ") == \
+        "https://example.com/Path?a=1&b=2"
+    assert normalize_url("http://example.com") == "http://example.com/"
+    assert normalize_url("http://example.com:8080/?q=") == "http://example.com:8080/?q="
+
+
+def test_url_set():
+    urls = UrlSet()
+    urls.add("https://example.com/a")
+    assert "https://example.com/a" in urls
+    assert "https://example.com/b" not in urls
+    assert len(urls) == 1
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    added = [f"https://example.com/page/{i}" for i in range(1000)]
+    for url in added:
+        bloom.add(url)
+    assert all(url in bloom for url in added)
+    false_positives = sum(f"https://example.org/other/{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+    assert len(bloom) == 1000
+
+
+def test_url_filter(monkeypatch):
+    monkeypatch.setattr('app.config.Config.CRAWL_EXACT_DEDUP_LIMIT', 100)
+    assert isinstance(url_filter(100), UrlSet)
+    assert isinstance(url_filter(101), BloomFilter)
+
+
+def test_frontier_rotates_hosts():
+    frontier = Frontier(max_size=10)
+    for url in ("https://a.com/1", "https://a.com/2", "https://a.com/3", "https://b.com/1"):
+        frontier.push(url, depth=1)
+    popped = [frontier.pop()[0] for _ in range(4)]
+    assert popped == ["https://a.com/1", "https://b.com/1", "https://a.com/2", "https://a.com/3"]
+    assert frontier.pop() is None
+
+
+def test_frontier_orders_by_depth_then_priority():
+    frontier = Frontier()
+    frontier.push("https://a.com/deep", depth=2, priority=1.0)
+    frontier.push("https://a.com/low", depth=1, priority=0.1)
+    frontier.push("https://a.com/high", depth=1, priority=0.9)
+    assert [frontier.pop() for _ in range(3)] == [
+        ("https://a.com/high", 1), ("https://a.com/low", 1), ("https://a.com/deep", 2)
+    ]
+
+
+def test_frontier_is_bounded():
+    frontier = Frontier(max_size=2)
+    assert frontier.push("https://a.com/1", 0)
+    assert frontier.push("https://b.com/1", 0)
+    assert frontier.full()
+    assert not frontier.push("https://c.com/1", 0)
+    assert len(frontier) == 2
+
+
+def test_parse_sitemap():
+    urlset = (b'<?xml version="1.0"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+              b'<url><loc>https://a.com/1</loc><priority>0.8</priority></url>'
+              b'<url><loc> https://a.com/2 </loc><priority>high</priority></url></urlset>')
+    assert parse_sitemap(urlset) == ([("https://a.com/1", 0.8), ("https://a.com/2", 0.5)], [])
+    assert parse_sitemap(gzip.compress(urlset)) == parse_sitemap(urlset)
+
+    index = (b'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+             b'<sitemap><loc>https://a.com/s1.xml</loc></sitemap></sitemapindex>')
+    assert parse_sitemap(index) == ([], ["https://a.com/s1.xml"])
+    assert parse_sitemap(b"https://a.com/1\nhttps://a.com/2\n") == ([("https://a.com/1", 0.5),
+                                                                       ("https://a.com/2", 0.5)], [])
+
+
+def test_parse_sitemap_stops_at_max_bytes():
+    urls = b''.join(b'<url><loc>https://a.com/%d</loc></url>' % i for i in range(10000))
+    data = gzip.compress(b'<urlset>' + urls + b'</urlset>')
+    pages, _ = parse_sitemap(data, max_bytes=4096)
+    assert len(pages) < 10000
+
+
+def test_extract_links():
+    html = ('<html><head><base href="https://a.com/docs/"></head><body>'
+            '<a href="page">1</a><a href="/root">2</a><a href="https://b.com/x" rel="nofollow">3</a>'
+            '<a>4</a></body></html>')
+    assert extract_links(html, "https://a.com/") == ["https://a.com/docs/page", "https://a.com/root"]
+    assert extract_links('<meta name="robots" content="noindex, nofollow"><a href="/x">x</a>',
+                         "https://a.com/") == []
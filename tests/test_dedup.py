@@ -0,0 +1,58 @@
+import pytest
+
+from app.processing.dedup import MinHasher, find_duplicates, shingles
+
+TEXT = ("Near-duplicate detection estimates the Jaccard similarity of word shingles with MinHash "
+        "and finds candidates through locality-sensitive hashing over signature bands")
+
+
+def test_shingles():
+    assert shingles("One two three four", size=2) == {"one two", "two three", "three four"}
+    assert shingles("Short text", size=5) == {"short text"}
+    assert shingles("  ...  ", size=5) == set()
+
+
+def test_signature_is_deterministic():
+    first, second = MinHasher(num_perm=64, bands=16), MinHasher(num_perm=64, bands=16)
+    signature = first.signature(TEXT)
+    assert len(signature) == 64 * 4
+    assert second.signature(TEXT) == signature
+    assert first.signature("") is None
+
+
+def test_similarity():
+    hasher = MinHasher(num_perm=128, bands=32, shingle_size=3)
+    signature = hasher.signature(TEXT)
+    assert hasher.similarity(signature, signature) == 1.0
+    assert hasher.similarity(signature, hasher.signature(TEXT + " in a dataset")) > 0.7
+    assert hasher.similarity(signature, hasher.signature("Something else entirely about cooking soup")) < 0.2
+    assert hasher.similarity(signature, None) == 0.0
+
+
+def test_band_keys():
+    hasher = MinHasher(num_perm=64, bands=16)
+    keys = hasher.band_keys(hasher.signature(TEXT))
+    assert [band for band, _ in keys] == list(range(16))
+    assert all(-2 ** 63 <= bucket < 2 ** 63 for _, bucket in keys)
+    assert keys == hasher.band_keys(hasher.signature(TEXT.upper()))
+
+
+def test_num_perm_must_divide_into_bands():
+    with pytest.raises(ValueError):
+        MinHasher(num_perm=10, bands=3)
+
+
+def test_find_duplicates_against_stored():
+    hasher = MinHasher(num_perm=64, bands=16)
+    stored = hasher.signature(TEXT)
+    candidates = [(band, bucket, "stored", stored) for band, bucket in hasher.band_keys(stored)]
+    signatures = [hasher.signature(TEXT), hasher.signature("Unrelated words about the weather today"), None]
+    assert find_duplicates(hasher, signatures, candidates, threshold=0.8) == ["stored", None, None]
+
+
+def test_find_duplicates_within_batch():
+    hasher = MinHasher(num_perm=64, bands=16)
+    other = "A completely different paragraph about gardening and tomatoes"
+    signatures = [hasher.signature(TEXT), hasher.signature(other), hasher.signature(TEXT),
+                  hasher.signature(other)]
+    assert find_duplicates(hasher, signatures, [], threshold=0.8) == [None, None, "#0", "#1"]
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.processing.cache import MemoryCache
+from app.processing.embedder import EmbeddingGenerator
+
+
+class FakeEncoding:
+    def encode(self, text):
+        return text.split()
+
+    def encode_ordinary_batch(self, texts):
+        return [self.encode(text) for text in texts]
+
+
+class FakeLimiter:
+    async def call(self, model, tokens, request):
+        return await request()
+
+
+class FakeEmbeddings:
+    """Embeds a text as [number of words, 1]; any batch containing 'bad' fails."""
+
+    def __init__(self):
+        self.requests = []
+        self.with_raw_response = self
+
+    async def create(self, model, input):
+        self.requests.append(list(input))
+        if any('bad' in text for text in input):
+            raise ValueError("invalid input")
+        data = [SimpleNamespace(index=i, embedding=[float(len(text.split())), 1.0]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=data)
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    monkeypatch.setattr('app.config.Config.OPENAI_API_KEY', 'test')
+
+    def build(**kwargs):
+        generator = EmbeddingGenerator(encoding=FakeEncoding(), limiter=FakeLimiter(), model='test-model',
+                                       **kwargs)
+        generator.client = SimpleNamespace(embeddings=FakeEmbeddings())
+        return generator
+
+    return build
+
+
+def test_pack_batches_by_count_and_tokens(generator):
+    embedder = generator(batch_size=3, batch_tokens=10, cache=MemoryCache())
+    assert embedder._pack_batches(['a'] * 7, [1] * 7) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert embedder._pack_batches(['a'] * 4, [4, 4, 4, 9]) == [[0, 1], [2], [3]]
+    # An oversized text still gets a request of its own
+    assert embedder._pack_batches(['a'] * 2, [50, 1]) == [[0], [1]]
+
+
+def test_pack_batches_counts_tokens_itself(generator):
+    embedder = generator(batch_size=10, batch_tokens=4, cache=MemoryCache())
+    assert embedder._pack_batches(['one two', 'three four', 'five']) == [[0, 1], [2]]
+
+
+def test_batch_embeds_in_one_request(generator):
+    embedder = generator(batch_size=10, batch_tokens=100, cache=MemoryCache())
+    embeddings = asyncio.run(embedder.generate_embeddings_batch(['one', 'one two', 'one two three']))
+    assert embeddings == [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0]]
+    assert len(embedder.client.embeddings.requests) == 1
+
+
+def test_failed_batch_is_split_until_the_bad_input(generator):
+    embedder = generator(batch_size=10, batch_tokens=100, cache=MemoryCache())
+    texts = ['one', 'one two', 'bad', 'one two three']
+    embeddings = asyncio.run(embedder.generate_embeddings_batch(texts))
+    assert embeddings == [[1.0, 1.0], [2.0, 1.0], None, [3.0, 1.0]]
+    requests = embedder.client.embeddings.requests
+    assert requests[0] == texts
+    assert ['bad'] in requests
+    assert max(len(request) for request in requests[1:]) == 2
+
+
+def test_cached_embeddings_skip_the_api(generator):
+    embedder = generator(batch_size=10, batch_tokens=100, cache=MemoryCache())
+    asyncio.run(embedder.generate_embeddings_batch(['one', 'bad']))
+    embedder.client.embeddings.requests.clear()
+    embeddings = asyncio.run(embedder.generate_embeddings_batch(['one', 'one two', 'bad']))
+    assert embeddings == [[1.0, 1.0], [2.0, 1.0], None]
+    # Failures are not cached and are retried
+    assert embedder.client.embeddings.requests[0] == ['one two', 'bad']
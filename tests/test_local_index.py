@@ -0,0 +1,149 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from app.search.local_index import LocalVectorIndex
+
+START = datetime(2024, 5, 1, tzinfo=timezone.utc)
+
+
+class FakeDatabase:
+    """The DatabaseManager calls LocalVectorIndex makes, over an in-memory chunk list."""
+
+    def __init__(self, version=1):
+        self.version = version
+        self.chunks = []
+
+    def add(self, embedding, seconds, version=None):
+        chunk_id = uuid.uuid4()
+        self.chunks.append({'id': chunk_id, 'createdat': START + timedelta(seconds=seconds),
+                            'embedding': embedding, 'version': version or self.version})
+        return str(chunk_id)
+
+    def delete(self, chunk_id):
+        self.chunks = [chunk for chunk in self.chunks if str(chunk['id']) != chunk_id]
+
+    def _live(self, version):
+        return [chunk for chunk in self.chunks if chunk['version'] == (version or self.version)]
+
+    async def get_search_settings(self, dataset_id):
+        return {'chunkversion': self.version}
+
+    async def iter_chunk_embeddings(self, dataset_id, after=None, version=None):
+        for chunk in sorted(self._live(version), key=lambda chunk: (chunk['createdat'], chunk['id'])):
+            if after is None or (chunk['createdat'], chunk['id']) > after:
+                yield chunk
+
+    async def iter_chunk_ids(self, dataset_id, version=None):
+        for chunk in self._live(version):
+            yield chunk['id']
+
+    async def get_chunks_by_ids(self, chunk_ids):
+        live = {str(chunk['id']) for chunk in self.chunks}
+        return {chunk_id: {'id': chunk_id} for chunk_id in chunk_ids if chunk_id in live}
+
+
+def _index(tmp_path, **kwargs):
+    return LocalVectorIndex(str(tmp_path), 'dataset', **kwargs)
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16', 'int8'])
+def test_append_and_top_k(tmp_path, dtype):
+    index = _index(tmp_path, dtype=dtype)
+    ids = [uuid.uuid4() for _ in range(3)]
+    index.append(ids, np.array([[1, 0, 0], [0, 1, 0], [1, 1, 0]]), [START] * 3, (START, ids[-1]))
+    index._open()
+    assert len(index) == 3
+    results = index.top_k([1, 0.1, 0], k=2)
+    assert [chunk_id for chunk_id, _ in results] == [str(ids[0]), str(ids[2])]
+    assert results[0][1] == pytest.approx(0.995, abs=0.01)
+
+    reopened = _index(tmp_path)
+    assert reopened.meta['dtype'] == dtype
+    assert reopened.top_k([0, 1, 0], k=1)[0][0] == str(ids[1])
+
+
+def test_dimension_and_dtype_mismatch(tmp_path):
+    index = _index(tmp_path)
+    index.append([uuid.uuid4()], np.ones((1, 3)), [START], (START, uuid.uuid4()))
+    with pytest.raises(ValueError):
+        index.append([uuid.uuid4()], np.ones((1, 4)), [START], (START, uuid.uuid4()))
+    with pytest.raises(ValueError):
+        _index(tmp_path, dtype='int8')
+
+
+def test_interrupted_append_is_truncated(tmp_path):
+    index = _index(tmp_path)
+    index.append([uuid.uuid4()], np.ones((1, 3)), [START], (START, uuid.uuid4()))
+    with open(index._file('vectors.bin'), 'ab') as f:
+        f.write(b'\0' * 7)
+    assert _index(tmp_path).vectors.shape == (1, 3)
+
+
+def test_sync_is_incremental(tmp_path):
+    db = FakeDatabase()
+    first = db.add([1, 0], 0)
+    index = _index(tmp_path)
+    assert asyncio.run(index.sync(db)) == 1
+    second = db.add([0, 1], 10)
+    assert asyncio.run(index.sync(db)) == 1
+    assert asyncio.run(index.sync(db)) == 0
+    assert [chunk_id for chunk_id, _ in index.top_k([1, 1], k=5)] in ([first, second], [second, first])
+
+
+def test_sync_picks_up_late_commits_within_the_rescan_window(tmp_path):
+    db = FakeDatabase()
+    db.add([1, 0], 100)
+    index = _index(tmp_path, rescan_seconds=60)
+    asyncio.run(index.sync(db))
+    # Committed after the sync, with a createdat before its watermark
+    late = db.add([0, 1], 50)
+    assert asyncio.run(index.sync(db)) == 1
+    assert index.top_k([0, 1], k=1)[0][0] == late
+    db.add([0, 1], 10)
+    assert asyncio.run(index.sync(db)) == 0
+
+
+def test_deleted_chunks_are_masked_then_rebuilt(tmp_path):
+    db = FakeDatabase()
+    ids = [db.add([1, i / 10], i) for i in range(10)]
+    index = _index(tmp_path, rebuild_ratio=0.2)
+    asyncio.run(index.sync(db))
+
+    db.delete(ids[0])
+    db.delete(ids[1])
+    assert asyncio.run(index.sync(db)) == 0
+    assert len(index) == 10
+    assert {chunk_id for chunk_id, _ in index.top_k([1, 0], k=10)} == set(ids[2:])
+    assert _index(tmp_path).deleted.sum() == 2
+
+    db.delete(ids[2])
+    assert asyncio.run(index.sync(db)) == 7
+    assert len(index) == 7
+
+
+def test_chunk_version_switch_rebuilds(tmp_path):
+    db = FakeDatabase(version=1)
+    db.add([1, 0], 0)
+    index = _index(tmp_path)
+    asyncio.run(index.sync(db))
+    db.version = 2
+    fresh = db.add([0, 1], 5)
+    assert asyncio.run(index.sync(db)) == 1
+    assert len(index) == 1 and index.meta['chunkversion'] == 2
+    assert index.top_k([1, 0], k=5)[0][0] == fresh
+
+
+def test_search_skips_chunks_deleted_since_sync(tmp_path):
+    db = FakeDatabase()
+    ids = [db.add([1, i / 10], i) for i in range(6)]
+    index = _index(tmp_path)
+    asyncio.run(index.sync(db))
+    for chunk_id in ids[:3]:
+        db.delete(chunk_id)
+    results = asyncio.run(index.search(db, [1, 0], limit=2))
+    assert [row['id'] for row in results] == ids[3:5]
+    assert len(asyncio.run(index.search(db, [1, 0], limit=10))) == 3
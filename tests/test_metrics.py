@@ -0,0 +1,65 @@
+import pytest
+
+from app.metrics import Histogram, MetricsRegistry
+
+
+def test_histogram_quantiles():
+    histogram = Histogram(buckets=(1, 2, 4))
+    assert histogram.quantile(0.5) == 0.0
+    for value in (0.5, 1.5, 1.5, 3, 100):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.quantile(0.2) == pytest.approx(1.0)
+    assert histogram.quantile(0.4) == pytest.approx(1.5)
+    assert histogram.quantile(0.7) == pytest.approx(3.0)
+    # Values past the last bucket report its upper bound
+    assert histogram.quantile(1.0) == 4
+    assert histogram.cumulative_counts() == [1, 3, 4, 5]
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 5 and snapshot["sum"] == pytest.approx(106.5)
+
+
+def test_render_prometheus():
+    registry = MetricsRegistry(prefix='test')
+    pages = registry.counter("pages_total", "Pages processed", ["status"])
+    pages.labels(status='ok').inc(3)
+    pages.labels(status='say "hi"\n').inc()
+    registry.gauge("queue_size", "Queued pages").set(2.5)
+    registry.histogram("latency_seconds", "Latency", ["stage"], buckets=(0.1, 1)).labels(stage='fetch').observe(0.5)
+    registry.counter("unused_total", "Never incremented")
+
+    assert registry.render_prometheus().splitlines() == [
+        '# HELP test_pages_total Pages processed',
+        '# TYPE test_pages_total counter',
+        'test_pages_total{status="ok"} 3',
+        'test_pages_total{status="say \\"hi\\"\\n"} 1',
+        '# HELP test_queue_size Queued pages',
+        '# TYPE test_queue_size gauge',
+        'test_queue_size 2.5',
+        '# HELP test_latency_seconds Latency',
+        '# TYPE test_latency_seconds histogram',
+        'test_latency_seconds_bucket{stage="fetch",le="0.1"} 0',
+        'test_latency_seconds_bucket{stage="fetch",le="1"} 1',
+        'test_latency_seconds_bucket{stage="fetch",le="+Inf"} 1',
+        'test_latency_seconds_sum{stage="fetch"} 0.5',
+        'test_latency_seconds_count{stage="fetch"} 1',
+        '# HELP test_unused_total Never incremented',
+        '# TYPE test_unused_total counter',
+    ]
+
+
+def test_registering_twice_returns_the_same_metric():
+    registry = MetricsRegistry()
+    assert registry.counter("pages_total", "Pages") is registry.counter("pages_total", "Pages")
+    assert "strage_pages_total" in registry.metrics
+
+
+def test_gauge_function_and_summary():
+    registry = MetricsRegistry(prefix='')
+    queue = []
+    registry.gauge("queue_size", "Queued").labels().set_function(lambda: len(queue))
+    queue.extend([1, 2])
+    in_flight = registry.gauge("in_flight", "In flight", ["stage"])
+    with in_flight.labels(stage='embed').track():
+        assert registry.summary()["in_flight"] == {"stage=embed": 1}
+    assert registry.summary() == {"queue_size": {"": 2}, "in_flight": {"stage=embed": 0}}
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from app.processing import ratelimit
+from app.processing.ratelimit import ModelLimiter, TokenBucket, parse_reset
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, 'monotonic', clock)
+    return clock
+
+
+def test_parse_reset():
+    assert parse_reset("20ms") == pytest.approx(0.02)
+    assert parse_reset("6m0s") == 360
+    assert parse_reset("1.5") == 1.5
+    assert parse_reset("soon") is None
+    assert parse_reset(None) is None
+
+
+def test_token_bucket_delay(clock):
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.delay_for(60) == 0
+    bucket.consume(60)
+    assert bucket.delay_for(1) == pytest.approx(1.0)
+    clock.now += 0.5
+    assert bucket.delay_for(1) == pytest.approx(0.5)
+    clock.now += 120
+    assert bucket.available == pytest.approx(0.5)
+    assert bucket.delay_for(1) == 0
+    assert bucket.available == 60
+
+
+def test_token_bucket_capacity(clock):
+    bucket = TokenBucket(per_minute=600, capacity=5)
+    assert bucket.available == 5
+    # Requests larger than the burst wait for a full bucket instead of forever
+    assert bucket.delay_for(50) == 0
+    bucket.consume(50)
+    assert bucket.available == 0
+    assert bucket.delay_for(5) == pytest.approx(0.5)
+
+
+def test_token_bucket_clamp(clock):
+    bucket = TokenBucket(per_minute=60)
+    bucket.clamp(3)
+    assert bucket.delay_for(5) == pytest.approx(2.0)
+
+
+def test_concurrency_grows_after_successes():
+    async def scenario():
+        limiter = ModelLimiter('model', rpm=10000, tpm=10 ** 7, max_concurrency=4)
+        assert limiter.limit == 2
+        for _ in range(2):
+            await limiter.acquire(1)
+            await limiter.release()
+        assert limiter.limit == 3
+        for _ in range(3):
+            await limiter.acquire(1)
+            await limiter.release()
+        assert limiter.limit == 4
+        for _ in range(8):
+            await limiter.acquire(1)
+            await limiter.release()
+        assert limiter.limit == 4
+        assert limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_concurrency_halves_on_throttling():
+    async def scenario():
+        limiter = ModelLimiter('model', rpm=10000, tpm=10 ** 7, max_concurrency=16)
+        await limiter.acquire(1)
+        await limiter.release(throttled=True)
+        assert limiter.limit == 4
+        await limiter.acquire(1)
+        await limiter.release(succeeded=False)
+        assert limiter.limit == 4 and limiter.successes == 0
+        for _ in range(3):
+            await limiter.acquire(1)
+            await limiter.release(throttled=True)
+        assert limiter.limit == 1
+
+    asyncio.run(scenario())
+
+
+def test_acquire_waits_for_a_free_slot():
+    async def scenario():
+        limiter = ModelLimiter('model', rpm=10000, tpm=10 ** 7, max_concurrency=2)
+        await limiter.acquire(1)
+        waiter = asyncio.ensure_future(limiter.acquire(1))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        await limiter.release()
+        await asyncio.wait_for(waiter, 1)
+        assert limiter.in_flight == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_acquire_releases_its_slot():
+    async def scenario():
+        limiter = ModelLimiter('model', rpm=10000, tpm=10 ** 7, max_concurrency=2)
+        limiter.pause(60)
+        waiter = asyncio.ensure_future(limiter.acquire(1))
+        await asyncio.sleep(0.01)
+        assert limiter.in_flight == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.in_flight == 0
+        return limiter
+
+    limiter = asyncio.run(scenario())
+
+    async def reuse():
+        # A second event loop gets a fresh condition
+        limiter.paused_until = 0
+        await limiter.acquire(1)
+        await limiter.release()
+
+    asyncio.run(reuse())
+    assert limiter.in_flight == 0
+
+
+def test_update_from_headers_pauses(clock):
+    limiter = ModelLimiter('model', rpm=100, tpm=1000, max_concurrency=2)
+    limiter.update_from_headers({'x-ratelimit-remaining-requests': '0', 'x-ratelimit-reset-requests': '2s',
+                                 'x-ratelimit-remaining-tokens': '10'})
+    assert limiter.paused_until == clock.now + 2
+    assert limiter.tokens.available == 10
@@ -0,0 +1,78 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from app.rawstore import BlobRawStore, PostgresRawStore, RawContentStore, create_raw_store, raw_hash
+
+HTML = "<html><body><p>Привет, мир</p>" + "<div>повтор</div>" * 200 + "</body></html>"
+
+
+class FakeConnection:
+    """Answers collect_garbage's reference lookup from a set of hashes pages point at."""
+
+    def __init__(self, referenced=()):
+        self.referenced = set(referenced)
+
+    async def fetch(self, query, hashes):
+        return [{'rawhash': rawhash} for rawhash in hashes if rawhash in self.referenced]
+
+
+def _age(store, rawhash, seconds):
+    past = time.time() - seconds
+    os.utime(store._path(rawhash), (past, past))
+
+
+def test_compress_round_trip():
+    store = PostgresRawStore()
+    data = store.compress(HTML)
+    assert len(data) < len(HTML.encode('utf-8'))
+    assert store.decompress(data) == HTML
+
+
+def test_raw_content_store_is_abstract():
+    with pytest.raises(TypeError):
+        RawContentStore()
+
+
+def test_blob_round_trip(tmp_path):
+    store = BlobRawStore(directory=str(tmp_path))
+    rawhash = asyncio.run(store.put(None, HTML))
+    assert rawhash == raw_hash(HTML)
+    assert os.path.exists(tmp_path / rawhash[:2] / (rawhash + '.zst'))
+    assert asyncio.run(store.get(None, rawhash)) == HTML
+    assert asyncio.run(store.get(None, raw_hash("missing"))) is None
+    # Identical content is stored once
+    assert asyncio.run(store.put(None, HTML)) == rawhash
+    assert asyncio.run(store.hashes(None)) == [rawhash]
+
+
+def test_blob_garbage_collection(tmp_path):
+    store = BlobRawStore(directory=str(tmp_path))
+    kept, orphan, recent = (asyncio.run(store.put(None, html)) for html in (HTML, "<p>orphan</p>", "<p>new</p>"))
+    _age(store, kept, 7200)
+    _age(store, orphan, 7200)
+
+    removed = asyncio.run(store.collect_garbage(FakeConnection([kept]), batch_size=1, grace=3600))
+    assert removed == 1
+    assert sorted(asyncio.run(store.hashes(None))) == sorted([kept, recent])
+
+
+def test_put_refreshes_an_old_blob(tmp_path):
+    store = BlobRawStore(directory=str(tmp_path))
+    rawhash = asyncio.run(store.put(None, HTML))
+    _age(store, rawhash, 7200)
+    assert asyncio.run(store.hashes(None, older_than=3600)) == [rawhash]
+    asyncio.run(store.put(None, HTML))
+    assert asyncio.run(store.hashes(None, older_than=3600)) == []
+    # A file touched after it was listed survives the delete
+    asyncio.run(store.delete(None, [rawhash], older_than=3600))
+    assert asyncio.run(store.get(None, rawhash)) == HTML
+
+
+def test_create_raw_store():
+    assert isinstance(create_raw_store('postgres'), PostgresRawStore)
+    assert create_raw_store('inline') is None
+    with pytest.raises(ValueError):
+        create_raw_store('s3')